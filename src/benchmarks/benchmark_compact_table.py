@@ -0,0 +1,86 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import json
+import time
+
+# Load the python libraries
+import pandas as pd
+
+# Import the TRAC runtime library, the plugins and the static API are needed to load schemas outside of a model run
+import tracdap.rt.ext.plugins as trac_plugins
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+
+# Load the TRAC helpers
+import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from benchmarks.synthetic_data import make_mortgage_book_t0
+
+"""
+Compares the memory held by a synthetic mortgage book at t0 when its STRING fields are columns of Python objects and
+its INTEGER fields are 64-bit, as the TRAC runtime hands them to a model, with the same book after CompactTableUtils has
+applied its dtype plan. The time for a groupby over the categorical columns, the main operation the PPNR models run on
+the book, is given for both. FLOAT fields can be held as 32-bit floats as well, to see what that would save.
+
+Run from the root of the repository with:
+    PYTHONPATH=src python src/benchmarks/benchmark_compact_table.py --loans 5000000 --float32 balance monthly_repayment
+"""
+
+
+def time_groupby(data: pd.DataFrame, group_columns: tp.List[str]) -> float:
+
+    start = time.perf_counter()
+    data.groupby(group_columns, observed=True, sort=False)[["balance", "monthly_repayment"]].sum()
+
+    return time.perf_counter() - start
+
+
+def run_benchmark(number_of_loans: int, float32_columns: tp.Optional[tp.List[str]] = None) -> tp.Dict[str, tp.Any]:
+    """
+    A function that measures the memory and groupby time of the mortgage book before and after it is made compact.
+    :param number_of_loans: The number of loans in the book.
+    :param float32_columns: FLOAT fields to hold as 32-bit floats.
+    :return: The results.
+    """
+
+    schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+    group_columns = ["region", "mortgage_type"]
+
+    mortgage_book_t0 = make_mortgage_book_t0(number_of_loans)
+
+    object_bytes = CompactTableUtils.memory_usage(mortgage_book_t0)
+    object_column_bytes = mortgage_book_t0.memory_usage(index=False, deep=True)
+    object_seconds = time_groupby(mortgage_book_t0, group_columns)
+
+    start = time.perf_counter()
+    dtype_plan = CompactTableUtils.get_dtype_plan(schema, mortgage_book_t0, float32_columns)
+    mortgage_book_t0 = CompactTableUtils.apply_dtype_plan(mortgage_book_t0, dtype_plan)
+    compact_seconds = time.perf_counter() - start
+
+    compact_bytes = CompactTableUtils.memory_usage(mortgage_book_t0)
+    compact_column_bytes = mortgage_book_t0.memory_usage(index=False, deep=True)
+
+    return {
+        "loans": number_of_loans,
+        "object_bytes": object_bytes,
+        "compact_bytes": compact_bytes,
+        "memory_ratio": round(object_bytes / compact_bytes, 2),
+        "compact_seconds": round(compact_seconds, 3),
+        "object_groupby_seconds": round(object_seconds, 3),
+        "compact_groupby_seconds": round(time_groupby(mortgage_book_t0, group_columns), 3),
+        "bytes_by_column": {column_name: {"dtype": str(dtype), "object": int(object_column_bytes[column_name]), "compact": int(compact_column_bytes[column_name])}
+                            for column_name, dtype in dtype_plan.items()}
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory benchmark for the compact table types")
+    parser.add_argument("--loans", type=int, default=5000000, help="The number of loans in the synthetic book")
+    parser.add_argument("--float32", nargs="*", default=[], help="FLOAT fields to hold as 32-bit floats")
+    arguments = parser.parse_args()
+
+    trac_plugins.PluginManager.register_core_plugins()
+    _trac_static_api.StaticApiImpl.register_impl()
+
+    print(json.dumps(run_benchmark(arguments.loans, arguments.float32), indent=2))
@@ -0,0 +1,322 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import datetime
+import json
+import logging
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import time
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pa_pq
+
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+import tracdap.rt.ext.plugins as trac_plugins
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+import tracdap.rt._version as _trac_version  # noqa
+
+# Load the models and the TRAC helpers
+from ppnr.ppnr_pipeline import PPNR_MODELS
+from ppnr.calculate_ppnr_scenarios import PpnrScenariosModel
+from impairment.impairment_pipeline import IMPAIRMENT_MODELS
+from data_quality.calculate_data_quality_metrics_python import Wrapper as DataQualityModel
+from utils.utils_model_pipeline import ModelPipeline
+from benchmarks.synthetic_data import STORAGE_FORMATS, generate_inputs
+
+"""
+A benchmark harness that runs every model over synthetic data made by synthetic_data.py and records the wall time,
+peak memory and throughput of each one in a JSON results file. Results from different commits can be compared to see
+the effect of a change.
+
+Each model runs on its own, in a fresh process, through the model pipeline. It reads its inputs from the synthetic
+data, or from the outputs saved by the models that ran before it, and saves its outputs for the models after it, so
+the PPNR balance forecast is the one the EAD model reads. For each model the results hold:
+
+    seconds          The time to load the inputs, run the model and save the outputs
+    process_seconds  The time for the whole process, including starting Python and importing the libraries
+    peak_rss_bytes   The peak resident memory of the process, taken from the operating system when it ends
+    input_rows       The number of rows in the inputs
+    output_rows      The number of rows in the outputs
+    rows_per_second  The number of rows read and written per second
+
+Run from the root of the repository with:
+    PYTHONPATH=src python src/benchmarks/benchmark_models.py --loans 1000000 --months 60 --format PARQUET
+
+Then compare a run on another commit with:
+    PYTHONPATH=src python src/benchmarks/benchmark_models.py --loans 1000000 --months 60 --compare <results file>
+"""
+
+# Every model that is benchmarked, keyed by node name, the order they run in is worked out from their inputs
+BENCHMARK_MODELS: tp.Dict[str, tp.Type[trac.TracModel]] = {
+    **PPNR_MODELS,
+    "calculate_ppnr_scenarios": PpnrScenariosModel,
+    **IMPAIRMENT_MODELS,
+    "calculate_data_quality_metrics": DataQualityModel
+}
+
+# Inputs that are read under a different name from the synthetic dataset that supplies them
+INPUT_ALIASES = {"data": "mortgage_book_t0"}
+
+
+def data_folder(number_of_loans: int, number_of_months: int, storage_format: str) -> pathlib.Path:
+
+    return pathlib.Path("data") / "synthetic" / f"{number_of_loans}_loans_{number_of_months}_months_{storage_format.lower()}"
+
+
+def prepare_data(root_path: pathlib.Path, number_of_loans: int, number_of_months: int, storage_format: str, regenerate: bool = False) -> tp.Dict[str, tp.Any]:
+    """
+    A function that generates the synthetic data unless it is already there from an earlier run, and writes a
+    system config for a local storage bucket holding it.
+    :return: The manifest of the synthetic data.
+    """
+
+    log = logging.getLogger(prepare_data.__name__)
+
+    manifest_path = root_path / "manifest.json"
+
+    if manifest_path.exists() and not regenerate:
+        log.info(f"Using the synthetic data in [{root_path}]")
+        manifest = json.loads(manifest_path.read_text())
+    else:
+        log.info(f"Generating synthetic data in [{root_path}]")
+        manifest = generate_inputs(root_path, number_of_loans, number_of_months, storage_format)
+
+    (root_path / "outputs").mkdir(exist_ok=True)
+    (root_path / "logs").mkdir(exist_ok=True)
+
+    (root_path / "sys_config.yaml").write_text(
+        "storage:\n"
+        "  defaultBucket: benchmark_data\n"
+        f"  defaultFormat: {storage_format}\n"
+        "  buckets:\n"
+        "    benchmark_data:\n"
+        "      protocol: LOCAL\n"
+        f"      properties:\n        rootPath: {root_path.resolve()}\n")
+
+    return manifest
+
+
+def model_storage(node_name: str, manifest: tp.Dict[str, tp.Any]) -> tp.Tuple[tp.Dict[str, str], tp.Dict[str, str]]:
+    """
+    A function that works out where a model reads each of its inputs from and where it saves each of its outputs.
+    Outputs are saved in the same format as the synthetic data.
+    :return: The storage paths of the inputs and of the outputs.
+    """
+
+    model = BENCHMARK_MODELS[node_name]()
+    extension = STORAGE_FORMATS[manifest["format"]]
+
+    produced = {output_name for model_class in BENCHMARK_MODELS.values() for output_name in model_class().define_outputs()}
+
+    inputs = {
+        input_name: f"outputs/{input_name}{extension}" if input_name in produced else manifest["datasets"][INPUT_ALIASES.get(input_name, input_name)]
+        for input_name in model.define_inputs()}
+
+    outputs = {output_name: f"outputs/{output_name}{extension}" for output_name in model.define_outputs()}
+
+    return inputs, outputs
+
+
+def model_parameters(node_name: str, manifest: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+    """
+    A function that sets the forecast months of a model to match the synthetic data, every other parameter takes
+    its default value.
+    """
+
+    parameters = BENCHMARK_MODELS[node_name]().define_parameters()
+
+    return {param_name: manifest[param_name] for param_name in ["first_forecast_month", "last_forecast_month"] if param_name in parameters}
+
+
+def count_rows(storage_path: pathlib.Path, storage_format: str) -> int:
+
+    if storage_format == "PARQUET":
+        return pa_pq.ParquetFile(storage_path).metadata.num_rows
+
+    if storage_format == "ARROW_FILE":
+        with pa.memory_map(str(storage_path), "r") as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(batch_index).num_rows for batch_index in range(reader.num_record_batches))
+
+    # A CSV file has a header line, the generated files and the TRAC runtime do not put line breaks inside values
+    with open(storage_path, "rb") as csv_file:
+        return sum(1 for _ in csv_file) - 1
+
+
+def run_worker(root_path: pathlib.Path, node_name: str):
+    """
+    Run one model through the model pipeline and print the time it took as JSON.
+    """
+
+    manifest = json.loads((root_path / "manifest.json").read_text())
+    inputs, outputs = model_storage(node_name, manifest)
+
+    pipeline = ModelPipeline({node_name: BENCHMARK_MODELS[node_name]}, root_path / "sys_config.yaml")
+
+    start = time.perf_counter()
+    pipeline.run({node_name: model_parameters(node_name, manifest)}, inputs, outputs)
+    seconds = time.perf_counter() - start
+
+    print(json.dumps({"seconds": seconds}))
+
+
+def run_model(root_path: pathlib.Path, node_name: str, manifest: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+    """
+    Run one model in a new process and measure it. The peak memory comes from the resource usage the operating system
+    reports for the process when it ends, so it is the peak of that process alone.
+    """
+
+    log_path = root_path / "logs" / f"{node_name}.log"
+
+    start = time.perf_counter()
+
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            [sys.executable, __file__, "--worker", str(root_path), "--node", node_name],
+            stdout=subprocess.PIPE, stderr=log_file)
+
+        stdout = process.stdout.read()
+        _, status, resource_usage = os.wait4(process.pid, 0)
+
+    process_seconds = time.perf_counter() - start
+
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise Exception(f"Model [{node_name}] failed, see [{log_path}] for the error")
+
+    seconds = json.loads(stdout.decode().strip().splitlines()[-1])["seconds"]
+
+    inputs, outputs = model_storage(node_name, manifest)
+    input_rows = sum(count_rows(root_path / storage_path, manifest["format"]) for storage_path in inputs.values())
+    output_rows = sum(count_rows(root_path / storage_path, manifest["format"]) for storage_path in outputs.values())
+
+    return {
+        "seconds": round(seconds, 3),
+        "process_seconds": round(process_seconds, 3),
+        # On Linux the peak resident memory is given in kilobytes
+        "peak_rss_bytes": resource_usage.ru_maxrss * 1024,
+        "input_rows": input_rows,
+        "output_rows": output_rows,
+        "rows_per_second": round((input_rows + output_rows) / seconds) if seconds > 0 else None
+    }
+
+
+def git_commit() -> tp.Dict[str, tp.Any]:
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "uncommitted_changes": None}
+
+    return {"commit": commit, "uncommitted_changes": bool(changes)}
+
+
+def run_benchmark(root_path: pathlib.Path, manifest: tp.Dict[str, tp.Any], node_names: tp.Optional[tp.List[str]] = None) -> tp.Dict[str, tp.Any]:
+    """
+    A function that runs the models one after another and collects the results.
+    :param root_path: The folder holding the synthetic data.
+    :param manifest: The manifest of the synthetic data.
+    :param node_names: The models to run, by default all of them. A model that reads the output of a model that is
+    not run uses the output saved by an earlier run.
+    :return: The results.
+    """
+
+    log = logging.getLogger(run_benchmark.__name__)
+
+    node_order = ModelPipeline(BENCHMARK_MODELS, root_path / "sys_config.yaml").node_order
+
+    results = {
+        **git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(), "tracdap": _trac_version.__version__, "pandas": pd.__version__,
+            "numpy": np.__version__, "pyarrow": pa.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "data": {key: value for key, value in manifest.items() if key not in ("datasets", "rows")},
+        "models": dict()
+    }
+
+    for node_name in node_order:
+
+        if node_names and node_name not in node_names:
+            continue
+
+        log.info(f"Running model [{node_name}]")
+
+        results["models"][node_name] = run_model(root_path, node_name, manifest)
+
+        log.info(f"Model [{node_name}] took {results['models'][node_name]['seconds']}s, "
+                 f"peak RSS {results['models'][node_name]['peak_rss_bytes'] / 2 ** 20:.0f} MB")
+
+    results["total_seconds"] = round(sum(model_results["seconds"] for model_results in results["models"].values()), 3)
+
+    return results
+
+
+def compare_results(baseline: tp.Dict[str, tp.Any], results: tp.Dict[str, tp.Any]) -> pd.DataFrame:
+    """
+    A function that compares two sets of results, model by model. A ratio below 1 means the new results are faster
+    or use less memory.
+    """
+
+    comparison = pd.DataFrame([
+        {"model": node_name,
+         "baseline_seconds": baseline["models"][node_name]["seconds"],
+         "seconds": model_results["seconds"],
+         "seconds_ratio": model_results["seconds"] / baseline["models"][node_name]["seconds"],
+         "baseline_peak_rss_mb": baseline["models"][node_name]["peak_rss_bytes"] / 2 ** 20,
+         "peak_rss_mb": model_results["peak_rss_bytes"] / 2 ** 20,
+         "peak_rss_ratio": model_results["peak_rss_bytes"] / baseline["models"][node_name]["peak_rss_bytes"]}
+        for node_name, model_results in results["models"].items() if node_name in baseline["models"]])
+
+    if baseline["data"] != results["data"]:
+        logging.getLogger(compare_results.__name__).warning("The results were not run on the same synthetic data")
+
+    return comparison.round(3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every model over synthetic data")
+    parser.add_argument("--loans", type=int, default=10000, help="The number of loans in the mortgage book")
+    parser.add_argument("--months", type=int, default=12, help="The number of months in the forecast")
+    parser.add_argument("--format", default="PARQUET", choices=list(STORAGE_FORMATS), help="The format of the synthetic data")
+    parser.add_argument("--models", nargs="+", choices=list(BENCHMARK_MODELS), help="The models to run, by default all of them")
+    parser.add_argument("--regenerate", action="store_true", help="Generate the synthetic data again even if it is already there")
+    parser.add_argument("--results", help="The results file to write, by default results/<commit>.json in the data folder")
+    parser.add_argument("--compare", help="A results file from an earlier run to compare with")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--node", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    trac_plugins.PluginManager.register_core_plugins()
+    _trac_static_api.StaticApiImpl.register_impl()
+
+    if arguments.worker:
+        run_worker(pathlib.Path(arguments.worker), arguments.node)
+        sys.exit(0)
+
+    storage_root = data_folder(arguments.loans, arguments.months, arguments.format)
+    data_manifest = prepare_data(storage_root, arguments.loans, arguments.months, arguments.format, arguments.regenerate)
+
+    benchmark_results = run_benchmark(storage_root, data_manifest, arguments.models)
+
+    results_path = pathlib.Path(arguments.results) if arguments.results else \
+        storage_root / "results" / f"{(benchmark_results['commit'] or 'unknown')[:12]}.json"
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    results_path.write_text(json.dumps(benchmark_results, indent=2))
+
+    print(json.dumps(benchmark_results["models"], indent=2))
+    print(f"Results written to {results_path}")
+
+    if arguments.compare:
+        print(compare_results(json.loads(pathlib.Path(arguments.compare).read_text()), benchmark_results).to_string(index=False))
@@ -0,0 +1,201 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+import tracdap.rt.ext.plugins as trac_plugins
+import tracdap.rt._impl.data as _trac_data  # noqa
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+
+# Load the TRAC helpers
+import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_columnar_storage import ColumnarStorageUtils
+from benchmarks.synthetic_data import make_mortgage_book_t0
+
+"""
+Compares the memory used by several jobs reading the same mortgage book at the same time. The book is written once as
+an Arrow file, then a number of jobs are started together, each running a small model that reads the whole book. With
+the TRAC launcher every job reads its own copy, with the model pipeline every job memory-maps the file and the model's
+dataFrame is built over the mapped pages, so the jobs share one copy through the page cache.
+
+The memory of each job is sampled from /proc while it runs. RSS counts every shared page in full for every process,
+PSS splits each shared page between the processes using it, so the sum of PSS is the memory the jobs actually use.
+
+Run from the root of the repository with:
+    PYTHONPATH=src python src/benchmarks/benchmark_shared_inputs.py --loans 1000000 --jobs 4
+"""
+
+
+class BookSummaryModel(trac.TracModel):
+
+    def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
+        return trac.define_parameters()
+
+    def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+
+        return {"mortgage_book_t0": trac.ModelInputSchema(mortgage_book_t0_schema)}
+
+    def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
+        book_summary_schema = trac.define_output_table(
+            trac.F("region", trac.BasicType.STRING, label="Region", categorical=True),
+            trac.F("balance", trac.BasicType.FLOAT, label="Drawn balance"),
+            trac.F("loans", trac.BasicType.INTEGER, label="Number of loans"))
+
+        return {"book_summary": book_summary_schema}
+
+    def run_model(self, ctx: trac.TracContext):
+
+        mortgage_book_t0 = CompactTableUtils.get_compact_table(ctx, "mortgage_book_t0")
+
+        # Touch every column so that all of the book is paged in
+        book_summary = mortgage_book_t0.groupby("region", observed=True, as_index=False).agg(
+            balance=("balance", "sum"), loans=("id", "count"), valuation=("valuation", "sum"), dtv=("dtv", "max"),
+            monthly_repayment=("monthly_repayment", "sum"), months_in_arrears=("months_in_arrears", "max"),
+            pd_12m=("pd_12m", "mean"), in_default=("in_default", "sum"))
+
+        CompactTableUtils.put_compact_table(ctx, "book_summary", book_summary[["region", "balance", "loans"]])
+
+
+def write_storage(root_path: pathlib.Path, number_of_loans: int):
+    """
+    Write the synthetic mortgage book as a single record batch Arrow file, along with a system config for a local
+    storage bucket holding it and a job config for the TRAC launcher.
+    """
+
+    arrow_schema = _trac_data.DataMapping.trac_to_arrow_schema(SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv"))
+    mortgage_book_t0 = _trac_data.DataMapping.pandas_to_arrow(make_mortgage_book_t0(number_of_loans), arrow_schema)
+
+    (root_path / "inputs").mkdir(parents=True)
+    ColumnarStorageUtils.write_table(str(root_path / "inputs" / "mortgage_book_t0.arrow"), mortgage_book_t0, "ARROW_FILE", rows_per_group=0)
+
+    (root_path / "sys_config.yaml").write_text(
+        "storage:\n"
+        "  defaultBucket: benchmark_data\n"
+        "  defaultFormat: ARROW_FILE\n"
+        "  buckets:\n"
+        "    benchmark_data:\n"
+        "      protocol: LOCAL\n"
+        f"      properties:\n        rootPath: {root_path}\n")
+
+
+def run_worker(root_path: pathlib.Path, job_index: int, shared: bool):
+    """
+    Run the model once, either through the model pipeline or through the TRAC launcher.
+    """
+
+    if shared:
+        from utils.utils_model_pipeline import ModelPipeline
+
+        ModelPipeline({"book_summary": BookSummaryModel}, root_path / "sys_config.yaml").run(
+            dict(), {"mortgage_book_t0": "inputs/mortgage_book_t0.arrow"})
+
+    else:
+        import tracdap.rt.launch as launch
+
+        job_config = root_path / f"job_config_{job_index}.yaml"
+        job_config.write_text(
+            "job:\n"
+            "  runModel:\n"
+            "    inputs:\n"
+            "      mortgage_book_t0: inputs/mortgage_book_t0.arrow\n"
+            "    outputs:\n"
+            f"      book_summary: outputs/book_summary_{job_index}.arrow\n")
+
+        launch.launch_model(BookSummaryModel, job_config, root_path / "sys_config.yaml")
+
+
+def read_memory(process_id: int) -> tp.Optional[tp.Dict[str, int]]:
+
+    try:
+        smaps = pathlib.Path(f"/proc/{process_id}/smaps_rollup").read_text()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    memory = dict()
+
+    for line in smaps.splitlines():
+        name, _, value = line.partition(":")
+        if name in ("Rss", "Pss"):
+            memory[name.lower()] = int(value.split()[0]) * 1024
+
+    return memory
+
+
+def run_jobs(root_path: pathlib.Path, number_of_jobs: int, shared: bool) -> tp.Dict[str, tp.Any]:
+    """
+    Start the jobs together and sample the memory of each one every few milliseconds until they have all finished.
+    """
+
+    start = time.perf_counter()
+
+    jobs = [subprocess.Popen(
+        [sys.executable, __file__, "--worker", str(root_path), "--job-index", str(job_index), "--mode", "shared" if shared else "copied"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for job_index in range(number_of_jobs)]
+
+    peak_rss = [0] * number_of_jobs
+    peak_pss = [0] * number_of_jobs
+    peak_total_pss = 0
+
+    while any(job.poll() is None for job in jobs):
+
+        total_pss = 0
+
+        for job_index, job in enumerate(jobs):
+            memory = read_memory(job.pid) if job.poll() is None else None
+            if memory:
+                peak_rss[job_index] = max(peak_rss[job_index], memory["rss"])
+                peak_pss[job_index] = max(peak_pss[job_index], memory["pss"])
+                total_pss += memory["pss"]
+
+        peak_total_pss = max(peak_total_pss, total_pss)
+        time.sleep(0.005)
+
+    failed = [job_index for job_index, job in enumerate(jobs) if job.returncode != 0]
+    if failed:
+        raise Exception(f"The benchmark jobs {failed} failed, run one with --worker to see the error")
+
+    return {"seconds": round(time.perf_counter() - start, 3), "peak_rss_by_job": peak_rss, "peak_pss_by_job": peak_pss,
+            "sum_of_peak_rss": sum(peak_rss), "sum_of_peak_pss": sum(peak_pss), "peak_combined_pss": peak_total_pss}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory benchmark for jobs sharing a memory-mapped input")
+    parser.add_argument("--loans", type=int, default=1000000, help="The number of loans in the synthetic book")
+    parser.add_argument("--jobs", type=int, default=4, help="The number of jobs to run at the same time")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--job-index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=["shared", "copied"], default="shared", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    trac_plugins.PluginManager.register_core_plugins()
+    _trac_static_api.StaticApiImpl.register_impl()
+
+    if arguments.worker:
+        run_worker(pathlib.Path(arguments.worker), arguments.job_index, arguments.mode == "shared")
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+
+        storage_root = pathlib.Path(temporary_dir)
+        write_storage(storage_root, arguments.loans)
+
+        results = {
+            "loans": arguments.loans,
+            "jobs": arguments.jobs,
+            "file_bytes": (storage_root / "inputs" / "mortgage_book_t0.arrow").stat().st_size,
+            "copied": run_jobs(storage_root, arguments.jobs, shared=False),
+            "shared": run_jobs(storage_root, arguments.jobs, shared=True)
+        }
+
+    print(json.dumps(results, indent=2))
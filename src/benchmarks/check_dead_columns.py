@@ -0,0 +1,226 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import logging
+import pathlib
+import sys
+
+# Load the python libraries
+import pandas as pd
+import pyarrow as pa
+
+# Import the TRAC runtime library
+import tracdap.rt.ext.plugins as trac_plugins
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+
+# Load the models and the TRAC helpers
+from utils.utils_model_pipeline import ModelPipeline
+from benchmarks.benchmark_models import BENCHMARK_MODELS, INPUT_ALIASES, data_folder, prepare_data, model_parameters
+
+"""
+A check that finds the dead columns of every model, the input columns that make no difference to what the model puts
+out. Each column of each input is changed in turn, numbers are scaled and shifted, strings prefixed, booleans flipped
+and dates moved on a month, and the model is run again on synthetic data. A column is used when the change shows up
+in the outputs, or makes the model fail.
+
+The models run with every column in their input schemas, then the columns found to be used are checked against the
+columns each model declares with define_input_columns(). Every column falls in one of these:
+
+    used              The model reads the column and declares it, or declares no columns for the input
+    used, undeclared  The model reads the column but leaves it out of its declaration, so it fails in a pipeline
+    dead, pruned      The model does not need the column and it is not loaded
+    dead, loaded      The model does not need the column but it is still loaded and carried through the model
+
+The models are also run with their declared columns only, which must give the same outputs. The check fails when a
+model needs a column it does not declare or gives different outputs when its inputs are pruned, dead columns that are
+still loaded are reported as findings. A column can also look dead when a model's outputs are unchanged by the change
+made to it, the data quality model only counts the distinct values of a string column, which a prefix leaves alone, so
+findings are read before a column is left out of a declaration.
+
+Run from the root of the repository with:
+    PYTHONPATH=src python src/benchmarks/check_dead_columns.py --loans 2000 --months 12
+"""
+
+USED = "used"
+USED_UNDECLARED = "used, undeclared"
+DEAD_PRUNED = "dead, pruned"
+DEAD_LOADED = "dead, loaded"
+
+
+def perturb_column(column: pa.ChunkedArray) -> pa.Array:
+    """
+    A function that changes every value in a column, keeping its type and its missing values.
+    :param column: The column.
+    :return: The changed column.
+    """
+
+    values = column.to_pandas()
+
+    if pa.types.is_floating(column.type) or pa.types.is_decimal(column.type):
+        values = values * 1.37 + 0.11
+    elif pa.types.is_integer(column.type):
+        values = values + 1
+    elif pa.types.is_boolean(column.type):
+        values = values.map({True: False, False: True})
+    elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        values = "changed_" + values
+    elif pa.types.is_date(column.type):
+        values = (pd.to_datetime(values) + pd.DateOffset(months=1)).dt.date
+    elif pa.types.is_timestamp(column.type):
+        values = pd.to_datetime(values) + pd.DateOffset(months=1)
+    else:
+        raise Exception(f"Cannot change a column of type {column.type}")
+
+    return pa.array(values, type=column.type, from_pandas=True)
+
+
+def outputs_equal(outputs: tp.Dict[str, pa.Table], baseline: tp.Dict[str, pa.Table]) -> bool:
+
+    return outputs.keys() == baseline.keys() and all(
+        outputs[output_name].to_pandas().equals(baseline[output_name].to_pandas()) for output_name in baseline)
+
+
+def run_model(pipeline: ModelPipeline, node_name: str, parameters: tp.Dict[str, tp.Any], inputs: tp.Dict[str, pa.Table]) -> tp.Optional[tp.Dict[str, pa.Table]]:
+    """
+    Run one model on in-memory inputs, a model that fails gives None.
+    """
+
+    try:
+        return pipeline.run({node_name: parameters}, inputs)
+    except Exception:  # noqa
+        return None
+
+
+def check_model(node_name: str, sys_config: pathlib.Path, parameters: tp.Dict[str, tp.Any], inputs: tp.Dict[str, pa.Table]) -> pd.DataFrame:
+    """
+    A function that finds the dead columns of one model.
+    :param node_name: The node name of the model.
+    :param sys_config: The path to the TRAC system config.
+    :param parameters: The model parameters.
+    :param inputs: The model inputs.
+    :return: A row for each input column, with what the model declares for it and whether it is used.
+    """
+
+    log = logging.getLogger(check_model.__name__)
+
+    full_pipeline = ModelPipeline({node_name: BENCHMARK_MODELS[node_name]}, sys_config, prune_columns=False)
+    pruned_pipeline = ModelPipeline({node_name: BENCHMARK_MODELS[node_name]}, sys_config)
+
+    declared_columns = full_pipeline.declared_input_columns(node_name)
+
+    baseline = run_model(full_pipeline, node_name, parameters, inputs)
+
+    if baseline is None:
+        raise Exception(f"Model [{node_name}] fails on the synthetic data")
+
+    pruned_outputs_equal = outputs_equal(run_model(pruned_pipeline, node_name, parameters, inputs) or dict(), baseline)
+
+    if not pruned_outputs_equal:
+        log.error(f"Model [{node_name}] gives different outputs when its inputs are pruned to the declared columns")
+
+    rows = []
+
+    for input_name in inputs:
+
+        table = inputs[input_name]
+        schema_columns = [field.fieldName for field in full_pipeline.dataset_schema(input_name).table.fields]
+
+        for column_name in schema_columns:
+
+            column_index = table.schema.get_field_index(column_name)
+            changed_table = table.set_column(column_index, table.field(column_index), perturb_column(table.column(column_index)))
+
+            changed_outputs = run_model(full_pipeline, node_name, parameters, {**inputs, input_name: changed_table})
+            used = changed_outputs is None or not outputs_equal(changed_outputs, baseline)
+
+            declared = input_name not in declared_columns or column_name in declared_columns[input_name]
+
+            if used:
+                status = USED if declared else USED_UNDECLARED
+            else:
+                status = DEAD_LOADED if declared else DEAD_PRUNED
+
+            rows.append({
+                "model": node_name, "input": input_name, "column": column_name,
+                "declared": input_name in declared_columns and column_name in declared_columns[input_name],
+                "used": used, "status": status, "pruned_outputs_equal": pruned_outputs_equal})
+
+    return pd.DataFrame(rows)
+
+
+def run_check(root_path: pathlib.Path, manifest: tp.Dict[str, tp.Any], node_names: tp.Optional[tp.List[str]] = None) -> pd.DataFrame:
+    """
+    A function that runs every model once to get the inputs of each model, then finds the dead columns model by model.
+    :param root_path: The folder holding the synthetic data.
+    :param manifest: The manifest of the synthetic data.
+    :param node_names: The models to check, by default all of them.
+    :return: A row for each input column of each model.
+    """
+
+    log = logging.getLogger(run_check.__name__)
+
+    sys_config = root_path / "sys_config.yaml"
+    pipeline = ModelPipeline(BENCHMARK_MODELS, sys_config)
+
+    inputs = {input_name: manifest["datasets"][INPUT_ALIASES.get(input_name, input_name)] for input_name in pipeline.required_inputs()}
+    parameters = {node_name: model_parameters(node_name, manifest) for node_name in BENCHMARK_MODELS}
+
+    # Every dataset is kept in memory, the synthetic inputs are loaded once and handed to the models as tables
+    datasets = {input_name: pipeline.load_dataset(input_name, storage_path) for input_name, storage_path in inputs.items()}
+    produced = [output_name for model_class in BENCHMARK_MODELS.values() for output_name in model_class().define_outputs()]
+    datasets.update(pipeline.run(parameters, datasets, keep=produced))
+
+    results = []
+
+    for node_name in pipeline.node_order:
+
+        if node_names and node_name not in node_names:
+            continue
+
+        log.info(f"Checking model [{node_name}]")
+
+        node_inputs = {input_name: datasets[input_name] for input_name in BENCHMARK_MODELS[node_name]().define_inputs()}
+
+        results.append(check_model(node_name, sys_config, parameters[node_name], node_inputs))
+
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the input columns that make no difference to each model")
+    parser.add_argument("--loans", type=int, default=2000, help="The number of loans in the mortgage book")
+    parser.add_argument("--months", type=int, default=12, help="The number of months in the forecast")
+    parser.add_argument("--models", nargs="+", choices=list(BENCHMARK_MODELS), help="The models to check, by default all of them")
+    parser.add_argument("--output", help="A CSV file to write every column to, by default only the findings are printed")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    trac_plugins.PluginManager.register_core_plugins()
+    _trac_static_api.StaticApiImpl.register_impl()
+
+    storage_root = data_folder(arguments.loans, arguments.months, "PARQUET")
+    data_manifest = prepare_data(storage_root, arguments.loans, arguments.months, "PARQUET")
+
+    # The models and the pipeline log every run at info level, only the progress of the check is wanted here
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger(run_check.__name__).setLevel(logging.INFO)
+
+    check_results = run_check(storage_root, data_manifest, arguments.models)
+
+    if arguments.output:
+        check_results.to_csv(arguments.output, index=False)
+
+    summary = check_results.groupby(["model", "status"], sort=False).size().unstack(fill_value=0)
+    findings = check_results[check_results["status"].isin([USED_UNDECLARED, DEAD_LOADED])]
+
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", None):
+        print(summary.to_string())
+        print()
+        print(findings[["model", "input", "column", "status"]].to_string(index=False) if len(findings) else "No dead columns are loaded")
+
+    pruning_failures = check_results.loc[~check_results["pruned_outputs_equal"], "model"].unique()
+
+    if len(pruning_failures) or (check_results["status"] == USED_UNDECLARED).any():
+        print(f"Models that need columns they do not declare: {', '.join(pruning_failures) or 'see above'}")
+        sys.exit(1)
@@ -0,0 +1,402 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import datetime
+import functools
+import json
+import logging
+import pathlib
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pa_pq
+
+# Import the TRAC runtime library, the plugins and the static API are needed to load schemas outside of a model run
+import tracdap.rt.api as trac
+import tracdap.rt.ext.plugins as trac_plugins
+import tracdap.rt._impl.data as _trac_data  # noqa
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+
+# Load the TRAC helpers
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_columnar_storage import COLUMNAR_FORMATS, DEFAULT_ROWS_PER_GROUP
+
+"""
+Synthetic inputs for benchmarking the models at scale, from a few thousand loans and a year of forecast up to tens of
+millions of loans and thirty years. Every dataset is built from its schema in src/ppnr/schemas or
+src/impairment/schemas and conformed to it before it is written, so the files are read by the models exactly as the
+sample data is. The schemas do not list the values of their categorical fields, so these (the regions, sub-regions,
+mortgage types and so on) and the starting levels of the rates and costs are taken from the sample data in
+data/inputs.
+
+The mortgage book is built and written a chunk of loans at a time, each chunk with its own seed, so memory does not
+grow with the size of the book and the same arguments always give the same data.
+
+Generate a book of a million loans with a five year forecast from the root of the repository with:
+    PYTHONPATH=src python src/benchmarks/synthetic_data.py data/synthetic --loans 1000000 --months 60 --format PARQUET
+"""
+
+# The sample data the categorical values and starting levels are taken from
+SAMPLE_INPUTS = pathlib.Path(__file__).parents[2] / "data" / "inputs"
+
+# The date of the book, the same as the sample book, the forecast starts in the month after it
+DEFAULT_T0 = datetime.date(2022, 12, 1)
+
+# The market and economic scenarios start in the same month as the sample scenarios
+HISTORY_START = datetime.date(2005, 1, 1)
+
+# The number of loans built and written at a time
+LOANS_PER_CHUNK = 1000000
+
+# The storage formats that can be written, with their file extensions
+STORAGE_FORMATS = {"CSV": ".csv", **COLUMNAR_FORMATS}
+
+# The share of loans that are 0, 1, 2 and 3 months in arrears, as in the sample book, loans 3 months in arrears are in
+# default
+MONTHS_IN_ARREARS_WEIGHTS = [0.633, 0.206, 0.115, 0.046]
+
+# The monthly growth in mortgage lending in each market scenario, any scenario in the sample that is not listed grows
+# at the base rate
+SCENARIO_LENDING_GROWTH = {"base": 0.005, "downside": 0.001, "upside": 0.008}
+
+# The rate and cost tables are set by year and region, the tables of model parameters and investment income are small
+# and are copied from the sample data as they are
+YEARLY_DATASETS = ["cost_of_funding", "customer_rates", "fees_and_commissions_income", "business_support_costs",
+                   "processing_costs", "sales_and_marketing_costs", "corporate_centre_costs"]
+
+COPIED_DATASETS = {"investment_income": "ppnr", "ead_model_parameters": "impairment", "lgd_model_parameters": "impairment"}
+
+
+def load_schema(dataset_name: str, package: str = "ppnr") -> trac.SchemaDefinition:
+
+    return SchemaRegistry.load_schema(f"{package}.schemas", f"{dataset_name}_schema.csv")
+
+
+def month_start(date: datetime.date, months_after: int = 0) -> datetime.date:
+
+    month_index = date.year * 12 + date.month - 1 + months_after
+
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+@functools.lru_cache()
+def sample_categories(dataset_name: str, package: str = "ppnr") -> tp.Dict[str, np.ndarray]:
+    """
+    A function that finds the values of each categorical STRING field of a schema in the sample data, in the order
+    they first appear.
+    :param dataset_name: The name of the dataset, for example 'mortgage_book_t0'.
+    :param package: The package holding the schema and the folder in data/inputs holding the sample data.
+    :return: The values of each categorical field.
+    """
+
+    sample = pd.read_csv(SAMPLE_INPUTS / package / f"{dataset_name}.csv", dtype=str)
+
+    return {field.fieldName: np.array(sample[field.fieldName].dropna().unique(), dtype=object)
+            for field in load_schema(dataset_name, package).table.fields
+            if field.categorical and field.fieldType == trac.BasicType.STRING}
+
+
+def make_mortgage_book_t0(number_of_loans: int, seed: int = 42, t0: datetime.date = DEFAULT_T0, first_loan: int = 0) -> pd.DataFrame:
+    """
+    A function that makes a synthetic mortgage book at t0 with the columns of mortgage_book_t0_schema.csv, with the
+    STRING fields held as Python objects, as the TRAC runtime hands them to a model. The categorical values are
+    those in the sample book and the numbers follow the same distributions.
+    :param number_of_loans: The number of loans in the book.
+    :param seed: The seed for the random numbers.
+    :param t0: The date of the book.
+    :param first_loan: The number of the first loan, so that a book built in chunks has a unique ID for each loan.
+    :return: The mortgage book.
+    """
+
+    rng = np.random.default_rng(seed)
+    categories = sample_categories("mortgage_book_t0")
+
+    def pick(field_name):
+        return categories[field_name][rng.integers(0, len(categories[field_name]), number_of_loans)]
+
+    valuation = np.round(rng.lognormal(12.8, 0.25, number_of_loans), 4)
+    dtv = np.round(rng.beta(4.0, 6.0, number_of_loans), 9)
+    balance = np.round(valuation * dtv)
+
+    # Each loan has between 5 and 35 years left to run
+    remaining_months = rng.integers(60, 421, number_of_loans)
+    monthly_repayment = np.round(balance / remaining_months * rng.uniform(1.0, 1.6, number_of_loans))
+
+    months_in_arrears = rng.choice(len(MONTHS_IN_ARREARS_WEIGHTS), number_of_loans, p=MONTHS_IN_ARREARS_WEIGHTS)
+    in_default = months_in_arrears == len(MONTHS_IN_ARREARS_WEIGHTS) - 1
+
+    # Loans in default have a PD of 1, the others a small PD skewed towards zero
+    pd_12m = np.where(in_default, 1.0, np.round(np.minimum(rng.lognormal(-8.5, 1.5, number_of_loans), 0.5), 9))
+
+    loan_numbers = np.arange(1007700001 + first_loan, 1007700001 + first_loan + number_of_loans)
+
+    return pd.DataFrame({
+        "id": np.char.add("ID", loan_numbers.astype(str)).astype(object),
+        "date": np.full(number_of_loans, np.datetime64(t0, "ns")),
+        "business_line": pick("business_line"),
+        "product_line": pick("product_line"),
+        "region": pick("region"),
+        "subregion": pick("subregion"),
+        "mortgage_type": pick("mortgage_type"),
+        "valuation": valuation,
+        "dtv": dtv,
+        "balance": balance,
+        "monthly_repayment": monthly_repayment,
+        "months_in_arrears": months_in_arrears,
+        "pd_12m": pd_12m,
+        "in_default": in_default
+    })
+
+
+def make_market_scenario(first_month: datetime.date, last_month: datetime.date, seed: int = 42, lending_growth: float = 0.005) -> pd.DataFrame:
+    """
+    A function that makes a monthly market scenario with the columns of market_scenario_schema.csv. Lending starts at
+    the level of the sample scenario and grows by a random amount each month, the mix of new business moves around
+    the mix in the sample scenario.
+    :param first_month: The first month of the scenario.
+    :param last_month: The last month of the scenario.
+    :param seed: The seed for the random numbers.
+    :param lending_growth: The average monthly growth in mortgage lending.
+    :return: The market scenario.
+    """
+
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(SAMPLE_INPUTS / "ppnr" / "market_scenario.csv").iloc[0]
+
+    observation_date = pd.date_range(first_month, last_month, freq="MS")
+    number_of_months = len(observation_date)
+
+    def mix(*field_names):
+        shares = np.column_stack([sample[field_name] * rng.lognormal(0.0, 0.1, number_of_months) for field_name in field_names])
+        return shares / shares.sum(axis=1, keepdims=True)
+
+    rate_mix = mix("new_business_fixed_rate", "new_business_floating_rate", "new_business_capped_rate")
+    repayment_mix = mix("new_business_interest_only", "new_business_amortising")
+
+    return pd.DataFrame({
+        "observation_date": observation_date,
+        "mortgage_lending_to_households": np.round(sample["mortgage_lending_to_households"] * np.exp(np.cumsum(rng.normal(lending_growth, 0.003, number_of_months)))),
+        "share_of_market": np.round(np.clip(rng.normal(sample["share_of_market"], 0.01, number_of_months), 0.0, 1.0), 4),
+        "new_business_fixed_rate": rate_mix[:, 0],
+        "new_business_floating_rate": rate_mix[:, 1],
+        "new_business_capped_rate": rate_mix[:, 2],
+        "new_business_interest_only": repayment_mix[:, 0],
+        "new_business_amortising": repayment_mix[:, 1]
+    })
+
+
+def make_market_scenarios(first_month: datetime.date, last_month: datetime.date, seed: int = 42) -> pd.DataFrame:
+    """
+    A function that makes a market scenario for each scenario ID in the sample, stacked with the columns of
+    market_scenarios_schema.csv.
+    :param first_month: The first month of the scenarios.
+    :param last_month: The last month of the scenarios.
+    :param seed: The seed for the random numbers.
+    :return: The market scenarios.
+    """
+
+    scenario_ids = sample_categories("market_scenarios")["scenario_id"]
+
+    return pd.concat([
+        make_market_scenario(first_month, last_month, seed + scenario_index, SCENARIO_LENDING_GROWTH.get(scenario_id, SCENARIO_LENDING_GROWTH["base"]))
+        .assign(scenario_id=scenario_id)
+        for scenario_index, scenario_id in enumerate(scenario_ids)], ignore_index=True)
+
+
+def make_economic_scenario(first_month: datetime.date, last_month: datetime.date, seed: int = 42) -> pd.DataFrame:
+    """
+    A function that makes a quarterly economic scenario with the columns of economic_scenario_schema.csv, starting
+    from the levels in the sample scenario. There is a row for the first month of each quarter up to the last month.
+    :param first_month: The first month of the scenario.
+    :param last_month: The last month of the scenario.
+    :param seed: The seed for the random numbers.
+    :return: The economic scenario.
+    """
+
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(SAMPLE_INPUTS / "ppnr" / "economic_scenario.csv").iloc[0]
+
+    observation_date = pd.date_range(first_month, last_month, freq="QS-JAN")
+    number_of_quarters = len(observation_date)
+
+    # Unemployment drifts back towards its starting level, the policy rate wanders but stays above -0.5%
+    unemployment_rate = np.empty(number_of_quarters)
+    unemployment_rate[0] = sample["unemployment_rate"]
+    for quarter in range(1, number_of_quarters):
+        unemployment_rate[quarter] = unemployment_rate[quarter - 1] + 0.2 * (sample["unemployment_rate"] - unemployment_rate[quarter - 1]) + rng.normal(0.0, 0.003)
+
+    return pd.DataFrame({
+        "observation_date": observation_date,
+        "unemployment_rate": np.round(np.clip(unemployment_rate, 0.01, 0.3), 8),
+        "disposable_income_growth": np.round(rng.normal(0.005, 0.01, number_of_quarters), 6),
+        "riksbank_policy_rate": np.round(np.clip(sample["riksbank_policy_rate"] + np.cumsum(rng.normal(0.0, 0.0025, number_of_quarters)), -0.005, 0.1), 6),
+        "nominal_hpi": np.round(sample["nominal_hpi"] * np.exp(np.cumsum(rng.normal(0.012, 0.02, number_of_quarters))), 4)
+    })
+
+
+def make_yearly_table(dataset_name: str, first_year: int, last_year: int, seed: int = 42) -> pd.DataFrame:
+    """
+    A function that makes a table of rates or costs set by year and region. There is a row for each region in the
+    sample table and each year, the models join the tables on the year and region. Each value starts from the latest
+    one in the sample for its region and moves by a random amount each year.
+    :param dataset_name: The name of the table, for example 'customer_rates'.
+    :param first_year: The first year in the table.
+    :param last_year: The last year in the table.
+    :param seed: The seed for the random numbers.
+    :return: The table, holding the fields in its schema.
+    """
+
+    rng = np.random.default_rng(seed)
+    fields = load_schema(dataset_name).table.fields
+
+    # The latest row for each region, the sample tables all hold a year even when the schema does not
+    sample = pd.read_csv(SAMPLE_INPUTS / "ppnr" / f"{dataset_name}.csv")
+    latest = sample.sort_values("date").groupby("region", sort=False).tail(1).set_index("region").loc[sample["region"].unique()]
+
+    years = np.arange(first_year, last_year + 1)
+    regions = np.repeat(latest.index.to_numpy(dtype=object), len(years))
+
+    table = {"id": np.arange(len(regions)), "date": np.tile(years, len(latest)), "region": regions}
+
+    for field in fields:
+        if field.fieldName in table:
+            continue
+        if field.fieldType == trac.BasicType.FLOAT:
+            drift = np.exp(np.cumsum(rng.normal(0.0, 0.05, (len(latest), len(years))), axis=1))
+            table[field.fieldName] = (latest[field.fieldName].to_numpy()[:, np.newaxis] * drift).ravel()
+        else:
+            table[field.fieldName] = np.repeat(latest[field.fieldName].to_numpy(dtype=object), len(years))
+
+    return pd.DataFrame(table)[[field.fieldName for field in fields]]
+
+
+def write_dataset(target_path: pathlib.Path, storage_format: str, schema: trac.SchemaDefinition, chunks: tp.Iterable[pd.DataFrame]) -> int:
+    """
+    A function that conforms each chunk of a dataset to its schema and writes it to one file, so that a dataset
+    larger than memory can be written a piece at a time.
+    :param target_path: The path to the file.
+    :param storage_format: The TRAC format code, 'CSV', 'PARQUET' or 'ARROW_FILE'.
+    :param schema: The TRAC schema of the dataset.
+    :param chunks: The rows of the dataset, in one or more dataFrames.
+    :return: The number of rows written.
+    """
+
+    arrow_schema = _trac_data.DataMapping.trac_to_arrow_schema(schema)
+    storage_format = storage_format.upper()
+
+    if storage_format == "CSV":
+        writer = pa_csv.CSVWriter(str(target_path), arrow_schema)
+    elif storage_format == "PARQUET":
+        writer = pa_pq.ParquetWriter(str(target_path), arrow_schema)
+    elif storage_format == "ARROW_FILE":
+        writer = pa.ipc.new_file(str(target_path), arrow_schema)
+    else:
+        raise Exception(f"Storage format '{storage_format}' is not supported, use one of {', '.join(STORAGE_FORMATS)}")
+
+    number_of_rows = 0
+
+    with writer:
+        for chunk in chunks:
+            # The sample tables that are copied hold columns that are not in their schemas, these are left out
+            table = _trac_data.DataMapping.pandas_to_arrow(chunk[arrow_schema.names], arrow_schema)
+
+            if storage_format == "PARQUET":
+                writer.write_table(table, row_group_size=DEFAULT_ROWS_PER_GROUP)
+            elif storage_format == "ARROW_FILE":
+                writer.write_table(table, max_chunksize=DEFAULT_ROWS_PER_GROUP)
+            else:
+                writer.write_table(table)
+
+            number_of_rows += table.num_rows
+
+    return number_of_rows
+
+
+def generate_inputs(output_folder: tp.Union[str, pathlib.Path], number_of_loans: int, number_of_months: int, storage_format: str = "PARQUET",
+                    seed: int = 42, t0: datetime.date = DEFAULT_T0) -> tp.Dict[str, tp.Any]:
+    """
+    A function that writes every input the models read, for a book of a given size and a forecast of a given
+    length starting in the month after t0. The market scenarios, economic scenario and rate and cost tables cover
+    every month and year of the forecast.
+    :param output_folder: The folder to write the files to, the files are written to an 'inputs' folder inside it.
+    :param number_of_loans: The number of loans in the mortgage book.
+    :param number_of_months: The number of months in the forecast.
+    :param storage_format: The TRAC format code, 'CSV', 'PARQUET' or 'ARROW_FILE'.
+    :param seed: The seed for the random numbers.
+    :param t0: The date of the mortgage book.
+    :return: A manifest of what was written, the path to each dataset is relative to the output folder. The
+    manifest is also written to the output folder as manifest.json.
+    """
+
+    log = logging.getLogger(generate_inputs.__name__)
+
+    if number_of_loans < 1 or number_of_months < 1:
+        raise Exception(f"The book needs at least one loan and the forecast at least one month, not {number_of_loans} loans and {number_of_months} months")
+
+    storage_format = storage_format.upper()
+    if storage_format not in STORAGE_FORMATS:
+        raise Exception(f"Storage format '{storage_format}' is not supported, use one of {', '.join(STORAGE_FORMATS)}")
+
+    output_folder = pathlib.Path(output_folder)
+    (output_folder / "inputs").mkdir(parents=True, exist_ok=True)
+
+    first_forecast_month = month_start(t0, 1)
+    last_forecast_month = month_start(t0, number_of_months)
+
+    def book_chunks():
+        for first_loan in range(0, number_of_loans, LOANS_PER_CHUNK):
+            yield make_mortgage_book_t0(min(LOANS_PER_CHUNK, number_of_loans - first_loan), seed + first_loan // LOANS_PER_CHUNK, t0, first_loan)
+
+    datasets = {
+        "mortgage_book_t0": ("ppnr", book_chunks()),
+        "market_scenario": ("ppnr", [make_market_scenario(HISTORY_START, last_forecast_month, seed)]),
+        "market_scenarios": ("ppnr", [make_market_scenarios(HISTORY_START, last_forecast_month, seed)]),
+        "economic_scenario": ("ppnr", [make_economic_scenario(HISTORY_START, last_forecast_month, seed)])
+    }
+
+    for dataset_index, dataset_name in enumerate(YEARLY_DATASETS):
+        datasets[dataset_name] = ("ppnr", [make_yearly_table(dataset_name, t0.year - 4, last_forecast_month.year, seed + dataset_index)])
+
+    for dataset_name, package in COPIED_DATASETS.items():
+        datasets[dataset_name] = (package, [pd.read_csv(SAMPLE_INPUTS / package / f"{dataset_name}.csv")])
+
+    manifest = {
+        "loans": number_of_loans, "months": number_of_months, "format": storage_format, "seed": seed, "t0": t0.isoformat(),
+        "first_forecast_month": first_forecast_month.isoformat(), "last_forecast_month": last_forecast_month.isoformat(),
+        "datasets": dict(), "rows": dict()
+    }
+
+    for dataset_name, (package, chunks) in datasets.items():
+
+        storage_path = f"inputs/{dataset_name}{STORAGE_FORMATS[storage_format]}"
+
+        number_of_rows = write_dataset(output_folder / storage_path, storage_format, load_schema(dataset_name, package), chunks)
+
+        log.info(f"Wrote {number_of_rows} rows to [{output_folder / storage_path}]")
+
+        manifest["datasets"][dataset_name] = storage_path
+        manifest["rows"][dataset_name] = number_of_rows
+
+    (output_folder / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+    return manifest
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Generate synthetic inputs for the models")
+    parser.add_argument("output_folder", help="The folder to write the inputs to, for example data/synthetic")
+    parser.add_argument("--loans", type=int, default=10000, help="The number of loans in the mortgage book, for example 10000 to 50000000")
+    parser.add_argument("--months", type=int, default=12, help="The number of months in the forecast, for example 12 to 360")
+    parser.add_argument("--format", default="PARQUET", choices=list(STORAGE_FORMATS), help="The format to write")
+    parser.add_argument("--seed", type=int, default=42, help="The seed for the random numbers")
+    arguments = parser.parse_args()
+
+    trac_plugins.PluginManager.register_core_plugins()
+    _trac_static_api.StaticApiImpl.register_impl()
+
+    generate_inputs(arguments.output_folder, arguments.loans, arguments.months, arguments.format, arguments.seed)
@@ -9,8 +9,13 @@ import tracdap.rt.api as trac
 
 # Load the schemas library
 from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+# Load the mergeable column profiles used to profile the data in batches
+from data_quality.column_profiles import profile_batches
 # Load a set of utils for handling TRAC schemas
 from utils.utils_trac_schema import TracSchemaUtils
+# Load a set of utils for working on groups of columns in parallel
+from utils.utils_parallel_columns import ParallelColumnUtils
 
 """
 A model that creates a data quality report on a dataset. 
@@ -22,17 +27,195 @@ A model that creates a data quality report on a dataset.
 # TODO when spark models are available in the TRAC API then this need to be rewritten to work for larger datasets handled in spark.
 
 
+# The statistics in the data quality report, in the order they appear after the schema columns
+DATA_QUALITY_STATISTICS = [
+    "count_not_null", "count_null", "count_infinite", "count_less_than_zero", "count_equals_zero", "count_more_than_zero", "count_more_than_one",
+    "count_empty_string", "count_unique_values", "sum", "minimum_number_value", "maximum_number_value", "mean_number_value", "median_number_value",
+    "minimum_date_value", "maximum_date_value", "median_date_value", "minimum_datetime_value", "maximum_datetime_value", "median_datetime_value",
+    "count_unique_values_error", "median_rank_error"
+]
+
+# The statistics grouped by their type in the report
+DATA_QUALITY_NUMBER_STATISTICS = DATA_QUALITY_STATISTICS[:DATA_QUALITY_STATISTICS.index("minimum_date_value")] + ["count_unique_values_error", "median_rank_error"]
+DATA_QUALITY_DATE_STATISTICS = ["minimum_date_value", "maximum_date_value", "median_date_value"]
+DATA_QUALITY_DATETIME_STATISTICS = ["minimum_datetime_value", "maximum_datetime_value", "median_datetime_value"]
+
+
+def calculate_numeric_statistics(column: pd.Series, basic_type: trac.BasicType) -> tp.Dict[str, tp.Any]:
+    """
+    Calculate the data quality statistics for a FLOAT, DECIMAL or INTEGER column using numpy reductions.
+    :param column: The column to profile.
+    :param basic_type: The TRAC type of the column.
+    :return: A dictionary of the statistics keyed by name.
+    """
+    values = column.to_numpy(dtype="float64", na_value=np.nan)
+
+    is_null = np.isnan(values)
+
+    # Comparisons against nan are always false so missing values are not counted in the sign flags
+    statistics = {
+        "count_not_null": values.size - np.count_nonzero(is_null),
+        "count_null": np.count_nonzero(is_null),
+        "count_infinite": np.count_nonzero(np.isinf(values)),
+        "count_less_than_zero": np.count_nonzero(values < 0),
+        "count_equals_zero": np.count_nonzero(values == 0),
+        "count_more_than_zero": np.count_nonzero(values > 0),
+        "count_more_than_one": np.count_nonzero(values > 1)
+    }
+
+    if basic_type == trac.INTEGER:
+
+        # Median is used for integers
+        real_values = values[~is_null]
+        statistics["median_number_value"] = np.median(real_values) if real_values.size else np.nan
+
+    else:
+
+        # nan values are valid float dtypes but with a value set to nan. These behave differently to null values.
+        # It's really confusing to the user when they look at the report, and it's polluted by null, nan and inf,
+        # so we remove these so that the aggregation stats are all presented on a common basis and relate to only
+        # real numbers. Mean is used for floats and decimals
+        real_values = values[np.isfinite(values)]
+        statistics["sum"] = real_values.sum()
+        statistics["mean_number_value"] = real_values.mean() if real_values.size else np.nan
+
+    statistics["minimum_number_value"] = real_values.min() if real_values.size else np.nan
+    statistics["maximum_number_value"] = real_values.max() if real_values.size else np.nan
+    statistics["count_unique_values"] = np.unique(real_values).size
+
+    return statistics
+
+
+def calculate_string_statistics(column: pd.Series) -> tp.Dict[str, tp.Any]:
+    """
+    Calculate the data quality statistics for a STRING column.
+    :param column: The column to profile.
+    :return: A dictionary of the statistics keyed by name.
+    """
+    is_null = column.isna().to_numpy()
+
+    return {
+        "count_not_null": is_null.size - np.count_nonzero(is_null),
+        "count_null": np.count_nonzero(is_null),
+        # Note we remove whitespace in 'count_empty_string'
+        "count_empty_string": np.count_nonzero(column.str.strip().eq("").to_numpy(dtype=bool, na_value=False)),
+        "count_unique_values": column.nunique()
+    }
+
+
+def calculate_temporal_statistics(column: pd.Series, basic_type: trac.BasicType) -> tp.Dict[str, tp.Any]:
+    """
+    Calculate the data quality statistics for a DATE or DATETIME column. Dates are reported as dates rather than
+    datetime values.
+    :param column: The column to profile.
+    :param basic_type: The TRAC type of the column.
+    :return: A dictionary of the statistics keyed by name.
+    """
+    column = pd.to_datetime(column)
+    is_null = column.isna().to_numpy()
+
+    minimum, maximum, median = column.min(), column.max(), column.median()
+
+    if basic_type == trac.DATE:
+        suffix = "date_value"
+        minimum, maximum, median = [None if pd.isna(value) else value.date() for value in (minimum, maximum, median)]
+    else:
+        suffix = "datetime_value"
+
+    return {
+        "count_not_null": is_null.size - np.count_nonzero(is_null),
+        "count_null": np.count_nonzero(is_null),
+        "count_unique_values": column.nunique(),
+        "minimum_" + suffix: minimum,
+        "maximum_" + suffix: maximum,
+        "median_" + suffix: median
+    }
+
+
+def calculate_column_statistics(column: pd.Series, basic_type: trac.BasicType) -> tp.Dict[str, tp.Any]:
+    """
+    Calculate all the data quality statistics that apply to a column given its TRAC type, statistics that do not
+    apply to the type are left out.
+    :param column: The column to profile.
+    :param basic_type: The TRAC type of the column.
+    :return: A dictionary of the statistics keyed by name.
+    """
+    if basic_type in [trac.FLOAT, trac.DECIMAL, trac.INTEGER]:
+        return calculate_numeric_statistics(column, basic_type)
+
+    elif basic_type == trac.STRING:
+        return calculate_string_statistics(column)
+
+    elif basic_type in [trac.DATE, trac.DATETIME]:
+        return calculate_temporal_statistics(column, basic_type)
+
+    # Booleans only have the null and unique counts
+    is_null = column.isna().to_numpy()
+
+    return {
+        "count_not_null": is_null.size - np.count_nonzero(is_null),
+        "count_null": np.count_nonzero(is_null),
+        "count_unique_values": column.nunique()
+    }
+
+
+def profile_columns(data: pd.DataFrame, columns: tp.List[tp.Tuple[str, trac.BasicType]], profiling_mode: str, rows_per_batch: int) -> tp.Dict[str, tp.Dict[str, tp.Any]]:
+    """
+    Calculate the data quality statistics for a set of columns. The statistics for each column only depend on that
+    column, so different sets of columns can be profiled by different workers.
+    :param data: The data holding the columns.
+    :param columns: The (name, TRAC type) pairs of the columns to profile.
+    :param profiling_mode: Either 'exact' or 'approximate'.
+    :param rows_per_batch: The number of rows to profile at a time in approximate mode.
+    :return: A dictionary keyed by variable name of the statistics for each variable.
+    """
+    if profiling_mode == "exact":
+        # Calculate every statistic for a column in one go, each column is only read once
+        return {column_name: calculate_column_statistics(data[column_name], basic_type) for column_name, basic_type in columns}
+
+    # The working memory is one batch plus a fixed size profile per column, the unique counts and the medians are
+    # estimates and the report includes their error bounds
+    rows_per_batch = rows_per_batch if rows_per_batch > 0 else max(len(data), 1)
+    batches = (data.iloc[start:start + rows_per_batch] for start in range(0, len(data), rows_per_batch))
+
+    return profile_batches(batches, columns)
+
+
+def create_data_quality_report(schema_as_data: pd.DataFrame, column_statistics: tp.Dict[str, tp.Dict[str, tp.Any]]) -> pd.DataFrame:
+    """
+    Put the statistics for each column into the data quality report, one row per variable in the schema. Statistics
+    that do not apply to a variable are missing.
+    :param schema_as_data: The schema of the data as a dataFrame, from TracSchemaUtils.convert_schema_into_dataframe.
+    :param column_statistics: A dictionary keyed by variable name of the statistics for each variable.
+    :return: The data quality report.
+    """
+    statistics = pd.DataFrame.from_dict(column_statistics, orient="index").reindex(index=schema_as_data.index, columns=DATA_QUALITY_STATISTICS)
+
+    statistics[DATA_QUALITY_NUMBER_STATISTICS] = statistics[DATA_QUALITY_NUMBER_STATISTICS].astype("float64")
+    statistics[DATA_QUALITY_DATETIME_STATISTICS] = statistics[DATA_QUALITY_DATETIME_STATISTICS].apply(pd.to_datetime)
+
+    # Dates are held as python dates, variables without a date statistic get None rather than nan
+    date_statistics = statistics[DATA_QUALITY_DATE_STATISTICS].astype(object)
+    statistics[DATA_QUALITY_DATE_STATISTICS] = date_statistics.where(date_statistics.notna(), None)
+
+    return pd.concat([schema_as_data, statistics], axis=1)
+
+
 class Wrapper(trac.TracModel):
 
     # Set the model parameters
     def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
         return trac.declare_parameters(
+            trac.P("profiling_mode", trac.STRING, label="Profiling mode ('exact' or 'approximate')", default_value="exact"),
+            trac.P("rows_per_batch", trac.INTEGER, label="Number of rows to profile at a time in approximate mode", default_value=1000000),
+            trac.P("max_workers", trac.INTEGER, label="Number of workers profiling columns in parallel (1 to run serially)", default_value=1),
+            trac.P("executor_type", trac.STRING, label="Type of parallel worker ('thread' or 'process')", default_value="thread")
         )
 
     # Set the model input datasets
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
 
-        data_schema = trac.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        data_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
 
         return {"data": trac.ModelInputSchema(data_schema)}
 
@@ -64,25 +247,23 @@ class Wrapper(trac.TracModel):
             trac.F(field_name="median_date_value", field_type=trac.DATE, field_order=16, label="Median value (integers only)"),
             trac.F(field_name="minimum_datetime_value", field_type=trac.DATETIME, field_order=14, label="Minimum value (numbers & dates only)"),
             trac.F(field_name="maximum_datetime_value", field_type=trac.DATETIME, field_order=15, label="Maximum value (numbers & dates only)"),
-            trac.F(field_name="median_datetime_value", field_type=trac.DATETIME, field_order=16, label="Median value (integers only)")
+            trac.F(field_name="median_datetime_value", field_type=trac.DATETIME, field_order=16, label="Median value (integers only)"),
+            trac.F(field_name="count_unique_values_error", field_type=trac.FLOAT, field_order=19, label="Relative standard error of the unique count (approximate mode only)"),
+            trac.F(field_name="median_rank_error", field_type=trac.FLOAT, field_order=20, label="Rank error of the median at 99% confidence (approximate mode only)")
         ]
 
         return {"data_quality_report": trac.define_output_table(data_quality_report_schema, label="Data quality report")}
 
-    @staticmethod
-    def extract_columns_into_single_statistic(df: pd.DataFrame, column_name_part: str) -> pd.Series:
-        """
-        A function used to create a new series for an aggregation statistic from the series available. If we have two numeric variables 'A' and 'B'
-        then we will have 'sum_A' and 'sum_B' columns in the dataset. This function creates the 'sum' column which coalesces the values from the right
-        columns. It uses the 'field_name column to determine which values to take.
-        :param df: The dataFrame to coalesce the values from.
-        :param column_name_part: The first part of the column to get the values for, in the example above this will be 'sum_'
-        :return: A series with the coalesced values.
-        """
-        return df.apply(lambda row: pd.NA if (column_name_part + row["field_name"] not in df.columns) else row[column_name_part + row["field_name"]], axis=1)
-
     def run_model(self, ctx: trac.TracContext):
 
+        profiling_mode = ctx.get_parameter("profiling_mode")
+        rows_per_batch = ctx.get_parameter("rows_per_batch")
+        max_workers = ctx.get_parameter("max_workers")
+        executor_type = ctx.get_parameter("executor_type")
+
+        if profiling_mode not in ["exact", "approximate"]:
+            raise Exception(f"The profiling mode must be 'exact' or 'approximate', got '{profiling_mode}'")
+
         # Load the input data
         data = ctx.get_pandas_table("data")
 
@@ -91,200 +272,26 @@ class Wrapper(trac.TracModel):
         #  API we will be able to define a schema at runtime
         data_schema = ctx.get_schema("data")
 
-        # A dictionary of variable name lists broken down by type
-        schema_breakdown = TracSchemaUtils.get_trac_schema_type_breakdown(data_schema)
-
         # Convert the schema to an equivalent dataFrame, used to add columns into the output dataset
         schema_as_data = TracSchemaUtils.convert_schema_into_dataframe(data_schema)
 
-        #########################################################################################
-        #                     FLAG STATISTICS FOR FLOAT/DECIMAL/INTEGER VARIABLES               #
-        #########################################################################################
-
-        numeric_flag_data_quality_report = pd.DataFrame()
-
-        for variable in (schema_breakdown[trac.FLOAT] + schema_breakdown[trac.DECIMAL] + schema_breakdown[trac.INTEGER]):
-            # This is just an empty version of the input data but the index and the size of this index is the same as
-            # what's needed now, we recreate it for each variable being processed
-            data_temp = data.drop(columns=data.columns)
-
-            # Create the required true/false flag columns
-            data_temp["count_not_null"] = (data[variable].notnull()) & (~data[variable].map(pd.isna))
-            data_temp["count_null"] = (data[variable].isnull()) | (data[variable].map(pd.isna))
-            data_temp["count_infinite"] = (data[variable] == np.inf) | (data[variable] == -1 * np.inf)
-            data_temp["count_less_than_zero"] = data[variable] < 0
-            data_temp["count_equals_zero"] = data[variable] == 0
-            data_temp["count_more_than_zero"] = data[variable] > 0
-            data_temp["count_more_than_one"] = data[variable] > 1
-
-            # A dictionary of the flag based statistics that need a column to be calculated first before a statistic
-            # can be calculated. While we could wrap some of these into numeric_aggregation_statistic we would need
-            # to use lambda functions which would be slower.
-            numeric_flag_statistics = {
-                'count_not_null': 'sum',
-                'count_null': 'sum',
-                'count_infinite': 'sum',
-                'count_less_than_zero': 'sum',
-                'count_equals_zero': 'sum',
-                'count_more_than_zero': 'sum',
-                'count_more_than_one': 'sum'
-            }
-
-            # Calculate the numeric flag statistics against the new temporary dataset that
-            # had the new required metrics calculated on it
-            numeric_flag_data_quality_report[variable] = data_temp.agg(numeric_flag_statistics)
-
-        #########################################################################################
-        #                           FLAG STATISTICS FOR STRING VARIABLES                        #
-        #########################################################################################
-
-        string_flag_data_quality_report = pd.DataFrame()
-
-        for variable in schema_breakdown[trac.STRING]:
-            # This is just an empty version of the input data but the index and the size of this index is the same as
-            # what's needed now, we recreate it for each variable being processed
-            data_temp = data.drop(columns=data.columns)
-
-            # Create the required true/false flag columns
-            # Note we remove whitespace in 'count_empty_string'
-            data_temp["count_not_null"] = data[variable].notnull()
-            data_temp["count_null"] = data[variable].isnull()
-            data_temp["count_empty_string"] = data[variable].str.strip() == ""
-
-            # A dictionary of the flag based statistics that need a column to be calculated first before a statistic
-            # can be calculated.
-            string_flag_statistics = {
-                'count_not_null': 'sum',
-                'count_null': 'sum',
-                'count_empty_string': 'sum'
-            }
-
-            # Calculate the numeric flag statistics against the new temporary dataset that
-            # had the new required metrics calculated on it
-            string_flag_data_quality_report[variable] = data_temp.agg(string_flag_statistics)
-
-        #########################################################################################
-        #                   FLAG STATISTICS FOR BOOLEAN/DATE/DATETIME VARIABLES                 #
-        #########################################################################################
-
-        boolean_and_date_flag_data_quality_report = pd.DataFrame()
-
-        for variable in (schema_breakdown[trac.BOOLEAN] + schema_breakdown[trac.DATE] + schema_breakdown[trac.DATETIME]):
-            # This is just an empty version of the input data but the index and the size of this index is the same as
-            # what's needed now, we recreate it for each variable being processed
-            data_temp = data.drop(columns=data.columns)
-
-            # Create the required true/false flag columns
-            data_temp["count_not_null"] = data[variable].notnull()
-            data_temp["count_null"] = data[variable].isnull()
-
-            # A dictionary of the flag based statistics that need a column to be calculated first before a statistic
-            # can be calculated.
-            boolean_and_date_flag_statistics = {
-                'count_not_null': 'sum',
-                'count_null': 'sum'
-            }
-
-            # Calculate the numeric flag statistics against the new temporary dataset that
-            # had the new required metrics calculated on it
-            boolean_and_date_flag_data_quality_report[variable] = data_temp.agg(boolean_and_date_flag_statistics)
-
-        #########################################################################################
-        #                       NUMERIC AGGREGATION DATA QUALITY METRICS                        #
-        #########################################################################################
-
-        # A dictionary of the aggregation statistics for standard numeric calculations e.g. sum
-        # applied to all types of variables
-        numeric_aggregation_statistics = dict()
-
-        # Calculate the standard numeric statistics
-        for column in data.columns:
-
-            ctx.log().info("Adding aggregation statistics for %s", column)
-
-            # nan values are valid float dtypes but with a value set to nan. These behave differently to null values.
-            # It's really confusing to the user when they look at the report, and it's polluted by null, nan and inf,
-            # so we remove these so that the aggregation stats are all presented on a common basis and relate to on;y
-            # real numbers
-            if column in schema_breakdown[trac.FLOAT] + schema_breakdown[trac.DECIMAL]:
-                data[column] = data[column].map(lambda x: pd.NA if pd.isna(x) or (x == np.inf or x == -1 * np.inf) else x)
-
-            if column in schema_breakdown[trac.FLOAT] + schema_breakdown[trac.DECIMAL]:
-
-                # Mean is used for floats and decimals
-                numeric_aggregation_statistics["mean_number_value_" + column] = (column, "mean")
-                numeric_aggregation_statistics["sum_" + column] = (column, "sum")
-                numeric_aggregation_statistics["minimum_number_value_" + column] = (column, "min")
-                numeric_aggregation_statistics["maximum_number_value_" + column] = (column, "max")
-                # Use the builtin unique count as this can handle columns with NA in them
-                numeric_aggregation_statistics["count_unique_values_" + column] = (column, "nunique")
-
-            elif column in schema_breakdown[trac.INTEGER]:
-
-                # Median is used for integers
-                numeric_aggregation_statistics["median_number_value_" + column] = (column, "median")
-                numeric_aggregation_statistics["minimum_number_value_" + column] = (column, "min")
-                numeric_aggregation_statistics["maximum_number_value_" + column] = (column, "max")
-                # Use the builtin unique count as this can handle columns with NA in them
-                numeric_aggregation_statistics["count_unique_values_" + column] = (column, "nunique")
-
-            # Strings and booleans don't have all aggregation statistics applied as they can't be calculated
-            elif column in schema_breakdown[trac.STRING] + schema_breakdown[trac.BOOLEAN]:
-
-                numeric_aggregation_statistics["count_unique_values_" + column] = (column, "nunique")
-
-            elif column in schema_breakdown[trac.DATE] + schema_breakdown[trac.DATETIME]:
-
-                numeric_aggregation_statistics["count_unique_values_" + column] = (column, "nunique")
-                numeric_aggregation_statistics["median_date_value_" + column] = (column, "median")
-                numeric_aggregation_statistics["minimum_date_value_" + column] = (column, "min")
-                numeric_aggregation_statistics["maximum_date_value_" + column] = (column, "max")
-
-            elif column in schema_breakdown[trac.DATETIME] + schema_breakdown[trac.DATETIME]:
-
-                numeric_aggregation_statistics["count_unique_values_" + column] = (column, "nunique")
-                numeric_aggregation_statistics["median_datetime_value_" + column] = (column, "median")
-                numeric_aggregation_statistics["minimum_datetime_value_" + column] = (column, "min")
-                numeric_aggregation_statistics["maximum_datetime_value_" + column] = (column, "max")
-
-        # Calculate the standard numeric statistics in one pass, this should be faster
-        # Note the columns are the variable names and the index is the statistics with the column name appended, so
-        # we transpose so the columns are the statistics, this makes the final output have a data independent schema
-        # The ** is a clever way of deconstructing the numeric_aggregation_statistics dictionary into a series of
-        # arguments to the agg function. This means we can name each statistic (although because these have to be
-        # unique we have to append the variable name - which means we have a little extra work on the summary
-        # statistic data to reduce it to a summary dataFrame)
-        aggregation_data_quality_report = data.agg(**numeric_aggregation_statistics).T.reset_index(names="field_name")
-
-        # This is a list of the final set of aggregation statistics we want to have on the final version of
-        # 'aggregation_data_quality_report'.
-        list_to_extract = ["count_unique_values", "sum", "minimum_number_value", "maximum_number_value", "mean_number_value", "median_number_value", "minimum_date_value", "maximum_date_value",
-                           "median_date_value", "minimum_datetime_value", "maximum_datetime_value", "median_datetime_value"]
-
-        # For each statistic we want to coalesce the values from across the columns (which are per variable)
-        for item in list_to_extract:
-            aggregation_data_quality_report[item] = Wrapper.extract_columns_into_single_statistic(aggregation_data_quality_report, item + "_")
-
-        # Put back the index we had
-        aggregation_data_quality_report = aggregation_data_quality_report.set_index(keys="field_name", drop=True, inplace=False)
-
-        # Keep everything we need
-        aggregation_data_quality_report = aggregation_data_quality_report[list_to_extract]
-
-        # Make sure that the date column types are dates rather than datetime values
-        aggregation_data_quality_report["minimum_date_value"] = aggregation_data_quality_report["minimum_date_value"].date.date()
-        aggregation_data_quality_report["maximum_date_value"] = aggregation_data_quality_report["maximum_date_value"].date.date()
-        aggregation_data_quality_report["median_date_value"] = aggregation_data_quality_report["median_date_value"].date.date()
-
-        # Join all the flag metrics into a single dataFrame
-        flag_data_quality_report = pd.concat([numeric_flag_data_quality_report.T, string_flag_data_quality_report.T, boolean_and_date_flag_data_quality_report.T], axis=0)
-
-        # Merge the flag data quality results to the schema, if there are no flags configured for a particular colum in the
-        # data then it's still in the output, just with no data quality information
-        data_quality_report = pd.merge(schema_as_data, flag_data_quality_report, left_index=True, right_index=True, how="left")
+        columns = [(field.fieldName, field.fieldType) for field in data_schema.table.fields]
+
+        if profiling_mode == "approximate":
+            ctx.log().info("Profiling %s rows in batches of %s", len(data), rows_per_batch)
+
+        if max_workers > 1:
+
+            ctx.log().info("Profiling %s columns with %s %s workers", len(columns), max_workers, executor_type)
+
+            column_statistics = ParallelColumnUtils.map_column_groups(profile_columns, data, columns, max_workers, executor_type,
+                                                                      args=(profiling_mode, rows_per_batch))
+
+        else:
+
+            column_statistics = profile_columns(data, columns, profiling_mode, rows_per_batch)
 
-        # Merge the flag and aggregation statistics together by index, so they are on the same row per variable
-        data_quality_report = pd.merge(data_quality_report, aggregation_data_quality_report, left_index=True, right_index=True)
+        data_quality_report = create_data_quality_report(schema_as_data, column_statistics)
 
         # Output the dataset
         ctx.put_pandas_table("data_quality_report", data_quality_report)
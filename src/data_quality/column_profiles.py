@@ -0,0 +1,423 @@
+# Load a plugin to allow typing
+import typing as tp
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+# Load the TRAC runtime library
+import tracdap.rt.api as trac
+
+"""
+Mergeable accumulators used to profile a dataset a batch of rows at a time. Each accumulator holds a fixed amount of
+state however many rows it has seen, and two accumulators built from different batches can be merged into one that
+describes both.
+"""
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """
+    The number of bits needed to hold each value of an unsigned 64-bit array, worked out with a binary search so
+    there is no rounding from converting to floats.
+    """
+    values = values.copy()
+    bit_length = np.zeros(values.shape, dtype=np.int64)
+
+    for shift in (32, 16, 8, 4, 2, 1):
+        has_high_bits = values >= np.uint64(1 << shift)
+        bit_length += shift * has_high_bits
+        values = np.where(has_high_bits, values >> np.uint64(shift), values)
+
+    return bit_length + (values > 0)
+
+
+def hash_values(values: tp.Union[np.ndarray, pd.Series]) -> np.ndarray:
+    """
+    Hash values to 64 bits for the distinct count. Negative zero is hashed as zero so that it is counted as the
+    same value, as it is by pandas.
+    :param values: The values to hash, missing values should already have been removed.
+    :return: An array of unsigned 64-bit hashes.
+    """
+    values = np.asarray(values)
+
+    if values.dtype.kind == "f":
+        values = values + 0.0
+
+    # Hashing each value directly is quicker than factorizing first when most values are different
+    return pd.util.hash_array(values, categorize=False)
+
+
+class HyperLogLog:
+
+    def __init__(self, precision: int = 14):
+        """
+        A HyperLogLog sketch for counting distinct values.
+        :param precision: The number of hash bits used to pick a register, the sketch uses 2 ** precision registers.
+        """
+        self._precision = precision
+        self._registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self) -> float:
+        """
+        The relative standard error of the estimate, for whichever of linear counting or the raw HyperLogLog estimate
+        is used at the current fill of the registers.
+        """
+        return self._estimate()[1]
+
+    def add_hashes(self, hashes: np.ndarray):
+        """
+        Add a batch of 64-bit hashes to the sketch.
+        :param hashes: The hashes of the values, from hash_values.
+        """
+        if hashes.size == 0:
+            return
+
+        remaining_bits = 64 - self._precision
+
+        register_index = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << remaining_bits) - 1)
+
+        # The rank is the position of the first set bit in the part of the hash not used to pick the register
+        rank = (remaining_bits - _bit_length(remainder) + 1).astype(np.uint8)
+
+        # Keep the highest rank seen by each register, a groupby is much quicker than np.maximum.at here
+        batch_maximum = pd.Series(rank).groupby(register_index).max()
+        batch_registers = batch_maximum.index.to_numpy()
+
+        self._registers[batch_registers] = np.maximum(self._registers[batch_registers], batch_maximum.to_numpy())
+
+    def merge(self, other: "HyperLogLog"):
+        """
+        Merge another sketch into this one, the other sketch must have the same precision.
+        """
+        if other._precision != self._precision:
+            raise Exception("HyperLogLog sketches with different precisions can not be merged")
+
+        np.maximum(self._registers, other._registers, out=self._registers)
+
+    def estimate(self, maximum: tp.Optional[int] = None) -> int:
+        """
+        The estimated number of distinct values added to the sketch.
+        :param maximum: An upper bound on the count, such as the number of values added, the estimate is capped at it.
+        """
+        estimate = self._estimate()[0]
+
+        if maximum is not None:
+            estimate = min(estimate, maximum)
+
+        return estimate
+
+    def _estimate(self) -> tp.Tuple[int, float]:
+        """
+        The estimated number of distinct values along with the relative standard error of the estimator used.
+        """
+        register_count = self._registers.size
+        alpha = 0.7213 / (1 + 1.079 / register_count)
+
+        raw_estimate = alpha * register_count ** 2 / np.sum(np.ldexp(1.0, -self._registers.astype(np.int64)))
+
+        # Linear counting is more accurate while lots of the registers are still empty
+        empty_registers = np.count_nonzero(self._registers == 0)
+
+        if raw_estimate <= 2.5 * register_count and empty_registers > 0:
+
+            estimate = register_count * np.log(register_count / empty_registers)
+
+            if estimate == 0:
+                return 0, 0.0
+
+            # The standard error of linear counting from Whang et al. (1990), it depends on the load of the registers
+            load = estimate / register_count
+            relative_error = np.sqrt(register_count * (np.exp(load) - load - 1)) / estimate
+
+            return int(round(estimate)), float(relative_error)
+
+        return int(round(raw_estimate)), float(1.04 / np.sqrt(register_count))
+
+
+class KllSketch:
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        """
+        A KLL quantile sketch. Values are held in levels where each value at level h stands in for 2 ** h of the
+        original values, a level that grows past its capacity is sorted and every other value is promoted to the
+        level above.
+        :param k: The capacity of the top level, the rank error is roughly proportional to 1 / k.
+        :param seed: The seed for choosing which half of a level is promoted.
+        """
+        self._k = k
+        self._rng = np.random.default_rng(seed)
+        self._levels: tp.List[np.ndarray] = [np.empty(0)]
+        self._count = 0
+
+        # Each compaction at level h moves the rank of any value by 2 ** h either up or down with equal chance, so
+        # summing the squared weights gives the variance of the rank error
+        self._error_variance = 0.0
+
+    def _capacity(self, level: int) -> int:
+
+        height = len(self._levels) - 1 - level
+
+        return max(8, int(np.ceil(self._k * (2 / 3) ** height)))
+
+    def _compress(self):
+
+        level = 0
+
+        while level < len(self._levels):
+
+            if self._levels[level].size > self._capacity(level):
+
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+
+                items = np.sort(self._levels[level])
+
+                # With an odd number of items one stays behind so the total weight is kept
+                left_behind, items = items[:items.size % 2], items[items.size % 2:]
+                offset = self._rng.integers(2)
+
+                self._levels[level + 1] = np.concatenate([self._levels[level + 1], items[offset::2]])
+                self._levels[level] = left_behind
+                self._error_variance += 4.0 ** level
+
+            level += 1
+
+    def update(self, values: np.ndarray):
+        """
+        Add a batch of values to the sketch, missing values are ignored.
+        :param values: The values to add as floats.
+        """
+        values = values[~np.isnan(values)]
+
+        if values.size == 0:
+            return
+
+        self._count += values.size
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+
+    def merge(self, other: "KllSketch"):
+        """
+        Merge another sketch into this one.
+        """
+        for level, items in enumerate(other._levels):
+            if level == len(self._levels):
+                self._levels.append(np.empty(0))
+            self._levels[level] = np.concatenate([self._levels[level], items])
+
+        self._count += other._count
+        self._error_variance += other._error_variance
+        self._compress()
+
+    def quantile(self, fraction: float) -> float:
+        """
+        The estimated value at a quantile, nan if the sketch is empty.
+        :param fraction: The quantile to find, 0.5 is the median.
+        """
+        if self._count == 0:
+            return np.nan
+
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(level_items.size, 2.0 ** level) for level, level_items in enumerate(self._levels)])
+
+        order = np.argsort(items, kind="stable")
+        cumulative_weight = np.cumsum(weights[order])
+
+        position = np.searchsorted(cumulative_weight, fraction * cumulative_weight[-1])
+
+        return items[order][min(position, items.size - 1)]
+
+    def rank_error(self, z_score: float = 2.576) -> float:
+        """
+        A bound on the rank error of a quantile as a fraction of the number of values, by default at 99% confidence.
+        """
+        if self._count == 0:
+            return 0.0
+
+        return z_score * np.sqrt(self._error_variance) / self._count
+
+
+class ColumnProfile:
+
+    def __init__(self, basic_type: trac.BasicType, hll_precision: int = 14, kll_k: int = 200, seed: int = 0):
+        """
+        The mergeable data quality statistics for a single column. Counts, sums, minimums and maximums are exact, the
+        mean is kept with Welford's update, the distinct count uses a HyperLogLog sketch and the median a KLL sketch.
+        :param basic_type: The TRAC type of the column, this decides which statistics are kept.
+        :param hll_precision: The precision of the distinct count sketch.
+        :param kll_k: The size of the median sketch.
+        :param seed: The seed for the median sketch.
+        """
+        self._basic_type = basic_type
+
+        self._is_number = basic_type in [trac.FLOAT, trac.DECIMAL, trac.INTEGER]
+        self._is_temporal = basic_type in [trac.DATE, trac.DATETIME]
+
+        self._counts = {"count_not_null": 0, "count_null": 0}
+
+        if self._is_number:
+            self._counts.update({"count_infinite": 0, "count_less_than_zero": 0, "count_equals_zero": 0, "count_more_than_zero": 0, "count_more_than_one": 0})
+
+        if basic_type == trac.STRING:
+            self._counts["count_empty_string"] = 0
+
+        self._sum = 0.0
+        self._mean = 0.0
+        self._mean_count = 0
+        self._minimum = None
+        self._maximum = None
+
+        self._distinct_values = HyperLogLog(hll_precision)
+
+        # Medians are only reported for integers and dates
+        self._median = KllSketch(kll_k, seed) if basic_type in [trac.INTEGER, trac.DATE, trac.DATETIME] else None
+
+    def _update_range(self, values: np.ndarray):
+
+        if values.size == 0:
+            return
+
+        minimum, maximum = values.min(), values.max()
+
+        self._minimum = minimum if self._minimum is None else min(self._minimum, minimum)
+        self._maximum = maximum if self._maximum is None else max(self._maximum, maximum)
+
+    def _update_mean(self, batch_count: int, batch_mean: float):
+
+        if batch_count == 0:
+            return
+
+        self._mean_count += batch_count
+        self._mean += (batch_mean - self._mean) * batch_count / self._mean_count
+
+    def update(self, column: pd.Series):
+        """
+        Add a batch of rows for the column to the profile.
+        :param column: The batch of values.
+        """
+        if self._is_number:
+
+            values = column.to_numpy(dtype="float64", na_value=np.nan)
+            is_null = np.isnan(values)
+
+            self._counts["count_infinite"] += np.count_nonzero(np.isinf(values))
+            self._counts["count_less_than_zero"] += np.count_nonzero(values < 0)
+            self._counts["count_equals_zero"] += np.count_nonzero(values == 0)
+            self._counts["count_more_than_zero"] += np.count_nonzero(values > 0)
+            self._counts["count_more_than_one"] += np.count_nonzero(values > 1)
+
+            if self._basic_type == trac.INTEGER:
+                real_values = values[~is_null]
+                self._median.update(real_values)
+            else:
+                # Only real numbers are used in the aggregation statistics, as in the exact report
+                real_values = values[np.isfinite(values)]
+                self._sum += real_values.sum()
+                self._update_mean(real_values.size, real_values.mean() if real_values.size else 0.0)
+
+            self._update_range(real_values)
+
+        elif self._is_temporal:
+
+            # Dates are profiled as nanoseconds since the epoch
+            values = pd.to_datetime(column).to_numpy(dtype="datetime64[ns]")
+            is_null = np.isnat(values)
+
+            real_values = values[~is_null].view(np.int64)
+
+            self._median.update(real_values.astype(np.float64))
+            self._update_range(real_values)
+
+        else:
+
+            is_null = column.isna().to_numpy()
+            real_values = column.to_numpy()[~is_null]
+
+            if self._basic_type == trac.STRING:
+                self._counts["count_empty_string"] += np.count_nonzero(column.str.strip().eq("").to_numpy(dtype=bool, na_value=False))
+
+        self._counts["count_not_null"] += is_null.size - np.count_nonzero(is_null)
+        self._counts["count_null"] += np.count_nonzero(is_null)
+
+        self._distinct_values.add_hashes(hash_values(real_values))
+
+    def merge(self, other: "ColumnProfile"):
+        """
+        Merge the profile of another batch of the same column into this one.
+        """
+        for count_name, count in other._counts.items():
+            self._counts[count_name] += count
+
+        self._sum += other._sum
+        self._update_mean(other._mean_count, other._mean)
+
+        for value in [other._minimum, other._maximum]:
+            if value is not None:
+                self._update_range(np.array([value]))
+
+        self._distinct_values.merge(other._distinct_values)
+
+        if self._median is not None:
+            self._median.merge(other._median)
+
+    def to_statistics(self) -> tp.Dict[str, tp.Any]:
+        """
+        The statistics for the column with the same names as the data quality report, along with the error bounds of
+        the approximate statistics.
+        """
+        statistics: tp.Dict[str, tp.Any] = dict(self._counts)
+
+        # The sketch can overshoot on small columns, there can never be more distinct values than values
+        statistics["count_unique_values"] = self._distinct_values.estimate(self._counts["count_not_null"])
+        statistics["count_unique_values_error"] = self._distinct_values.relative_error
+
+        if self._median is not None:
+            statistics["median_rank_error"] = self._median.rank_error()
+
+        if self._is_number:
+
+            statistics["minimum_number_value"] = np.nan if self._minimum is None else self._minimum
+            statistics["maximum_number_value"] = np.nan if self._maximum is None else self._maximum
+
+            if self._basic_type == trac.INTEGER:
+                statistics["median_number_value"] = self._median.quantile(0.5)
+            else:
+                statistics["sum"] = self._sum
+                statistics["mean_number_value"] = self._mean if self._mean_count else np.nan
+
+        elif self._is_temporal:
+
+            median = self._median.quantile(0.5)
+
+            minimum, maximum, median = [
+                pd.NaT if pd.isna(value) else pd.Timestamp(int(value))
+                for value in (self._minimum, self._maximum, median)]
+
+            if self._basic_type == trac.DATE:
+                statistics.update({
+                    "minimum_date_value": None if pd.isna(minimum) else minimum.date(),
+                    "maximum_date_value": None if pd.isna(maximum) else maximum.date(),
+                    "median_date_value": None if pd.isna(median) else median.date()})
+            else:
+                statistics.update({"minimum_datetime_value": minimum, "maximum_datetime_value": maximum, "median_datetime_value": median})
+
+        return statistics
+
+
+def profile_batches(batches: tp.Iterable[pd.DataFrame], columns: tp.List[tp.Tuple[str, trac.BasicType]], **profile_options) -> tp.Dict[str, tp.Dict[str, tp.Any]]:
+    """
+    Profile a dataset one batch of rows at a time, only one batch is held in memory along with the fixed size
+    profile for each column.
+    :param batches: The batches of rows to profile.
+    :param columns: The (name, TRAC type) pairs of the columns to profile.
+    :param profile_options: Options passed to ColumnProfile.
+    :return: A dictionary keyed by variable name of the statistics for each variable.
+    """
+    profiles = {column_name: ColumnProfile(basic_type, **profile_options) for column_name, basic_type in columns}
+
+    for batch in batches:
+        for variable, profile in profiles.items():
+            profile.update(batch[variable])
+
+    return {variable: profile.to_statistics() for variable, profile in profiles.items()}
@@ -1,9 +1,31 @@
-import calendar
 import tracdap.rt.api as trac
 import typing as tp
 from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_forecast_calendar import ForecastCalendarUtils
 import datetime as dt
 import pandas as pd
+from utils.utils_forecast_panel import ForecastPanelUtils
+
+
+def calculate_ead_forecast(ead_forecast: pd.DataFrame, first_forecast_month: dt.date) -> pd.DataFrame:
+    """
+    Calculate the EAD forecast for a chunk of the account x month panel.
+    :param ead_forecast: A chunk of the panel.
+    :param first_forecast_month: The first month of the forecast, used to work out how many repayments have been made.
+    :return: The EAD forecast for the chunk.
+    """
+    ead_forecast["time_to_default"] = 3 - ead_forecast["months_in_arrears"]
+
+    ead_forecast["month_index"] = ForecastCalendarUtils.month_index(ead_forecast["date"], first_forecast_month)
+    ead_forecast["balance"] = ead_forecast["balance"] - ead_forecast["month_index"] * ead_forecast["monthly_repayment"]
+
+    ead_forecast["ead"] = ead_forecast["balance"] + 400 + ead_forecast["balance"] * (
+                pow(1 + (0.05 / 12), ead_forecast["time_to_default"]) - 1)
+
+    return ead_forecast.drop("month_index", axis=1)
 
 
 class CalculateEad(trac.TracModel):
@@ -12,14 +34,16 @@ class CalculateEad(trac.TracModel):
 
         return trac.declare_parameters(
             trac.P("first_forecast_month", trac.DATE, label="First month of forecast", default_value=dt.datetime(2022, 1, 1).date()),
-            trac.P("last_forecast_month", trac.DATE, label="Last month of forecast", default_value=dt.datetime(2025, 12, 1).date())
+            trac.P("last_forecast_month", trac.DATE, label="Last month of forecast", default_value=dt.datetime(2025, 12, 1).date()),
+            trac.P("loans_per_chunk", trac.INTEGER, label="Number of accounts to forecast at a time (0 for all)", default_value=100000),
+            trac.P("months_per_chunk", trac.INTEGER, label="Number of months to forecast at a time (0 for all)", default_value=0)
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
 
-        ead_model_parameters_schema = trac.load_schema(schemas, "ead_model_parameters_schema.csv")
-        balance_forecast_schema = trac.load_schema(schemas, "balance_forecast_schema.csv")
-        mortgage_book_t0_schema = trac.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        ead_model_parameters_schema = SchemaRegistry.load_schema(schemas, "ead_model_parameters_schema.csv")
+        balance_forecast_schema = SchemaRegistry.load_schema(schemas, "balance_forecast_schema.csv")
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
 
         return {"ead_model_parameters": trac.ModelInputSchema(ead_model_parameters_schema),
                 "balance_forecast": trac.ModelInputSchema(balance_forecast_schema),
@@ -27,42 +51,42 @@ class CalculateEad(trac.TracModel):
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
 
-        ead_forecast_schema = trac.load_schema(schemas, "ead_forecast_schema.csv")
+        ead_forecast_schema = SchemaRegistry.load_schema(schemas, "ead_forecast_schema.csv")
 
         return {"ead_forecast": trac.ModelOutputSchema(ead_forecast_schema)}
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        # The EAD model parameters and the balance forecast are not used yet
+        return {"ead_model_parameters": [],
+                "balance_forecast": [],
+                "mortgage_book_t0": ["id", "business_line", "product_line", "region", "subregion", "mortgage_type",
+                                     "valuation", "dtv", "balance", "monthly_repayment", "months_in_arrears"]}
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
 
         first_forecast_month = ctx.get_parameter("first_forecast_month")
         last_forecast_month = ctx.get_parameter("last_forecast_month")
+        loans_per_chunk = ctx.get_parameter("loans_per_chunk")
+        months_per_chunk = ctx.get_parameter("months_per_chunk")
 
-        last_day = calendar.monthrange(first_forecast_month.year, first_forecast_month.month)[1]
-        first_forecast_month = first_forecast_month.replace(day=last_day)
-
-        last_day = calendar.monthrange(last_forecast_month.year, last_forecast_month.month)[1]
-        last_forecast_month = last_forecast_month.replace(day=last_day)
-
-        date_list = pd.date_range(first_forecast_month, last_forecast_month, freq="M", inclusive="both", name="date")
-        dates = date_list.to_series("date").to_frame("date").reset_index(drop=True)
-
-        # ead_model_parameters = ctx.get_pandas_table("ead_model_parameters")
-        balance_forecast = ctx.get_pandas_table("balance_forecast")
-        mortgage_book_t0 = ctx.get_pandas_table("mortgage_book_t0")
-
-        ead_forecast = mortgage_book_t0.drop("date", axis=1).join(dates, how="cross")
-
-        ead_forecast["time_to_default"] = 3 - ead_forecast["months_in_arrears"]
+        dates = ForecastCalendarUtils.month_grid(first_forecast_month, last_forecast_month)
 
-        ead_forecast["month_index"] = 1 + (ead_forecast["date"].dt.year - first_forecast_month.year) * 12 + ead_forecast["date"].dt.month - first_forecast_month.month
-        ead_forecast["balance"] = ead_forecast["balance"] - ead_forecast["month_index"] * ead_forecast["monthly_repayment"]
+        input_columns = self.define_input_columns()
 
-        ead_forecast["ead"] = ead_forecast["balance"] + 400 + ead_forecast["balance"] * (
-                    pow(1 + (0.05 / 12), ead_forecast["time_to_default"]) - 1)
+        # ead_model_parameters = CompactTableUtils.get_compact_table(ctx, "ead_model_parameters")
+        mortgage_book_t0 = CompactTableUtils.get_compact_table(ctx, "mortgage_book_t0", input_columns["mortgage_book_t0"])
 
-        ead_forecast.drop(["pd_12m", "in_default", "month_index"], axis=1, inplace=True)
+        # Build the account x month panel a chunk at a time
+        with StageMetrics.stage("forecast ead", rows_in=len(mortgage_book_t0)) as stage:
+            ead_forecast = ForecastPanelUtils.build_panel(
+                mortgage_book_t0, dates,
+                lambda chunk: calculate_ead_forecast(chunk, first_forecast_month),
+                loans_per_chunk, months_per_chunk)
+            stage.rows_out = len(ead_forecast)
 
         # Output the dataset
-        ctx.put_pandas_table("ead_forecast", ead_forecast)
+        CompactTableUtils.put_compact_table(ctx, "ead_forecast", ead_forecast)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
 import tracdap.rt.api as trac
 import typing as tp
 from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
 
 
 class CalculateImpairment(trac.TracModel):
@@ -13,31 +16,41 @@ class CalculateImpairment(trac.TracModel):
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
 
-        pd_forecast_schema = trac.load_schema(schemas, "pd_forecast_schema.csv")
-        lgd_forecast_schema = trac.load_schema(schemas, "lgd_forecast_schema.csv")
+        pd_forecast_schema = SchemaRegistry.load_schema(schemas, "pd_forecast_schema.csv")
+        lgd_forecast_schema = SchemaRegistry.load_schema(schemas, "lgd_forecast_schema.csv")
 
         return {"pd_forecast": trac.ModelInputSchema(pd_forecast_schema),
                 "lgd_forecast": trac.ModelInputSchema(lgd_forecast_schema)}
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
 
-        impairment_forecast_schema = trac.load_schema(schemas, "impairment_forecast_schema.csv")
+        impairment_forecast_schema = SchemaRegistry.load_schema(schemas, "impairment_forecast_schema.csv")
 
         return {"impairment_forecast": trac.ModelOutputSchema(impairment_forecast_schema)}
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        # The segment columns are taken from the LGD forecast, so they are not read twice
+        return {"pd_forecast": ["id", "date", "pd_12m", "pd_lifetime"]}
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
 
         impairment_weight = ctx.get_parameter("impairment_weight")
 
-        pd_forecast = ctx.get_pandas_table("pd_forecast")
-        lgd_forecast = ctx.get_pandas_table("lgd_forecast")
+        input_columns = self.define_input_columns()
+
+        pd_forecast = CompactTableUtils.get_compact_table(ctx, "pd_forecast", input_columns["pd_forecast"])
+        lgd_forecast = CompactTableUtils.get_compact_table(ctx, "lgd_forecast")
+
+        with StageMetrics.stage("merge pd and lgd", rows_in=len(lgd_forecast)) as stage:
+            impairment_forecast = lgd_forecast.merge(pd_forecast, on=['id', "date"])
+            stage.rows_out = len(impairment_forecast)
 
-        impairment_forecast = lgd_forecast.merge(pd_forecast[["id", "date", "pd_12m", "pd_lifetime"]], on=['id', "date"])
         impairment_forecast["ecl_12m"] = impairment_forecast["ead"] * impairment_forecast["pd_12m"] * impairment_forecast["lgd_12m"] * impairment_weight
         impairment_forecast["ecl_lifetime"] = impairment_forecast["ead"] * impairment_forecast["pd_lifetime"] * impairment_forecast["lgd_lifetime"] * impairment_weight
 
         # Output the dataset
-        ctx.put_pandas_table("impairment_forecast", impairment_forecast)
+        CompactTableUtils.put_compact_table(ctx, "impairment_forecast", impairment_forecast)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+import tracdap.rt.api as trac
+import typing as tp
+from impairment import schemas as schemas
+from impairment.calculate_impairment_mi import IMPAIRMENT_MI_SUMS, IMPAIRMENT_MI_MEANS, aggregate_impairment_totals, sum_impairment_totals, impairment_mi_from_totals
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+import numpy as np
+import pandas as pd
+
+"""
+A cube of the sums and counts behind the impairment summary, grouped by month and by every combination of a set of
+dimensions, so that any cut of the summary is answered from the cube instead of another pass over the loan level
+forecast. The cube has a row for each combination that has accounts in it, which for the sample portfolios is a few
+thousand rows against millions in the forecast.
+
+Roll-ups and slices add up the sums and counts in the cube and only then divide, so the means are means over the
+accounts in each group rather than means of the means in the cube. A dimension left out of the cube holds ALL_MEMBER
+and cannot be used in a query. Cuts can be taken from a saved cube with query_impairment_cube.py.
+"""
+
+# The dimensions a cube can be built over, the month is always in the cube
+CUBE_DIMENSIONS = ["business_line", "product_line", "region", "subregion", "mortgage_type", "dtv_band", "arrears_bucket"]
+
+# The value held by a dimension that is not in the cube
+ALL_MEMBER = "All"
+
+# The debt to value bands, each band includes its lower edge, and the name of each band
+DTV_BAND_EDGES = [0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, np.inf]
+DTV_BAND_NAMES = ["0-50%", "50-60%", "60-70%", "70-80%", "80-90%", "90-100%", "100%+"]
+
+# The arrears buckets by number of months in arrears, the last bucket includes everything above it
+ARREARS_BUCKET_NAMES = ["Up to date", "1 month", "2 months", "3+ months"]
+
+# The name of a band or bucket when the value it is worked out from is missing or out of range
+UNKNOWN_MEMBER = "Unknown"
+
+# The members of the banded dimensions in the order they are reported in
+BAND_MEMBERS = {
+    "dtv_band": DTV_BAND_NAMES + [UNKNOWN_MEMBER],
+    "arrears_bucket": ARREARS_BUCKET_NAMES + [UNKNOWN_MEMBER]
+}
+
+
+def parse_cube_dimensions(cube_dimensions: str) -> tp.List[str]:
+    """
+    Read the comma separated list of dimensions a cube is built over.
+    :param cube_dimensions: The dimensions, for example 'region,mortgage_type,dtv_band'.
+    :return: The dimensions in the order of CUBE_DIMENSIONS.
+    """
+    dimensions = [dimension.strip() for dimension in cube_dimensions.split(",") if dimension.strip()]
+    unknown_dimensions = [dimension for dimension in dimensions if dimension not in CUBE_DIMENSIONS]
+
+    if unknown_dimensions:
+        raise Exception(f"Unknown cube dimensions: {', '.join(unknown_dimensions)}, use any of {', '.join(CUBE_DIMENSIONS)}")
+
+    return [dimension for dimension in CUBE_DIMENSIONS if dimension in dimensions]
+
+
+def add_band_columns(impairment_forecast: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the debt to value band and the arrears bucket of each row to the impairment forecast.
+    :param impairment_forecast: The impairment forecast.
+    :return: The forecast with dtv_band and arrears_bucket as categorical columns.
+    """
+    dtv = impairment_forecast["dtv"].to_numpy(dtype="float64", na_value=np.nan)
+    dtv_codes = np.searchsorted(DTV_BAND_EDGES, dtv, side="right") - 1
+    dtv_codes[~(dtv >= 0)] = len(DTV_BAND_NAMES)
+
+    months_in_arrears = impairment_forecast["months_in_arrears"].to_numpy(dtype="float64", na_value=np.nan)
+    arrears_codes = np.minimum(months_in_arrears, len(ARREARS_BUCKET_NAMES) - 1)
+    arrears_codes = np.where(months_in_arrears >= 0, arrears_codes, len(ARREARS_BUCKET_NAMES)).astype("int64")
+
+    impairment_forecast = impairment_forecast.copy()
+    impairment_forecast["dtv_band"] = pd.Categorical.from_codes(dtv_codes, BAND_MEMBERS["dtv_band"])
+    impairment_forecast["arrears_bucket"] = pd.Categorical.from_codes(arrears_codes, BAND_MEMBERS["arrears_bucket"])
+
+    return impairment_forecast
+
+
+def build_impairment_cube(impairment_forecast: pd.DataFrame, dimensions: tp.List[str]) -> pd.DataFrame:
+    """
+    Work out the sums and counts of the impairment summary for each month and combination of the dimensions.
+    :param impairment_forecast: The impairment forecast, one row per account and month.
+    :param dimensions: The dimensions to build the cube over, any of CUBE_DIMENSIONS.
+    :return: The cube, with ALL_MEMBER in the dimensions that are not in it.
+    """
+    impairment_forecast = add_band_columns(impairment_forecast)
+
+    impairment_cube = aggregate_impairment_totals(impairment_forecast, ["date"] + dimensions)
+
+    for dimension in CUBE_DIMENSIONS:
+        if dimension not in dimensions:
+            impairment_cube[dimension] = ALL_MEMBER
+
+    return impairment_cube.sort_values(by=["date"] + CUBE_DIMENSIONS, ascending=True).reset_index(drop=True)
+
+
+def query_impairment_cube(impairment_cube: pd.DataFrame, group_by: tp.List[str],
+                          filters: tp.Optional[tp.Dict[str, tp.Union[str, tp.List[str]]]] = None) -> pd.DataFrame:
+    """
+    Answer a cut of the impairment summary from the cube, for some of the dimensions and some of their values.
+    :param impairment_cube: The cube from build_impairment_cube.
+    :param group_by: The columns to summarise by, the month and any of the dimensions in the cube. Everything else is
+    added up, an empty list gives the grand total.
+    :param filters: The values to keep for some of the dimensions, a single value or a list of values.
+    :return: The impairment summary for the cut, with a total and mean for each column as in the impairment summary,
+    sorted by the group by columns.
+    """
+    filters = filters or dict()
+
+    for column in list(group_by) + list(filters):
+        if column != "date" and column not in CUBE_DIMENSIONS:
+            raise Exception(f"Unknown cube dimension: {column}, use the date or any of {', '.join(CUBE_DIMENSIONS)}")
+        if column != "date" and len(impairment_cube) > 0 and (impairment_cube[column] == ALL_MEMBER).all():
+            raise Exception(f"The cube was not built over {column}, build it again with {column} in its dimensions")
+
+    selected = np.ones(len(impairment_cube), dtype=bool)
+
+    for column, values in filters.items():
+        selected &= impairment_cube[column].isin([values] if isinstance(values, str) else values).to_numpy()
+
+    impairment_cube = impairment_cube[selected]
+
+    # Bands are reported in band order rather than in the order of their names
+    band_columns = [column for column in group_by if column in BAND_MEMBERS]
+
+    if band_columns:
+        impairment_cube = impairment_cube.astype({column: pd.CategoricalDtype(BAND_MEMBERS[column]) for column in band_columns})
+
+    # The grand total is grouped by a constant, which is dropped again after the means are worked out
+    if not group_by:
+        impairment_totals = sum_impairment_totals(impairment_cube.assign(total=ALL_MEMBER), ["total"])
+        return impairment_mi_from_totals(impairment_totals, ["total"]).drop(columns=["total"])
+
+    impairment_totals = sum_impairment_totals(impairment_cube, list(group_by))
+
+    return impairment_mi_from_totals(impairment_totals, list(group_by))
+
+
+class CalculateImpairmentCube(trac.TracModel):
+
+    def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
+        return trac.declare_parameters(
+            trac.P("cube_dimensions", trac.STRING, label="Comma separated dimensions to build the cube over", default_value=",".join(CUBE_DIMENSIONS))
+        )
+
+    def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
+        impairment_forecast_schema = SchemaRegistry.load_schema(schemas, "impairment_forecast_schema.csv")
+
+        return {"impairment_forecast": trac.ModelInputSchema(impairment_forecast_schema)}
+
+    def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
+        impairment_cube_schema = SchemaRegistry.load_schema(schemas, "impairment_cube_schema.csv")
+
+        return {"impairment_cube": trac.ModelOutputSchema(impairment_cube_schema)}
+
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        # Every dimension the cube can be built over, the bands are worked out from the debt to value and arrears
+        dimension_columns = [dimension for dimension in CUBE_DIMENSIONS if dimension not in BAND_MEMBERS]
+
+        return {"impairment_forecast": ["date"] + dimension_columns + ["dtv", "months_in_arrears"] +
+                                       list(IMPAIRMENT_MI_SUMS) + list(IMPAIRMENT_MI_MEANS)}
+
+    @StageMetrics.instrument
+    def run_model(self, ctx: trac.TracContext):
+        dimensions = parse_cube_dimensions(ctx.get_parameter("cube_dimensions"))
+        input_columns = self.define_input_columns()
+
+        impairment_forecast = CompactTableUtils.get_compact_table(ctx, "impairment_forecast", input_columns["impairment_forecast"])
+
+        with StageMetrics.stage("aggregate", rows_in=len(impairment_forecast)) as stage:
+            impairment_cube = build_impairment_cube(impairment_forecast, dimensions)
+            stage.rows_out = len(impairment_cube)
+
+        ctx.log().info(f"Built an impairment cube of {len(impairment_cube)} rows over {', '.join(['date'] + dimensions)}")
+
+        # Output the dataset
+        CompactTableUtils.put_compact_table(ctx, "impairment_cube", impairment_cube)
+
+
+if __name__ == "__main__":
+    import tracdap.rt.launch as launch
+
+    launch.launch_model(CalculateImpairmentCube, "config/impairment/calculate_impairment_cube.yaml", "config/sys_config.yaml")
@@ -1,6 +1,144 @@
 import tracdap.rt.api as trac
 import typing as tp
 from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+import numpy as np
+import pandas as pd
+
+# The columns the impairment summary is grouped by
+IMPAIRMENT_MI_GROUP_BY = ["business_line", "mortgage_type", "date"]
+
+
+def calculate_impairment_mi(impairment_forecast: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarise the impairment forecast by business line, mortgage type and month.
+    :param impairment_forecast: The impairment forecast, one row per account and month.
+    :return: The impairment summary, sorted by the group by columns.
+    """
+    impairment_mi = (impairment_forecast.groupby(IMPAIRMENT_MI_GROUP_BY, as_index=False, observed=True)
+          .agg({'balance': 'sum', 'ead': 'sum', 'pd_12m': 'mean', 'pd_lifetime': 'mean', 'lgd_12m': 'mean', 'lgd_lifetime': 'mean', 'ecl_12m': 'sum', 'ecl_lifetime': 'sum'})
+          .rename(columns={'balance': 'total_balance', 'ead': 'total_ead', 'pd_12m': 'mean_pd_12m', 'pd_lifetime': 'mean_pd_lifetime', 'lgd_12m': 'mean_lgd_12m', 'lgd_lifetime': 'mean_lgd_lifetime', 'ecl_12m': 'total_ecl_12m', 'ecl_lifetime': 'total_ecl_lifetime'}))
+
+    return impairment_mi.sort_values(by=IMPAIRMENT_MI_GROUP_BY, ascending=True)
+
+
+# The columns of the impairment forecast that the summary adds up and those it averages, with their summary names
+IMPAIRMENT_MI_SUMS = {"balance": "total_balance", "ead": "total_ead", "ecl_12m": "total_ecl_12m", "ecl_lifetime": "total_ecl_lifetime"}
+IMPAIRMENT_MI_MEANS = {"pd_12m": "mean_pd_12m", "pd_lifetime": "mean_pd_lifetime", "lgd_12m": "mean_lgd_12m", "lgd_lifetime": "mean_lgd_lifetime"}
+
+# The columns of the impairment forecast the summary reads
+IMPAIRMENT_MI_COLUMNS = IMPAIRMENT_MI_GROUP_BY + list(IMPAIRMENT_MI_SUMS) + list(IMPAIRMENT_MI_MEANS)
+
+
+def aggregate_impairment_totals(impairment_forecast: pd.DataFrame, group_by: tp.List[str] = None) -> pd.DataFrame:
+    """
+    Work out the sums and counts the impairment summary is made from, these can be added to and taken away from as
+    accounts come into and leave the forecast, without grouping the whole forecast again.
+    :param impairment_forecast: The impairment forecast, or some of its rows.
+    :param group_by: The columns to group by, the columns of the impairment summary if not given.
+    :return: For each group the number of rows, the sum of every summary column and the number of values in each
+    averaged column.
+    """
+    group_by = group_by or IMPAIRMENT_MI_GROUP_BY
+    value_columns = list(IMPAIRMENT_MI_SUMS) + list(IMPAIRMENT_MI_MEANS)
+
+    grouped = impairment_forecast.groupby(group_by, as_index=False, observed=True)
+
+    totals = grouped.size().rename(columns={"size": "row_count"})
+    totals[[f"sum_{column}" for column in value_columns]] = grouped[value_columns].sum()[value_columns].to_numpy(dtype="float64", na_value=np.nan)
+    totals[[f"count_{column}" for column in IMPAIRMENT_MI_MEANS]] = grouped[list(IMPAIRMENT_MI_MEANS)].count()[list(IMPAIRMENT_MI_MEANS)].to_numpy(dtype="int64")
+
+    # Plain strings rather than categoricals, so totals built from different rows can be put together
+    return totals.astype({column: str for column in group_by if column != "date"})
+
+
+def sum_impairment_totals(impairment_totals: pd.DataFrame, group_by: tp.List[str]) -> pd.DataFrame:
+    """
+    Add up sums and counts over coarser groups. A missing sum stays missing, as it does when the impairment forecast
+    is summarised directly.
+    :param impairment_totals: Totals from aggregate_impairment_totals.
+    :param group_by: The columns to group by, these must be among the columns the totals are grouped by.
+    :return: The totals of each group, sorted by the group by columns.
+    """
+    sum_columns = [column for column in impairment_totals.columns if column.startswith("sum_")]
+    missing_columns = [f"missing_{column}" for column in sum_columns]
+
+    impairment_totals = impairment_totals.copy()
+    impairment_totals[missing_columns] = np.isnan(impairment_totals[sum_columns].to_numpy(dtype="float64"))
+
+    value_columns = [column for column in impairment_totals.columns if column.startswith(("row_count", "sum_", "count_", "missing_"))]
+    impairment_totals = impairment_totals.groupby(group_by, as_index=False, sort=True, observed=True)[value_columns].sum()
+
+    for column, missing_column in zip(sum_columns, missing_columns):
+        impairment_totals.loc[impairment_totals[missing_column] > 0, column] = np.nan
+
+    return impairment_totals.drop(columns=missing_columns)
+
+
+def update_impairment_totals(impairment_totals: pd.DataFrame, added_rows: pd.DataFrame, removed_rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    Update the sums and counts for rows added to and removed from the impairment forecast, groups left with no rows
+    are dropped.
+    :param impairment_totals: The totals from aggregate_impairment_totals.
+    :param added_rows: The rows added to the impairment forecast.
+    :param removed_rows: The rows removed from the impairment forecast.
+    :return: The updated totals.
+    """
+    removed_totals = aggregate_impairment_totals(removed_rows)
+    value_columns = [column for column in removed_totals.columns if column not in IMPAIRMENT_MI_GROUP_BY]
+    removed_totals[value_columns] = -removed_totals[value_columns]
+
+    # Infinite and missing values cannot be taken away again, a group that has one is left infinite or missing here
+    impairment_totals = sum_impairment_totals(
+        pd.concat([impairment_totals, aggregate_impairment_totals(added_rows), removed_totals], ignore_index=True),
+        IMPAIRMENT_MI_GROUP_BY)
+
+    return impairment_totals[impairment_totals["row_count"] > 0].reset_index(drop=True)
+
+
+def recalculate_nonfinite_totals(impairment_totals: pd.DataFrame, impairment_forecast: pd.DataFrame) -> pd.DataFrame:
+    """
+    Work out again from the impairment forecast the totals of the groups with a sum that is infinite or missing, as
+    these cannot be kept up to date by adding and taking away.
+    :param impairment_totals: The totals from update_impairment_totals.
+    :param impairment_forecast: The whole impairment forecast the totals are for.
+    :return: The totals, sorted by the group by columns.
+    """
+    sum_columns = [column for column in impairment_totals.columns if column.startswith("sum_")]
+    nonfinite = ~np.isfinite(impairment_totals[sum_columns].to_numpy(dtype="float64")).all(axis=1)
+
+    if not nonfinite.any():
+        return impairment_totals
+
+    group_rows = (impairment_forecast.astype({column: str for column in IMPAIRMENT_MI_GROUP_BY[:-1]})
+                  .merge(impairment_totals.loc[nonfinite, IMPAIRMENT_MI_GROUP_BY], on=IMPAIRMENT_MI_GROUP_BY))
+
+    impairment_totals = pd.concat([impairment_totals[~nonfinite], aggregate_impairment_totals(group_rows)], ignore_index=True)
+
+    return impairment_totals.sort_values(by=IMPAIRMENT_MI_GROUP_BY, ascending=True).reset_index(drop=True)
+
+
+def impairment_mi_from_totals(impairment_totals: pd.DataFrame, group_by: tp.List[str] = None) -> pd.DataFrame:
+    """
+    Make the impairment summary from its sums and counts, an average with no values to average is missing.
+    :param impairment_totals: The totals from aggregate_impairment_totals.
+    :param group_by: The columns the totals are grouped by, the columns of the impairment summary if not given.
+    :return: The impairment summary, sorted by the group by columns.
+    """
+    group_by = group_by or IMPAIRMENT_MI_GROUP_BY
+    impairment_mi = impairment_totals[group_by].copy()
+
+    for column, summary_column in IMPAIRMENT_MI_SUMS.items():
+        impairment_mi[summary_column] = impairment_totals[f"sum_{column}"]
+
+    for column, summary_column in IMPAIRMENT_MI_MEANS.items():
+        counts = impairment_totals[f"count_{column}"].to_numpy(dtype="float64")
+        impairment_mi[summary_column] = np.divide(impairment_totals[f"sum_{column}"].to_numpy(dtype="float64"), counts,
+                                                  out=np.full(len(counts), np.nan), where=counts > 0)
+
+    return impairment_mi.sort_values(by=group_by, ascending=True).reset_index(drop=True)
 
 
 class CalculateImpairmentMI(trac.TracModel):
@@ -9,27 +147,30 @@ class CalculateImpairmentMI(trac.TracModel):
         return trac.declare_parameters()
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        impairment_forecast_schema = trac.load_schema(schemas, "impairment_forecast_schema.csv")
+        impairment_forecast_schema = SchemaRegistry.load_schema(schemas, "impairment_forecast_schema.csv")
 
         return {"impairment_forecast": trac.ModelInputSchema(impairment_forecast_schema)}
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        impairment_mi_schema = trac.load_schema(schemas, "impairment_mi_schema.csv")
+        impairment_mi_schema = SchemaRegistry.load_schema(schemas, "impairment_mi_schema.csv")
 
         return {"impairment_mi": trac.ModelOutputSchema(impairment_mi_schema)}
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {"impairment_forecast": IMPAIRMENT_MI_COLUMNS}
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
-        impairment_forecast = ctx.get_pandas_table("impairment_forecast")
+        input_columns = self.define_input_columns()
 
-        group_by_list = ['business_line', "mortgage_type", "date"]
-        impairment_mi = (impairment_forecast.groupby(group_by_list, as_index=False)
-              .agg({'balance': 'sum', 'ead': 'sum', 'pd_12m': 'mean', 'pd_lifetime': 'mean', 'lgd_12m': 'mean', 'lgd_lifetime': 'mean', 'ecl_12m': 'sum', 'ecl_lifetime': 'sum'})
-              .rename(columns={'balance': 'total_balance', 'ead': 'total_ead', 'pd_12m': 'mean_pd_12m', 'pd_lifetime': 'mean_pd_lifetime', 'lgd_12m': 'mean_lgd_12m', 'lgd_lifetime': 'mean_lgd_lifetime', 'ecl_12m': 'total_ecl_12m', 'ecl_lifetime': 'total_ecl_lifetime'}))
+        impairment_forecast = CompactTableUtils.get_compact_table(ctx, "impairment_forecast", input_columns["impairment_forecast"])
 
-        impairment_mi = impairment_mi.sort_values(by=group_by_list, ascending=True)
+        with StageMetrics.stage("aggregate", rows_in=len(impairment_forecast)) as stage:
+            impairment_mi = calculate_impairment_mi(impairment_forecast)
+            stage.rows_out = len(impairment_mi)
 
         # Output the dataset
-        ctx.put_pandas_table("impairment_mi", impairment_mi)
+        CompactTableUtils.put_compact_table(ctx, "impairment_mi", impairment_mi)
 
 
 if __name__ == "__main__":
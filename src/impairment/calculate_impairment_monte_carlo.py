@@ -0,0 +1,350 @@
+import tracdap.rt.api as trac
+import typing as tp
+import concurrent.futures as futures
+from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from impairment.calculate_impairment_mi import IMPAIRMENT_MI_GROUP_BY, IMPAIRMENT_MI_COLUMNS, calculate_impairment_mi
+import numpy as np
+import pandas as pd
+
+"""
+A Monte Carlo version of the impairment summary. The impairment forecast gives one ECL per account and month, this
+model simulates a number of scenario paths around it and reports the distribution of the total ECL for each business
+line, mortgage type and month as well as the totals from CalculateImpairmentMI.
+
+On each path the PD and LGD of every account and month are scaled by lognormal multipliers with a mean of one. A
+multiplier combines a systematic factor, shared by every account, that follows an AR(1) path through the months of the
+forecast, and an idiosyncratic factor drawn once for each account on each path. PD and LGD rise and fall together with
+the systematic factor, so the mean ECL over the paths is above the deterministic total by a factor of about
+exp(pd_systematic_volatility x lgd_systematic_volatility), less where the PD or LGD on a path is capped at one.
+
+The paths are worked out as accounts x months x paths arrays, a block of accounts and a block of paths at a time. The
+ECL, PD and LGD of a block of accounts are laid out as accounts x months arrays only when the block is simulated, so the
+working memory depends on loans_per_block x months x paths_per_block rather than on the size of the book. Beyond the
+impairment forecast itself, the only memory that grows with the book is an index of the forecast rows by account, two
+integers per row, and the segment of each account. Each block of paths has its own random number generator spawned from
+the seed, so the results depend on the seed and paths_per_block and are exactly the same for any number of workers.
+Changing loans_per_block only changes the rounding, in the last bits of the totals, as the accounts are added up by
+segment in a different order. The blocks of paths are shared out between a pool of threads, NumPy releases the GIL for
+the random number generation and array arithmetic so the threads run on separate cores.
+
+Run it in place of CalculateImpairmentMI in the impairment pipeline with:
+    PYTHONPATH=src python src/impairment/impairment_pipeline.py config/impairment/impairment_pipeline_monte_carlo.yaml --monte-carlo
+"""
+
+# The horizons that ECL is simulated for, each needs the ecl, pd and lgd columns for the horizon in the forecast
+ECL_HORIZONS = ["12m", "lifetime"]
+
+# The statistics of the simulated ECL that are reported, keyed by the suffix of the output column
+ECL_PATH_QUANTILES = {"p95": 0.95, "p99_5": 0.995}
+
+
+class PathModel(tp.NamedTuple):
+    """
+    The volatilities of the PD and LGD multipliers and the persistence of the systematic factor from month to month.
+    """
+    pd_systematic_volatility: float
+    pd_idiosyncratic_volatility: float
+    lgd_systematic_volatility: float
+    lgd_idiosyncratic_volatility: float
+    systematic_persistence: float
+
+
+class ForecastArrays(tp.NamedTuple):
+    """
+    The impairment forecast indexed by account, so the rows of a block of accounts can be laid out as accounts x
+    months arrays when the block is simulated. The rows of account i are row_order[account_starts[i]:account_starts[i + 1]].
+    """
+    columns: tp.Dict[str, pd.Series]
+    row_order: np.ndarray
+    account_starts: np.ndarray
+    month_index: np.ndarray
+    segment_codes: np.ndarray
+    segments: pd.DataFrame
+    dates: pd.Index
+
+
+class BlockArrays(tp.NamedTuple):
+    """
+    A block of accounts held as accounts x months arrays, for each horizon the ECL and the largest multiplier the PD
+    and LGD can take before they reach one.
+    """
+    ecl: tp.Dict[str, np.ndarray]
+    pd_cap: tp.Dict[str, np.ndarray]
+    lgd_cap: tp.Dict[str, np.ndarray]
+
+
+def multiplier_cap(rate: np.ndarray) -> np.ndarray:
+    """
+    The largest multiplier a PD or LGD can take before it reaches one, infinite when the rate is zero or missing so
+    the multiplier is not capped.
+    """
+    return np.divide(1.0, rate, out=np.full(rate.shape, np.inf), where=rate > 0)
+
+
+def make_forecast_arrays(impairment_forecast: pd.DataFrame) -> ForecastArrays:
+    """
+    Index the impairment forecast by account. Each account belongs to the business line and mortgage type on its first
+    row, months an account has no row for have no ECL.
+    :param impairment_forecast: The impairment forecast, one row per account and month.
+    :return: The forecast arrays.
+    """
+    account_index, accounts = pd.factorize(impairment_forecast["id"])
+    month_index, dates = pd.factorize(impairment_forecast["date"], sort=True)
+
+    # A stable sort keeps the rows of each account in forecast order, so the first row of an account comes first
+    row_order = np.argsort(account_index, kind="stable")
+    account_starts = np.concatenate([[0], np.cumsum(np.bincount(account_index, minlength=len(accounts)))])
+
+    first_rows = row_order[account_starts[:-1]]
+    account_segments = impairment_forecast[IMPAIRMENT_MI_GROUP_BY[:-1]].iloc[first_rows].reset_index(drop=True)
+
+    account_segment_groups = account_segments.groupby(IMPAIRMENT_MI_GROUP_BY[:-1], observed=True)
+    segment_codes = account_segment_groups.ngroup().to_numpy()
+    segments = account_segment_groups.size().reset_index()[IMPAIRMENT_MI_GROUP_BY[:-1]]
+
+    columns = {column_name: impairment_forecast[column_name] for horizon in ECL_HORIZONS for column_name in [f"ecl_{horizon}", f"pd_{horizon}", f"lgd_{horizon}"]}
+
+    return ForecastArrays(columns, row_order, account_starts, month_index.astype(np.int32), segment_codes, segments, pd.Index(dates))
+
+
+def make_block_arrays(forecast: ForecastArrays, accounts: slice) -> BlockArrays:
+    """
+    Lay a block of accounts out as accounts x months arrays.
+    :param forecast: The forecast arrays.
+    :param accounts: The accounts in the block.
+    :return: The block arrays.
+    """
+    block_size = accounts.stop - accounts.start
+    account_starts = forecast.account_starts[accounts.start:accounts.stop + 1]
+
+    rows = forecast.row_order[account_starts[0]:account_starts[-1]]
+    block_accounts = np.repeat(np.arange(block_size), np.diff(account_starts))
+    block_months = forecast.month_index[rows]
+
+    def to_array(column_name: str, fill_value: float) -> np.ndarray:
+        array = np.full((block_size, len(forecast.dates)), fill_value)
+        array[block_accounts, block_months] = forecast.columns[column_name].iloc[rows].to_numpy(dtype="float64", na_value=np.nan)
+        return array
+
+    ecl = dict()
+    pd_cap = dict()
+    lgd_cap = dict()
+
+    for horizon in ECL_HORIZONS:
+        # A missing ECL counts as zero, in the same way as the sums in the deterministic summary
+        ecl[horizon] = np.nan_to_num(to_array(f"ecl_{horizon}", 0.0), nan=0.0)
+        pd_cap[horizon] = multiplier_cap(to_array(f"pd_{horizon}", 0.0))
+        lgd_cap[horizon] = multiplier_cap(to_array(f"lgd_{horizon}", 0.0))
+
+    return BlockArrays(ecl, pd_cap, lgd_cap)
+
+
+def simulate_systematic_factor(rng: np.random.Generator, number_of_months: int, number_of_paths: int, persistence: float) -> np.ndarray:
+    """
+    Simulate the systematic factor as a stationary AR(1) process with unit variance.
+    :return: A months x paths array.
+    """
+    shocks = rng.standard_normal((number_of_months, number_of_paths))
+
+    factor = np.empty_like(shocks)
+    factor[0] = shocks[0]
+
+    for month in range(1, number_of_months):
+        factor[month] = persistence * factor[month - 1] + np.sqrt(1 - persistence ** 2) * shocks[month]
+
+    return factor
+
+
+def simulate_path_block(forecast: ForecastArrays, path_model: PathModel, seed_sequence: np.random.SeedSequence,
+                        number_of_paths: int, loans_per_block: int) -> tp.Dict[str, np.ndarray]:
+    """
+    Simulate a block of paths and add up the ECL on each one by segment and month.
+    :param forecast: The forecast arrays.
+    :param path_model: The volatilities and persistence of the multipliers.
+    :param seed_sequence: The seed for the block.
+    :param number_of_paths: The number of paths in the block.
+    :param loans_per_block: The number of accounts to simulate at a time.
+    :return: For each horizon a segments x months x paths array of total ECL.
+    """
+    rng = np.random.default_rng(seed_sequence)
+
+    number_of_accounts, number_of_months = len(forecast.segment_codes), len(forecast.dates)
+    number_of_segments = len(forecast.segments)
+
+    systematic_factor = simulate_systematic_factor(rng, number_of_months, number_of_paths, path_model.systematic_persistence)
+
+    # The lognormal multipliers have a mean of one, the drift is taken off the idiosyncratic part
+    pd_systematic = path_model.pd_systematic_volatility * systematic_factor
+    lgd_systematic = path_model.lgd_systematic_volatility * systematic_factor
+    pd_drift = (path_model.pd_systematic_volatility ** 2 + path_model.pd_idiosyncratic_volatility ** 2) / 2
+    lgd_drift = (path_model.lgd_systematic_volatility ** 2 + path_model.lgd_idiosyncratic_volatility ** 2) / 2
+
+    totals = {horizon: np.zeros((number_of_segments, number_of_months * number_of_paths)) for horizon in ECL_HORIZONS}
+
+    for start in range(0, number_of_accounts, loans_per_block):
+
+        accounts = slice(start, min(start + loans_per_block, number_of_accounts))
+        block_size = accounts.stop - accounts.start
+        block = make_block_arrays(forecast, accounts)
+
+        # Both idiosyncratic draws come from one array, so blocks of accounts take the same numbers whatever their size
+        idiosyncratic = rng.standard_normal((block_size, 2, number_of_paths))
+        pd_idiosyncratic = path_model.pd_idiosyncratic_volatility * idiosyncratic[:, 0] - pd_drift
+        lgd_idiosyncratic = path_model.lgd_idiosyncratic_volatility * idiosyncratic[:, 1] - lgd_drift
+
+        # accounts x months x paths
+        pd_multiplier = np.exp(pd_systematic[np.newaxis, :, :] + pd_idiosyncratic[:, np.newaxis, :])
+        lgd_multiplier = np.exp(lgd_systematic[np.newaxis, :, :] + lgd_idiosyncratic[:, np.newaxis, :])
+
+        # A matrix that adds up the accounts in the block by segment
+        block_segments = forecast.segment_codes[accounts]
+        segment_matrix = np.zeros((number_of_segments, block_size))
+        segment_matrix[block_segments, np.arange(block_size)] = 1.0
+
+        for horizon in ECL_HORIZONS:
+
+            path_ecl = np.minimum(pd_multiplier, block.pd_cap[horizon][:, :, np.newaxis])
+            path_ecl *= np.minimum(lgd_multiplier, block.lgd_cap[horizon][:, :, np.newaxis])
+            path_ecl *= block.ecl[horizon][:, :, np.newaxis]
+
+            totals[horizon] += segment_matrix @ path_ecl.reshape(block_size, number_of_months * number_of_paths)
+
+    return {horizon: total.reshape(number_of_segments, number_of_months, number_of_paths) for horizon, total in totals.items()}
+
+
+def simulate_ecl_paths(forecast: ForecastArrays, path_model: PathModel, number_of_paths: int, paths_per_block: int,
+                       loans_per_block: int, seed: int, max_workers: int = 1) -> tp.Dict[str, np.ndarray]:
+    """
+    Simulate every path, a block of paths at a time.
+    :param forecast: The forecast arrays.
+    :param path_model: The volatilities and persistence of the multipliers.
+    :param number_of_paths: The number of paths to simulate.
+    :param paths_per_block: The number of paths to simulate at a time.
+    :param loans_per_block: The number of accounts to simulate at a time.
+    :param seed: The random number seed.
+    :param max_workers: The number of threads simulating blocks of paths at the same time.
+    :return: For each horizon a segments x months x paths array of total ECL.
+    """
+    block_sizes = [min(paths_per_block, number_of_paths - start) for start in range(0, number_of_paths, paths_per_block)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(block_sizes))
+
+    def run_block(block_index: int) -> tp.Dict[str, np.ndarray]:
+        return simulate_path_block(forecast, path_model, seed_sequences[block_index], block_sizes[block_index], loans_per_block)
+
+    if max_workers > 1:
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            block_totals = list(executor.map(run_block, range(len(block_sizes))))
+    else:
+        block_totals = [run_block(block_index) for block_index in range(len(block_sizes))]
+
+    return {horizon: np.concatenate([totals[horizon] for totals in block_totals], axis=2) for horizon in ECL_HORIZONS}
+
+
+def summarise_ecl_paths(forecast: ForecastArrays, path_totals: tp.Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Work out the mean and quantiles of the total ECL over the paths for each segment and month.
+    :param forecast: The forecast arrays, for the segments and dates.
+    :param path_totals: The segments x months x paths arrays from simulate_ecl_paths.
+    :return: One row per segment and month.
+    """
+    number_of_segments, number_of_months = len(forecast.segments), len(forecast.dates)
+
+    ecl_paths = forecast.segments.iloc[np.repeat(np.arange(number_of_segments), number_of_months)].reset_index(drop=True)
+    ecl_paths["date"] = np.tile(forecast.dates.to_numpy(), number_of_segments)
+
+    for horizon in ECL_HORIZONS:
+
+        ecl_paths[f"ecl_{horizon}_mean"] = path_totals[horizon].mean(axis=2).ravel()
+
+        quantiles = np.quantile(path_totals[horizon], list(ECL_PATH_QUANTILES.values()), axis=2)
+
+        for quantile_name, quantile in zip(ECL_PATH_QUANTILES, quantiles):
+            ecl_paths[f"ecl_{horizon}_{quantile_name}"] = quantile.ravel()
+
+    return ecl_paths
+
+
+class CalculateImpairmentMonteCarlo(trac.TracModel):
+
+    def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
+        return trac.declare_parameters(
+            trac.P("number_of_paths", trac.INTEGER, label="Number of scenario paths to simulate", default_value=1000),
+            trac.P("paths_per_block", trac.INTEGER, label="Number of paths to simulate at a time", default_value=100),
+            trac.P("loans_per_block", trac.INTEGER, label="Number of accounts to simulate at a time", default_value=2000),
+            trac.P("seed", trac.INTEGER, label="Random number seed", default_value=0),
+            trac.P("max_workers", trac.INTEGER, label="Number of threads simulating blocks of paths (1 to run serially)", default_value=1),
+            trac.P("pd_systematic_volatility", trac.FLOAT, label="Volatility of the systematic PD multiplier", default_value=0.3),
+            trac.P("pd_idiosyncratic_volatility", trac.FLOAT, label="Volatility of the account PD multiplier", default_value=0.2),
+            trac.P("lgd_systematic_volatility", trac.FLOAT, label="Volatility of the systematic LGD multiplier", default_value=0.15),
+            trac.P("lgd_idiosyncratic_volatility", trac.FLOAT, label="Volatility of the account LGD multiplier", default_value=0.1),
+            trac.P("systematic_persistence", trac.FLOAT, label="Month to month persistence of the systematic factor", default_value=0.9)
+        )
+
+    def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
+        impairment_forecast_schema = SchemaRegistry.load_schema(schemas, "impairment_forecast_schema.csv")
+
+        return {"impairment_forecast": trac.ModelInputSchema(impairment_forecast_schema)}
+
+    def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
+        impairment_mi_schema = SchemaRegistry.load_schema(schemas, "impairment_mi_monte_carlo_schema.csv")
+
+        return {"impairment_mi": trac.ModelOutputSchema(impairment_mi_schema)}
+
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        # The paths are simulated account by account, so the account ID is needed as well as the summary columns
+        return {"impairment_forecast": ["id"] + IMPAIRMENT_MI_COLUMNS}
+
+    @StageMetrics.instrument
+    def run_model(self, ctx: trac.TracContext):
+
+        number_of_paths = ctx.get_parameter("number_of_paths")
+        paths_per_block = ctx.get_parameter("paths_per_block")
+        loans_per_block = ctx.get_parameter("loans_per_block")
+        seed = ctx.get_parameter("seed")
+        max_workers = ctx.get_parameter("max_workers")
+
+        if number_of_paths < 1 or paths_per_block < 1 or loans_per_block < 1:
+            raise Exception("The number of paths, paths per block and loans per block must all be at least 1")
+
+        path_model = PathModel(
+            ctx.get_parameter("pd_systematic_volatility"),
+            ctx.get_parameter("pd_idiosyncratic_volatility"),
+            ctx.get_parameter("lgd_systematic_volatility"),
+            ctx.get_parameter("lgd_idiosyncratic_volatility"),
+            ctx.get_parameter("systematic_persistence"))
+
+        if not 0 <= path_model.systematic_persistence < 1:
+            raise Exception(f"The systematic persistence must be at least 0 and less than 1, got {path_model.systematic_persistence}")
+
+        impairment_forecast = CompactTableUtils.get_compact_table(ctx, "impairment_forecast", self.define_input_columns()["impairment_forecast"])
+
+        with StageMetrics.stage("aggregate", rows_in=len(impairment_forecast)) as stage:
+            impairment_mi = calculate_impairment_mi(impairment_forecast)
+            stage.rows_out = len(impairment_mi)
+
+        with StageMetrics.stage("arrange forecast", rows_in=len(impairment_forecast)):
+            forecast = make_forecast_arrays(impairment_forecast)
+
+        del impairment_forecast
+
+        ctx.log().info("Simulating %s paths for %s accounts and %s months with %s workers",
+                       number_of_paths, len(forecast.segment_codes), len(forecast.dates), max_workers)
+
+        with StageMetrics.stage("simulate paths") as stage:
+            path_totals = simulate_ecl_paths(forecast, path_model, number_of_paths, paths_per_block, loans_per_block, seed, max_workers)
+            ecl_paths = summarise_ecl_paths(forecast, path_totals)
+            stage.rows_out = len(ecl_paths)
+
+        impairment_mi = impairment_mi.merge(ecl_paths, on=IMPAIRMENT_MI_GROUP_BY, how="left")
+
+        # Output the dataset
+        CompactTableUtils.put_compact_table(ctx, "impairment_mi", impairment_mi)
+
+
+if __name__ == "__main__":
+    import tracdap.rt.launch as launch
+
+    launch.launch_model(CalculateImpairmentMonteCarlo, "config/impairment/calculate_impairment_monte_carlo.yaml", "config/sys_config.yaml")
@@ -1,9 +1,108 @@
 import tracdap.rt.api as trac
 import typing as tp
-import random
+import numpy as np
+import pandas as pd
 from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_keyed_random import KeyedRandomUtils
 import datetime
 
+# The LGD model assumptions, any of these can be overridden by a row in the lgd_model_parameters input with the same
+# value in the 'variable' column
+DEFAULT_LGD_MODEL_PARAMETERS = {
+    "legal_costs": 0.0,
+    "time_from_default_to_possession": 6,
+    "time_from_possession_to_sale": 3,
+    "fsd_less_than_30": 0.1,
+    "fsd_30_to_60": 0.2,
+    "fsd_60_to_80": 0.25,
+    "fsd_80_to_90": 0.3,
+    "fsd_greater_than_90": 0.5,
+    "lgd_12m_mean": 0.2,
+    "lgd_12m_standard_deviation": 0.2,
+    "lgd_12m_minimum": 0.0,
+    "lgd_12m_maximum": 0.8,
+    "lgd_lifetime_multiplier_mean": 1.0,
+    "lgd_lifetime_multiplier_standard_deviation": 1.0,
+    "lgd_lifetime_multiplier_minimum": 1.0,
+    "lgd_lifetime_multiplier_maximum": 1.1
+}
+
+# The forced sale discount of each debt to value band, each band includes its lower edge. An account with a missing
+# debt to value is given the discount of the highest band
+FORCED_SALE_DISCOUNT_BAND_EDGES = np.array([0.3, 0.6, 0.8, 0.9])
+FORCED_SALE_DISCOUNT_BANDS = ["fsd_less_than_30", "fsd_30_to_60", "fsd_60_to_80", "fsd_80_to_90", "fsd_greater_than_90"]
+
+# The columns that identify a row of the forecast, the random draws for a row depend only on these and the seed
+LGD_DRAW_KEYS = ["id", "date"]
+
+
+def get_lgd_model_parameters(lgd_model_parameters: pd.DataFrame) -> tp.Dict[str, float]:
+    """
+    Combine the lgd_model_parameters input with the default assumptions.
+    :param lgd_model_parameters: The LGD model parameters, one row per variable.
+    :return: A dictionary of parameter values keyed by variable name.
+    """
+    model_parameters = DEFAULT_LGD_MODEL_PARAMETERS.copy()
+    model_parameters.update(lgd_model_parameters.set_index("variable")["value"].to_dict())
+
+    return model_parameters
+
+
+def forced_sale_discount(dtv: pd.Series, model_parameters: tp.Dict[str, float]) -> np.ndarray:
+    """
+    Look up the forced sale discount of each row from its debt to value band.
+    :param dtv: The debt to value of each row.
+    :param model_parameters: The LGD model parameters from get_lgd_model_parameters.
+    :return: An array of float64, one for each row.
+    """
+    band_discounts = np.array([float(model_parameters[band_name]) for band_name in FORCED_SALE_DISCOUNT_BANDS])
+
+    dtv = dtv.to_numpy(dtype="float64", na_value=np.nan)
+    band_codes = np.searchsorted(FORCED_SALE_DISCOUNT_BAND_EDGES, dtv, side="right")
+    band_codes[np.isnan(dtv)] = len(FORCED_SALE_DISCOUNT_BANDS) - 1
+
+    return band_discounts[band_codes]
+
+
+def calculate_lgd_forecast(ead_forecast: pd.DataFrame, model_parameters: tp.Dict[str, float], seed: int) -> pd.DataFrame:
+    """
+    Work out the LGD forecast from an EAD forecast. The stochastic columns are drawn for every row in one call, each
+    row's draws depend on the seed, its account ID and its month but not on the other rows, so the forecast for an
+    account is the same whichever other accounts are forecast with it.
+    :param ead_forecast: The EAD forecast, one row per account and month, this is not changed.
+    :param model_parameters: The LGD model parameters from get_lgd_model_parameters.
+    :param seed: The random number seed.
+    :return: The EAD forecast with the LGD columns added.
+    """
+    row_count = len(ead_forecast)
+    draw_keys = [ead_forecast[key_column] for key_column in LGD_DRAW_KEYS]
+
+    lgd_forecast = ead_forecast.copy()
+
+    lgd_forecast["forced_sale_discount"] = forced_sale_discount(ead_forecast["dtv"], model_parameters)
+
+    time_from_default_to_sale = int(model_parameters["time_from_default_to_possession"]) + int(model_parameters["time_from_possession_to_sale"])
+    lgd_forecast["time_to_sale"] = ead_forecast["time_to_default"] + time_from_default_to_sale
+
+    # Legal costs are a fixed amount per account, so they add more to the loss rate for smaller exposures
+    ead = ead_forecast["ead"].to_numpy(dtype="float64")
+    legal_cost_rate = np.divide(model_parameters["legal_costs"], ead, out=np.zeros(row_count), where=ead > 0)
+
+    lgd_12m = KeyedRandomUtils.normal(seed, "lgd_12m", draw_keys, model_parameters["lgd_12m_mean"], model_parameters["lgd_12m_standard_deviation"]) + legal_cost_rate
+    lgd_forecast["lgd_12m"] = np.clip(lgd_12m, model_parameters["lgd_12m_minimum"], model_parameters["lgd_12m_maximum"])
+
+    # The lifetime uplift is a single draw applied to the whole book, it only depends on the seed
+    lgd_lifetime_multiplier = np.clip(
+        np.random.default_rng(seed).normal(model_parameters["lgd_lifetime_multiplier_mean"], model_parameters["lgd_lifetime_multiplier_standard_deviation"]),
+        model_parameters["lgd_lifetime_multiplier_minimum"], model_parameters["lgd_lifetime_multiplier_maximum"])
+
+    lgd_forecast["lgd_lifetime"] = lgd_forecast["lgd_12m"] * lgd_lifetime_multiplier
+
+    return lgd_forecast
+
 
 class CalculateLgd(trac.TracModel):
 
@@ -13,43 +112,42 @@ class CalculateLgd(trac.TracModel):
             trac.P("first_forecast_month", trac.BasicType.DATE, label="First month of forecast",
                    default_value=datetime.datetime(2022, 1, 1).date()),
             trac.P("last_forecast_month", trac.BasicType.DATE, label="Last month of forecast",
-                   default_value=datetime.datetime(2025, 12, 1).date())
+                   default_value=datetime.datetime(2025, 12, 1).date()),
+            trac.P("seed", trac.BasicType.INTEGER, label="Random number seed", default_value=0)
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        lgd_model_parameters_schema = trac.load_schema(schemas, "lgd_model_parameters_schema.csv")
-        ead_forecast_schema = trac.load_schema(schemas, "ead_forecast_schema.csv")
+        lgd_model_parameters_schema = SchemaRegistry.load_schema(schemas, "lgd_model_parameters_schema.csv")
+        ead_forecast_schema = SchemaRegistry.load_schema(schemas, "ead_forecast_schema.csv")
 
         return {"lgd_model_parameters": trac.ModelInputSchema(lgd_model_parameters_schema),
                 "ead_forecast": trac.ModelInputSchema(ead_forecast_schema)}
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        lgd_forecast_schema = trac.load_schema(schemas, "lgd_forecast_schema.csv")
+        lgd_forecast_schema = SchemaRegistry.load_schema(schemas, "lgd_forecast_schema.csv")
 
         return {"lgd_forecast": trac.ModelOutputSchema(lgd_forecast_schema)}
 
-    @staticmethod
-    def gauss(x):
-        return max(0.0, min(0.8, random.gauss(0.2, 0.2)))
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {"lgd_model_parameters": ["variable", "value"]}
 
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
-        lgd_model_parameters = ctx.get_pandas_table("lgd_model_parameters")
-        ead_forecast = ctx.get_pandas_table("ead_forecast")
-
-        lgd_forecast = ead_forecast.copy()
+        seed = ctx.get_parameter("seed")
 
-        forced_sale_discount_list = [0.1, 0.2, 0.25, 0.3, 0.5]
-        lgd_forecast["forced_sale_discount"] = random.choices(forced_sale_discount_list, weights=(50, 40, 20, 10, 5),
-                                                              k=len(lgd_forecast))
+        input_columns = self.define_input_columns()
 
-        lgd_forecast["time_to_sale"] = lgd_forecast["time_to_default"] + 9
+        lgd_model_parameters = CompactTableUtils.get_compact_table(ctx, "lgd_model_parameters", input_columns["lgd_model_parameters"])
+        ead_forecast = CompactTableUtils.get_compact_table(ctx, "ead_forecast")
 
-        lgd_forecast["lgd_12m"] = lgd_forecast.apply(CalculateLgd.gauss, axis=1)
+        model_parameters = get_lgd_model_parameters(lgd_model_parameters)
 
-        lgd_forecast["lgd_lifetime"] = lgd_forecast["lgd_12m"] * min(1.1, max(1.0, random.gauss(1, 1)))
+        with StageMetrics.stage("forecast lgd", rows_in=len(ead_forecast)) as stage:
+            lgd_forecast = calculate_lgd_forecast(ead_forecast, model_parameters, seed)
+            stage.rows_out = len(lgd_forecast)
 
         # Output the dataset
-        ctx.put_pandas_table("lgd_forecast", lgd_forecast)
+        CompactTableUtils.put_compact_table(ctx, "lgd_forecast", lgd_forecast)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,27 @@
-import calendar
 import tracdap.rt.api as trac
 import typing as tp
-import random
 from impairment import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_forecast_calendar import ForecastCalendarUtils
 import datetime
+import numpy as np
 import pandas as pd
+from utils.utils_forecast_panel import ForecastPanelUtils
+
+
+def calculate_pd_forecast(pd_forecast: pd.DataFrame, pd_lifetime_multiplier: float) -> pd.DataFrame:
+    """
+    Calculate the PD forecast for a chunk of the account x month panel.
+    :param pd_forecast: A chunk of the panel.
+    :param pd_lifetime_multiplier: The ratio of lifetime PD to 12 month PD, the same value is used for every chunk.
+    :return: The PD forecast for the chunk.
+    """
+    # fmin caps the lifetime PD at 1, a missing 12 month PD also gives a lifetime PD of 1
+    pd_forecast["pd_lifetime"] = np.fmin(pd_forecast["pd_12m"] * pd_lifetime_multiplier, 1)
+
+    return pd_forecast
 
 
 class CalculatePd(trac.TracModel):
@@ -13,65 +30,57 @@ class CalculatePd(trac.TracModel):
         return trac.declare_parameters(
 
             trac.P("first_forecast_month", trac.BasicType.DATE, label="First month of forecast", default_value=datetime.datetime(2022, 1, 1).date()),
-            trac.P("last_forecast_month", trac.BasicType.DATE, label="Last month of forecast", default_value=datetime.datetime(2025, 12, 1).date())
+            trac.P("last_forecast_month", trac.BasicType.DATE, label="Last month of forecast", default_value=datetime.datetime(2025, 12, 1).date()),
+            trac.P("loans_per_chunk", trac.BasicType.INTEGER, label="Number of accounts to forecast at a time (0 for all)", default_value=100000),
+            trac.P("months_per_chunk", trac.BasicType.INTEGER, label="Number of months to forecast at a time (0 for all)", default_value=0),
+            trac.P("seed", trac.BasicType.INTEGER, label="Random number seed", default_value=0)
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        economic_scenario_schema = trac.load_schema(schemas, "economic_scenario_schema.csv")
-        mortgage_book_t0_schema = trac.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        economic_scenario_schema = SchemaRegistry.load_schema(schemas, "economic_scenario_schema.csv")
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
 
         return {"economic_scenario": trac.ModelInputSchema(economic_scenario_schema),
                 "mortgage_book_t0": trac.ModelInputSchema(mortgage_book_t0_schema)}
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        pd_forecast_schema = trac.load_schema(schemas, "pd_forecast_schema.csv")
+        pd_forecast_schema = SchemaRegistry.load_schema(schemas, "pd_forecast_schema.csv")
 
         return {"pd_forecast": trac.ModelOutputSchema(pd_forecast_schema)}
 
-    def run_model(self, ctx: trac.TracContext):
-
-        print("here")
-        pd_forecast_schema = ctx.get_schema("pd_forecast")
-        print(pd_forecast_schema.table.fields)
-        for f in pd_forecast_schema.table.fields:
-            print(f)
-            print(f.fieldType)
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        # The PD forecast only needs the segment of each account and its 12 month PD, the economic scenario is not used
+        return {"economic_scenario": [],
+                "mortgage_book_t0": ["id", "business_line", "product_line", "region", "subregion", "mortgage_type", "pd_12m"]}
 
-        x = filter(lambda field: field.fieldType == trac.STRING, pd_forecast_schema.table.fields)
-        print(x)
-
-        keys = []
-        for f in x:
-            print(f)
-            keys.append(f.fieldName)
-
-        print(keys)
+    @StageMetrics.instrument
+    def run_model(self, ctx: trac.TracContext):
 
         first_forecast_month = ctx.get_parameter("first_forecast_month")
         last_forecast_month = ctx.get_parameter("last_forecast_month")
+        loans_per_chunk = ctx.get_parameter("loans_per_chunk")
+        months_per_chunk = ctx.get_parameter("months_per_chunk")
+        seed = ctx.get_parameter("seed")
 
-        economic_scenario = ctx.get_pandas_table("economic_scenario")
-        mortgage_book_t0 = ctx.get_pandas_table("mortgage_book_t0")
-
-        last_day = calendar.monthrange(first_forecast_month.year, first_forecast_month.month)[1]
-        first_forecast_month = first_forecast_month.replace(day=last_day)
+        input_columns = self.define_input_columns()
 
-        last_day = calendar.monthrange(last_forecast_month.year, last_forecast_month.month)[1]
-        last_forecast_month = last_forecast_month.replace(day=last_day)
+        mortgage_book_t0 = CompactTableUtils.get_compact_table(ctx, "mortgage_book_t0", input_columns["mortgage_book_t0"])
 
-        date_list = pd.date_range(first_forecast_month, last_forecast_month, freq="M", inclusive="both", name="date")
-        dates = date_list.to_series("date").to_frame("date").reset_index(drop=True)
+        dates = ForecastCalendarUtils.month_grid(first_forecast_month, last_forecast_month)
 
-        pd_forecast = mortgage_book_t0.drop("date", axis=1).join(dates, how="cross")
+        # A single draw for the whole book, so a run with the same seed gives the same forecast for every account
+        pd_lifetime_multiplier = np.random.default_rng(seed).integers(10, 15, endpoint=True) / 10
 
-        pd_forecast["pd_lifetime"] = pd_forecast["pd_12m"] * random.randint(10, 15) / 10
-        pd_forecast["pd_lifetime_max"] = 1
-        pd_forecast["pd_lifetime"] = pd_forecast[['pd_lifetime', 'pd_lifetime_max']].min(axis=1)
-        pd_forecast.drop(["pd_lifetime_max"], inplace=True, axis=1)
-        pd_forecast = pd_forecast.drop(["valuation", "dtv", "balance", "monthly_repayment", "months_in_arrears", "in_default"], axis=1)
+        # Build the account x month panel a chunk at a time
+        with StageMetrics.stage("forecast pd", rows_in=len(mortgage_book_t0)) as stage:
+            pd_forecast = ForecastPanelUtils.build_panel(
+                mortgage_book_t0, dates,
+                lambda chunk: calculate_pd_forecast(chunk, pd_lifetime_multiplier),
+                loans_per_chunk, months_per_chunk)
+            stage.rows_out = len(pd_forecast)
 
         # Output the dataset
-        ctx.put_pandas_table("pd_forecast", pd_forecast)
+        CompactTableUtils.put_compact_table(ctx, "pd_forecast", pd_forecast)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+import sys
+import logging
+import pathlib
+import typing as tp
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import yaml
+import tracdap.rt.api as trac
+import tracdap.rt._impl.data as _trac_data  # noqa
+import tracdap.rt._impl.util as _trac_util  # noqa
+
+from impairment import schemas as schemas
+from impairment.impairment_pipeline import IMPAIRMENT_FORECAST_MODELS
+from impairment.calculate_impairment_mi import aggregate_impairment_totals, update_impairment_totals, recalculate_nonfinite_totals, impairment_mi_from_totals
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_forecast_panel import ForecastPanelUtils
+from utils.utils_model_pipeline import ModelPipeline
+
+"""
+Brings last month's impairment forecasts up to date for a new mortgage book without forecasting every account again.
+The new book is compared with the book the forecasts were made from, account by account, and only the accounts that
+are new or have changed go through the PD, EAD, LGD and impairment models. Their rows replace the rows of changed and
+closed accounts in the stored forecasts, which are put back in the order a full run over the new book gives them.
+
+The summary is updated from the sums and counts behind it (impairment_mi_totals), adding the rows that came in and
+taking away the rows that went out. A group with an infinite or missing value is totalled again from the patched
+forecast instead, as such a value cannot be taken away. The totals are saved with the summary for the next month, the
+first incremental run builds them from the previous impairment forecast.
+
+The forecasts are row for row the same as a full run with the same parameters, because every model works each row out
+from that row's account and month alone. The summary matches a full run to within floating point rounding, as the sums
+are added up in a different order. The book date is not compared, the forecast months are set by the parameters, and
+the parameters and other inputs must be the ones the previous forecasts were made with.
+
+Run from the root of the repository with:
+    PYTHONPATH=src python src/impairment/impairment_incremental.py config/impairment/impairment_incremental.yaml
+"""
+
+# The column identifying an account in the book and in the forecasts
+BOOK_KEY = "id"
+
+# Columns of the book that do not change an account's forecast
+IGNORED_BOOK_COLUMNS = ["date"]
+
+# The forecasts that are patched, with the model whose chunk sizes decide their row order. The LGD and impairment
+# forecasts keep the rows in the order of the EAD forecast they are made from
+FORECAST_PANEL_NODES = {
+    "pd_forecast": "calculate_pd",
+    "ead_forecast": "calculate_ead",
+    "lgd_forecast": "calculate_ead",
+    "impairment_forecast": "calculate_ead"
+}
+
+
+class BookChanges(tp.NamedTuple):
+    """
+    The IDs of the accounts that are new in a book, have changed or have closed since the previous book.
+    """
+    new: pa.Array
+    changed: pa.Array
+    closed: pa.Array
+
+
+def diff_books(previous_book: pd.DataFrame, new_book: pd.DataFrame) -> BookChanges:
+    """
+    Compare two mortgage books account by account, an account has changed when any column other than the ID and the
+    ignored columns is different.
+    :param previous_book: The book the stored forecasts were made from.
+    :param new_book: The new book.
+    :return: The IDs of the new, changed and closed accounts.
+    """
+    compare_columns = [column for column in new_book.columns if column != BOOK_KEY and column not in IGNORED_BOOK_COLUMNS]
+
+    for book_name, book in [("previous", previous_book), ("new", new_book)]:
+        if book[BOOK_KEY].duplicated().any():
+            raise Exception(f"The {book_name} mortgage book has more than one row for some accounts")
+
+    previous_hashes = pd.Series(pd.util.hash_pandas_object(previous_book[compare_columns], index=False).to_numpy(),
+                                index=previous_book[BOOK_KEY].to_numpy(dtype=object))
+    new_hashes = pd.Series(pd.util.hash_pandas_object(new_book[compare_columns], index=False).to_numpy(),
+                           index=new_book[BOOK_KEY].to_numpy(dtype=object))
+
+    in_previous = new_hashes.index.isin(previous_hashes.index)
+    in_new = previous_hashes.index.isin(new_hashes.index)
+
+    changed = new_hashes[in_previous].to_numpy() != previous_hashes.reindex(new_hashes.index[in_previous]).to_numpy()
+
+    return BookChanges(
+        new=pa.array(new_hashes.index[~in_previous], pa.string()),
+        changed=pa.array(new_hashes.index[in_previous][changed], pa.string()),
+        closed=pa.array(previous_hashes.index[~in_new], pa.string()))
+
+
+def patch_forecast(previous_forecast: pa.Table, recalculated_rows: pa.Table, removed_ids: pa.Array, book_ids: pa.Array,
+                   forecast_dates: pa.Array, loans_per_chunk: int, months_per_chunk: int) -> pa.Table:
+    """
+    Replace the rows of some accounts in a forecast and put the rows in the order a full run would give them.
+    :param previous_forecast: The stored forecast.
+    :param recalculated_rows: The rows of the new and changed accounts.
+    :param removed_ids: The IDs of the changed and closed accounts, whose stored rows are dropped.
+    :param book_ids: The account IDs of the new book, in the order of the book.
+    :param forecast_dates: The forecast months, in order.
+    :param loans_per_chunk: The number of loans in each chunk of the model's panel.
+    :param months_per_chunk: The number of months in each chunk of the model's panel.
+    :return: The patched forecast.
+    """
+    kept_rows = previous_forecast.filter(pc.invert(pc.is_in(previous_forecast[BOOK_KEY], value_set=removed_ids)))
+    recalculated_rows = recalculated_rows.select(kept_rows.schema.names).cast(kept_rows.schema)
+
+    forecast = pa.concat_tables([kept_rows, recalculated_rows])
+
+    loan_positions = pc.index_in(forecast[BOOK_KEY], value_set=book_ids)
+    month_positions = pc.index_in(forecast["date"], value_set=forecast_dates)
+
+    if loan_positions.null_count > 0:
+        raise Exception("The stored forecast has rows for accounts that are not in the previous mortgage book")
+
+    if month_positions.null_count > 0:
+        raise Exception("The forecast months are not the same as in the stored forecast, run the full pipeline instead")
+
+    row_order = ForecastPanelUtils.panel_order(
+        loan_positions.to_numpy(), month_positions.to_numpy(), len(book_ids), len(forecast_dates), loans_per_chunk, months_per_chunk)
+
+    return forecast.take(row_order).combine_chunks()
+
+
+def to_arrow(data: pd.DataFrame, schema: trac.SchemaDefinition) -> pa.Table:
+    """
+    Convert a dataFrame made outside a model to Arrow, with the types in its TRAC schema.
+    """
+    categorical_columns = [column_name for column_name, dtype in data.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    data = data.astype({column_name: str for column_name in categorical_columns})
+
+    return _trac_data.DataMapping.pandas_to_arrow(data, _trac_data.DataMapping.trac_to_arrow_schema(schema))
+
+
+def run_incremental(incremental_config: tp.Union[str, pathlib.Path], sys_config: tp.Union[str, pathlib.Path]) -> tp.Dict[str, pa.Table]:
+    """
+    Patch the stored impairment forecasts for a new mortgage book. The config has the same parameters and inputs as
+    the pipeline config, with the new book as the mortgage_book_t0 input, the storage paths of the previous book and
+    forecasts under 'previous', and where to save the patched forecasts, the summary and its totals under 'outputs'.
+    :param incremental_config: The path to the config.
+    :param sys_config: The path to the TRAC system config.
+    :return: The patched forecasts, the summary and its totals as Arrow tables.
+    """
+    _trac_util.configure_logging()
+    log = logging.getLogger(run_incremental.__name__)
+
+    config = yaml.safe_load(pathlib.Path(incremental_config).read_text())["incremental"]
+    parameters = config.get("parameters") or dict()
+    inputs = dict(config.get("inputs") or dict())
+    previous = config["previous"]
+    outputs = config.get("outputs") or dict()
+
+    pipeline = ModelPipeline(IMPAIRMENT_FORECAST_MODELS, sys_config)
+
+    new_book = pipeline.load_dataset("mortgage_book_t0", inputs["mortgage_book_t0"])
+    previous_book = pipeline.load_dataset("mortgage_book_t0", previous["mortgage_book_t0"])
+
+    changes = diff_books(CompactTableUtils.arrow_to_pandas(previous_book), CompactTableUtils.arrow_to_pandas(new_book))
+
+    log.info(f"Of {len(new_book)} accounts {len(changes.new)} are new and {len(changes.changed)} have changed, "
+             f"{len(changes.closed)} have closed")
+
+    recalculated_ids = pa.concat_arrays([changes.new, changes.changed])
+    removed_ids = pa.concat_arrays([changes.changed, changes.closed])
+
+    # Run the forecast models on just the accounts that need forecasting again
+    recalculated_book = new_book.filter(pc.is_in(new_book[BOOK_KEY], value_set=recalculated_ids))
+
+    if len(recalculated_book) > 0:
+        recalculated = pipeline.run(parameters, {**inputs, "mortgage_book_t0": recalculated_book}, keep=list(FORECAST_PANEL_NODES))
+    else:
+        recalculated = dict()
+
+    results = dict()
+    removed_impairment_rows = None
+
+    for dataset_name, node_name in FORECAST_PANEL_NODES.items():
+
+        previous_forecast = pipeline.load_dataset(dataset_name, previous[dataset_name])
+        recalculated_rows = recalculated.get(dataset_name, previous_forecast.slice(0, 0))
+
+        node_parameters = pipeline.parameter_values(node_name, parameters.get(node_name) or dict())
+        forecast_dates = pc.unique(pa.concat_arrays(previous_forecast["date"].chunks + recalculated_rows["date"].chunks))
+        forecast_dates = forecast_dates.take(pc.sort_indices(forecast_dates))
+
+        results[dataset_name] = patch_forecast(previous_forecast, recalculated_rows, removed_ids, new_book[BOOK_KEY].combine_chunks(),
+                                               forecast_dates, node_parameters["loans_per_chunk"], node_parameters["months_per_chunk"])
+
+        if dataset_name == "impairment_forecast":
+            removed_impairment_rows = previous_forecast.filter(pc.is_in(previous_forecast[BOOK_KEY], value_set=removed_ids))
+
+            if "impairment_mi_totals" in previous:
+                totals_schema = SchemaRegistry.load_schema(schemas, "impairment_mi_totals_schema.csv")
+                impairment_totals = CompactTableUtils.arrow_to_pandas(pipeline.load_dataset("impairment_mi_totals", previous["impairment_mi_totals"], totals_schema))
+            else:
+                log.info("Building the impairment summary totals from the previous impairment forecast")
+                impairment_totals = aggregate_impairment_totals(CompactTableUtils.arrow_to_pandas(previous_forecast))
+
+            results["impairment_mi_totals"] = impairment_totals
+
+        del previous_forecast
+
+        if dataset_name in outputs:
+            pipeline.save_dataset(dataset_name, results[dataset_name], outputs[dataset_name])
+
+    # Update the summary by the rows that came in and went out
+    impairment_totals = update_impairment_totals(
+        results["impairment_mi_totals"],
+        CompactTableUtils.arrow_to_pandas(recalculated.get("impairment_forecast", removed_impairment_rows.slice(0, 0))),
+        CompactTableUtils.arrow_to_pandas(removed_impairment_rows))
+
+    if not np.isfinite(impairment_totals.filter(like="sum_").to_numpy(dtype="float64")).all():
+        log.info("Recalculating the impairment summary totals that have infinite or missing values")
+        impairment_totals = recalculate_nonfinite_totals(impairment_totals, CompactTableUtils.arrow_to_pandas(results["impairment_forecast"]))
+
+    results["impairment_mi_totals"] = to_arrow(impairment_totals, SchemaRegistry.load_schema(schemas, "impairment_mi_totals_schema.csv"))
+    results["impairment_mi"] = to_arrow(impairment_mi_from_totals(impairment_totals), SchemaRegistry.load_schema(schemas, "impairment_mi_schema.csv"))
+
+    for dataset_name in ["impairment_mi_totals", "impairment_mi"]:
+        if dataset_name in outputs:
+            pipeline.save_dataset(dataset_name, results[dataset_name], outputs[dataset_name])
+
+    return results
+
+
+if __name__ == "__main__":
+
+    run_incremental(sys.argv[1] if len(sys.argv) > 1 else "config/impairment/impairment_incremental.yaml", "config/sys_config.yaml")
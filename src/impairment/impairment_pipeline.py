@@ -0,0 +1,45 @@
+import sys
+import typing as tp
+import tracdap.rt.api as trac
+
+from impairment.calculate_pd import CalculatePd
+from impairment.calculate_ead import CalculateEad
+from impairment.calculate_lgd import CalculateLgd
+from impairment.calculate_impairment import CalculateImpairment
+from impairment.calculate_impairment_mi import CalculateImpairmentMI
+from impairment.calculate_impairment_cube import CalculateImpairmentCube
+from impairment.calculate_impairment_monte_carlo import CalculateImpairmentMonteCarlo
+
+# The models that make the loan level impairment forecast, keyed by the node names used in
+# flows/impairment_forecast_flow.json
+IMPAIRMENT_FORECAST_MODELS: tp.Dict[str, tp.Type[trac.TracModel]] = {
+    "calculate_pd": CalculatePd,
+    "calculate_ead": CalculateEad,
+    "calculate_lgd": CalculateLgd,
+    "calculate_impairment": CalculateImpairment
+}
+
+# The impairment models with the reports made from the forecast, the pipeline works out the order to run them in from
+# their inputs and outputs
+IMPAIRMENT_MODELS: tp.Dict[str, tp.Type[trac.TracModel]] = {
+    **IMPAIRMENT_FORECAST_MODELS,
+    "calculate_impairment_mi": CalculateImpairmentMI,
+    "calculate_impairment_cube": CalculateImpairmentCube
+}
+
+# The same pipeline with the impairment summary worked out over simulated scenario paths
+IMPAIRMENT_MONTE_CARLO_MODELS: tp.Dict[str, tp.Type[trac.TracModel]] = {
+    **IMPAIRMENT_FORECAST_MODELS,
+    "calculate_impairment_monte_carlo": CalculateImpairmentMonteCarlo
+}
+
+if __name__ == "__main__":
+    from utils.utils_model_pipeline import run_pipeline_config
+
+    # The pipeline config can be given on the command line, for example config/impairment/impairment_pipeline_parquet.yaml,
+    # add --monte-carlo to run the Monte Carlo impairment summary
+    arguments = [argument for argument in sys.argv[1:] if argument != "--monte-carlo"]
+    models = IMPAIRMENT_MONTE_CARLO_MODELS if "--monte-carlo" in sys.argv[1:] else IMPAIRMENT_MODELS
+    pipeline_config = arguments[0] if arguments else "config/impairment/impairment_pipeline.yaml"
+
+    run_pipeline_config(models, pipeline_config, "config/sys_config.yaml")
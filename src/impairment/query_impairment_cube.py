@@ -0,0 +1,66 @@
+import argparse
+import pathlib
+import typing as tp
+import pandas as pd
+
+from impairment.calculate_impairment_cube import query_impairment_cube
+from utils.utils_columnar_storage import ColumnarStorageUtils, COLUMNAR_FORMATS
+from utils.utils_compact_table import CompactTableUtils
+
+"""
+Answers a cut of the impairment summary from a saved impairment cube, without going back to the impairment forecast.
+Run from the root of the repository, for example to break down the fixed and capped rate mortgages by month and debt to
+value band:
+    PYTHONPATH=src python src/impairment/query_impairment_cube.py data/outputs/impairment/impairment_cube.parquet \
+        --by date,dtv_band --where "mortgage_type=fixed rate|capped rate"
+"""
+
+
+def load_impairment_cube(cube_path: tp.Union[str, pathlib.Path]) -> pd.DataFrame:
+    """
+    Load an impairment cube saved as Parquet or as an Arrow file.
+    :param cube_path: The path to the cube.
+    :return: The cube, with the dimensions as categorical columns.
+    """
+    storage_formats = {extension: storage_format for storage_format, extension in COLUMNAR_FORMATS.items()}
+    extension = pathlib.Path(cube_path).suffix
+
+    if extension not in storage_formats:
+        raise Exception(f"The impairment cube must be saved as {' or '.join(COLUMNAR_FORMATS.values())}, not [{cube_path}]")
+
+    return CompactTableUtils.arrow_to_pandas(ColumnarStorageUtils.read_table(str(cube_path), storage_formats[extension]))
+
+
+def parse_filters(where: tp.List[str]) -> tp.Dict[str, tp.List[str]]:
+    """
+    Read filters given as dimension=value, with several values separated by '|'.
+    """
+    filters = dict()
+
+    for condition in where:
+        if "=" not in condition:
+            raise Exception(f"A filter must be given as dimension=value, not [{condition}]")
+
+        dimension, values = condition.split("=", 1)
+        filters[dimension.strip()] = values.split("|")
+
+    return filters
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Answer a cut of the impairment summary from an impairment cube")
+    parser.add_argument("cube_path", help="The impairment cube, for example data/outputs/impairment/impairment_cube.parquet")
+    parser.add_argument("--by", default="date", help="Comma separated columns to summarise by, leave empty for the grand total")
+    parser.add_argument("--where", action="append", default=[], help="A filter as dimension=value, several values are separated by '|'")
+    parser.add_argument("--output", help="A CSV file to write the summary to, by default it is printed")
+    arguments = parser.parse_args()
+
+    group_by = [column.strip() for column in arguments.by.split(",") if column.strip()]
+    summary = query_impairment_cube(load_impairment_cube(arguments.cube_path), group_by, parse_filters(arguments.where))
+
+    if arguments.output:
+        summary.to_csv(arguments.output, index=False)
+    else:
+        with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", None):
+            print(summary.to_string(index=False))
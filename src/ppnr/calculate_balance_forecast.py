@@ -15,6 +15,194 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_forecast_calendar import ForecastCalendarUtils
+from utils.utils_memo_cache import MemoCache
+import numpy as np
+import pandas as pd
+
+
+# The new originations that go to each mortgage type, the interest only and then the amortising balance
+NEW_BALANCE_COLUMNS = {
+    "fixed rate": ("new_fixed_rate_interest_only_balance", "new_fixed_rate_amortising_balance"),
+    "floating rate": ("new_floating_rate_interest_only_balance", "new_floating_rate_amortising_balance"),
+    "capped rate": ("new_capped_rate_interest_only_balance", "new_capped_rate_amortising_balance")
+}
+
+# The columns in the balance_forecast output
+BALANCE_FORECAST_COLUMNS = ["date", "business_line", "region", "mortgage_type", "net_balance_flow", "cumulative_net_balance_flow", "balance"]
+
+
+def aggregate_mortgage_book_t0(mortgage_book_t0):
+    """
+    Sum the t0 book by mortgage type and region. This only depends on the book, so when several scenarios are run
+    together it is done once and shared by all of them.
+    :param mortgage_book_t0: The mortgage book at t0, one row per account.
+    :return: The balance at the start of the forecast, one row per mortgage type and region.
+    """
+    group_by_list = ["mortgage_type", "region"]
+
+    # Grouping categoricals with observed=True keeps the groups in the order they are first seen, so they are sorted
+    # afterwards to give the same order as grouping plain strings
+    return (mortgage_book_t0.groupby(group_by_list, as_index=False, observed=True).agg({'balance': 'sum'}).rename(
+        columns={'balance': 'balance_at_start'}).sort_values(by=group_by_list).reset_index(drop=True))
+
+
+def _factorize_rows(data, columns):
+    """
+    Give each distinct combination of values in some columns a dense integer code, the codes follow the sorted
+    order of the combinations.
+    :return: The code for each row and the distinct combinations as a dataFrame.
+    """
+    if not columns:
+        return np.zeros(len(data), dtype="int64"), pd.DataFrame(index=range(1))
+
+    groups = data.groupby(columns, sort=True, observed=True)
+
+    return groups.ngroup().to_numpy(), groups.size().index.to_frame(index=False)
+
+
+def _cumulative_sum(values):
+    """
+    A cumulative sum along the last axis of an array, each step works on every segment at once. Like a pandas
+    cumsum this uses compensated (Kahan) summation and skips missing values, so the results match the running totals
+    pandas gives to the last bit and do not drift over a long horizon.
+    """
+    cumulative = np.empty_like(values)
+    total = np.zeros(values.shape[:-1])
+    compensation = np.zeros(values.shape[:-1])
+
+    for step in range(values.shape[-1]):
+
+        value = values[..., step]
+        missing = np.isnan(value)
+
+        adjusted = value - compensation
+        new_total = total + adjusted
+
+        compensation = np.where(missing, compensation, new_total - total - adjusted)
+        total = np.where(missing, total, new_total)
+
+        cumulative[..., step] = np.where(missing, np.nan, total)
+
+    return cumulative
+
+
+def calculate_balance_forecast(balance_at_start, portfolio_runoff, new_originations, key_columns=()):
+    """
+    Roll the balance at the start of the forecast forward with the runoff and the new originations. When the new
+    originations hold several scenarios stacked on top of each other the key columns identify each scenario, the
+    flows are accumulated separately for each one and the key columns are carried through to the output.
+
+    The flows are laid out as arrays of scenario x segment x month, where the segments are the business line and
+    mortgage type pairs in the runoff. Every join is done by indexing with dense integer codes and the cumulative
+    flows are a running sum along the month axis. A month only counts for a segment when it is in both the
+    runoff and the new originations.
+    :param balance_at_start: The balance at the start of the forecast from aggregate_mortgage_book_t0.
+    :param portfolio_runoff: The portfolio runoff, one row per segment and month.
+    :param new_originations: The new originations, one row per month and scenario.
+    :param key_columns: The columns identifying each scenario in the new originations.
+    :return: The balance forecast, one row per segment and month for each scenario.
+    """
+    key_columns = list(key_columns)
+
+    runoff_dates = ForecastCalendarUtils.month_start(portfolio_runoff["date"]).to_numpy()
+    origination_dates = ForecastCalendarUtils.month_start(new_originations["date"]).to_numpy()
+
+    # Dense codes for the months, segments, business lines and scenarios
+    months = pd.Index(np.intersect1d(runoff_dates, origination_dates))
+
+    segment_codes, segments = _factorize_rows(portfolio_runoff, ["business_line", "mortgage_type"])
+    scenario_codes, scenarios = _factorize_rows(new_originations, key_columns)
+
+    business_lines = pd.Index(segments["business_line"].unique())
+    segment_business_lines = business_lines.get_indexer(segments["business_line"])
+    origination_business_lines = business_lines.get_indexer(new_originations["business_line"])
+
+    runoff_months = months.get_indexer(runoff_dates)
+    origination_months = months.get_indexer(origination_dates)
+
+    runoff_rows = runoff_months >= 0
+    origination_rows = (origination_months >= 0) & (origination_business_lines >= 0)
+
+    # The repayments and prepayments by segment x month, in millions
+    runoff_shape = (len(segments), len(months))
+    runoff_cells = (segment_codes[runoff_rows], runoff_months[runoff_rows])
+
+    if np.unique(np.ravel_multi_index(runoff_cells, runoff_shape)).size != np.count_nonzero(runoff_rows):
+        raise Exception("The portfolio runoff has more than one row for a segment and month")
+
+    runoff_present = np.zeros(runoff_shape, dtype=bool)
+    repayments = np.zeros(runoff_shape)
+    prepayments = np.zeros(runoff_shape)
+
+    runoff_present[runoff_cells] = True
+    repayments[runoff_cells] = portfolio_runoff["repayment_balance"].to_numpy(dtype="float64")[runoff_rows] / 1000000
+    prepayments[runoff_cells] = portfolio_runoff["prepayment_balance"].to_numpy(dtype="float64")[runoff_rows] / 1000000
+
+    # The new lending by scenario x business line x month x mortgage type, the extra mortgage type at the end is
+    # for segments that do not take any new lending
+    origination_shape = (len(scenarios), len(business_lines), len(months))
+    origination_cells = (scenario_codes[origination_rows], origination_business_lines[origination_rows], origination_months[origination_rows])
+
+    if np.unique(np.ravel_multi_index(origination_cells, origination_shape)).size != np.count_nonzero(origination_rows):
+        raise Exception("The new originations have more than one row for a scenario, business line and month")
+
+    origination_present = np.zeros(origination_shape, dtype=bool)
+    new_lending = np.zeros(origination_shape + (len(NEW_BALANCE_COLUMNS) + 1,))
+
+    origination_present[origination_cells] = True
+
+    for mortgage_type_code, (interest_only_column, amortising_column) in enumerate(NEW_BALANCE_COLUMNS.values()):
+        new_lending[origination_cells + (mortgage_type_code,)] = \
+            new_originations[interest_only_column].to_numpy(dtype="float64")[origination_rows] + \
+            new_originations[amortising_column].to_numpy(dtype="float64")[origination_rows]
+
+    segment_mortgage_types = pd.Index(list(NEW_BALANCE_COLUMNS.keys())).get_indexer(segments["mortgage_type"])
+    segment_mortgage_types[segment_mortgage_types < 0] = len(NEW_BALANCE_COLUMNS)
+
+    # The flows by scenario x segment x month, a month that is missing from either input adds nothing to the
+    # cumulative flows
+    present = origination_present[:, segment_business_lines, :] & runoff_present[np.newaxis, :, :]
+
+    segment_new_lending = new_lending[:, segment_business_lines[:, np.newaxis], np.arange(len(months))[np.newaxis, :], segment_mortgage_types[:, np.newaxis]]
+
+    net_balance_flow = np.where(present, segment_new_lending - repayments[np.newaxis, :, :] - prepayments[np.newaxis, :, :], 0.0)
+
+    cumulative_net_balance_flow = _cumulative_sum(net_balance_flow)
+
+    # Each row of the t0 balances picks up every segment with the same mortgage type
+    start_mortgage_types = balance_at_start["mortgage_type"].to_numpy()
+    start_balances = balance_at_start["balance_at_start"].to_numpy(dtype="float64")
+
+    row_starts, row_scenarios, row_segments, row_months = [], [], [], []
+
+    for start_index, mortgage_type in enumerate(start_mortgage_types):
+
+        start_segments = np.flatnonzero(segments["mortgage_type"].to_numpy() == mortgage_type)
+        cell_scenarios, cell_segments, cell_months = np.nonzero(present[:, start_segments, :])
+
+        row_starts.append(np.full(cell_scenarios.size, start_index))
+        row_scenarios.append(cell_scenarios)
+        row_segments.append(start_segments[cell_segments])
+        row_months.append(cell_months)
+
+    row_starts, row_scenarios, row_segments, row_months = (
+        np.concatenate(rows) if rows else np.zeros(0, dtype="int64") for rows in [row_starts, row_scenarios, row_segments, row_months])
+
+    balance_forecast = scenarios.iloc[row_scenarios].reset_index(drop=True) if key_columns else pd.DataFrame(index=range(row_starts.size))
+
+    balance_forecast["date"] = months.to_numpy()[row_months]
+    balance_forecast["business_line"] = segments["business_line"].to_numpy()[row_segments]
+    balance_forecast["region"] = balance_at_start["region"].to_numpy()[row_starts]
+    balance_forecast["mortgage_type"] = segments["mortgage_type"].to_numpy()[row_segments]
+    balance_forecast["net_balance_flow"] = net_balance_flow[row_scenarios, row_segments, row_months]
+    balance_forecast["cumulative_net_balance_flow"] = cumulative_net_balance_flow[row_scenarios, row_segments, row_months]
+    balance_forecast["balance"] = start_balances[row_starts] / 1000000 + balance_forecast["cumulative_net_balance_flow"].to_numpy()
+
+    return balance_forecast[key_columns + BALANCE_FORECAST_COLUMNS]
 
 
 class BalanceForecastModel(trac.TracModel):
@@ -23,9 +211,9 @@ class BalanceForecastModel(trac.TracModel):
         return trac.define_parameters()
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        mortgage_book_t0_schema = trac.load_schema(schemas, "mortgage_book_t0_schema.csv")
-        portfolio_runoff_schema = trac.load_schema(schemas, "portfolio_runoff_schema.csv")
-        new_originations_schema = trac.load_schema(schemas, "new_originations_schema.csv")
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        portfolio_runoff_schema = SchemaRegistry.load_schema(schemas, "portfolio_runoff_schema.csv")
+        new_originations_schema = SchemaRegistry.load_schema(schemas, "new_originations_schema.csv")
         return {
             "mortgage_book_t0": trac.ModelInputSchema(mortgage_book_t0_schema),
             "portfolio_runoff": trac.ModelInputSchema(portfolio_runoff_schema),
@@ -33,63 +221,38 @@ class BalanceForecastModel(trac.TracModel):
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        balance_forecast_schema = trac.load_schema(schemas, "balance_forecast_schema.csv")
+        balance_forecast_schema = SchemaRegistry.load_schema(schemas, "balance_forecast_schema.csv")
         return {
             "balance_forecast": trac.ModelOutputSchema(balance_forecast_schema),
             "financed_emissions": trac.ModelOutputSchema(balance_forecast_schema)
         }
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {
+            "mortgage_book_t0": ["region", "mortgage_type", "balance"],
+            "portfolio_runoff": ["business_line", "mortgage_type", "date", "prepayment_balance", "repayment_balance"]
+        }
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Model is running...")
 
-        mortgage_book_t0 = ctx.get_pandas_table("mortgage_book_t0")
-        portfolio_runoff = ctx.get_pandas_table("portfolio_runoff")
-        new_originations = ctx.get_pandas_table("new_originations")
-
-        mortgage_book_t0 = mortgage_book_t0[['business_line', "mortgage_type", "region", "date", "balance"]]
-        mortgage_book_t0["date"] = mortgage_book_t0["date"].apply(lambda x: x.replace(day=1))
-        portfolio_runoff["date"] = portfolio_runoff["date"].apply(lambda x: x.replace(day=1))
-        new_originations["date"] = new_originations["date"].apply(lambda x: x.replace(day=1))
-
-        balance_flows = portfolio_runoff.merge(new_originations, on=["date", 'business_line'], how="inner")
-        balance_flows.loc[balance_flows['mortgage_type'] != "fixed rate", 'new_fixed_rate_interest_only_balance'] = 0
-        balance_flows.loc[balance_flows['mortgage_type'] != "fixed rate", 'new_fixed_rate_amortising_balance'] = 0
-
-        balance_flows.loc[balance_flows['mortgage_type'] != "capped rate", 'new_capped_rate_interest_only_balance'] = 0
-        balance_flows.loc[balance_flows['mortgage_type'] != "capped rate", 'new_capped_rate_amortising_balance'] = 0
-
-        balance_flows.loc[
-            balance_flows['mortgage_type'] != "floating rate", 'new_floating_rate_interest_only_balance'] = 0
-        balance_flows.loc[balance_flows['mortgage_type'] != "floating rate", 'new_floating_rate_amortising_balance'] = 0
-
-        balance_flows["net_balance_flow"] = balance_flows["new_fixed_rate_interest_only_balance"] + balance_flows[
-            "new_floating_rate_interest_only_balance"] + balance_flows["new_capped_rate_interest_only_balance"] + \
-                                            balance_flows["new_fixed_rate_amortising_balance"] + balance_flows[
-                                                "new_floating_rate_amortising_balance"] + balance_flows[
-                                                "new_capped_rate_amortising_balance"] - (
-                                                    balance_flows["repayment_balance"] / 1000000) - (
-                                                    balance_flows["prepayment_balance"] / 1000000)
-
-        balance_flows = balance_flows.sort_values(by=["mortgage_type", "date"], ascending=True)
-
-        balance_flows["cumulative_net_balance_flow"] = balance_flows.groupby(["mortgage_type"])[
-            "net_balance_flow"].cumsum()
-
-        group_by_list = ["mortgage_type", "region"]
-
-        mortgage_book_t0 = (mortgage_book_t0.groupby(group_by_list, as_index=False).agg({'balance': 'sum'}).rename(
-            columns={'balance': 'balance_at_start'}))
+        input_columns = self.define_input_columns()
 
-        balance_forecast = mortgage_book_t0.merge(balance_flows, on=['mortgage_type'], how="inner")
+        mortgage_book_t0 = CompactTableUtils.get_compact_table(ctx, "mortgage_book_t0", input_columns["mortgage_book_t0"])
+        portfolio_runoff = CompactTableUtils.get_compact_table(ctx, "portfolio_runoff", input_columns["portfolio_runoff"])
+        new_originations = CompactTableUtils.get_compact_table(ctx, "new_originations")
 
-        balance_forecast["balance"] = balance_forecast["balance_at_start"] / 1000000 + balance_forecast[
-            "cumulative_net_balance_flow"]
+        with StageMetrics.stage("aggregate book", rows_in=len(mortgage_book_t0)) as stage:
+            balance_at_start = MemoCache.call(aggregate_mortgage_book_t0, mortgage_book_t0)
+            stage.rows_out = len(balance_at_start)
 
-        balance_forecast = balance_forecast[
-            ["date", "business_line", "region", "mortgage_type", "net_balance_flow", "cumulative_net_balance_flow", "balance"]]
+        with StageMetrics.stage("forecast balance", rows_in=len(portfolio_runoff)) as stage:
+            balance_forecast = calculate_balance_forecast(balance_at_start, portfolio_runoff, new_originations)
+            stage.rows_out = len(balance_forecast)
 
-        ctx.put_pandas_table("balance_forecast", balance_forecast)
-        ctx.put_pandas_table("financed_emissions", balance_forecast)
+        CompactTableUtils.put_compact_table(ctx, "balance_forecast", balance_forecast)
+        CompactTableUtils.put_compact_table(ctx, "financed_emissions", balance_forecast)
 
 
 if __name__ == "__main__":
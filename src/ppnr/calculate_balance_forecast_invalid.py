@@ -15,6 +15,8 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_stage_metrics import StageMetrics
 
 
 class BalanceForecastModel(trac.TracModel):
@@ -23,21 +25,22 @@ class BalanceForecastModel(trac.TracModel):
         return trac.define_parameters()
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        mortgage_book_t0_schema = trac.load_schema(schemas, "mortgage_book_t0_schema.csv")
-        portfolio_runoff_schema = trac.load_schema(schemas, "portfolio_runoff_schema.csv")
-        new_originations_schema = trac.load_schema(schemas, "new_originations_schema.csv")
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        portfolio_runoff_schema = SchemaRegistry.load_schema(schemas, "portfolio_runoff_schema.csv")
+        new_originations_schema = SchemaRegistry.load_schema(schemas, "new_originations_schema.csv")
         return {
             "mortgage_book_t0": trac.ModelInputSchema(mortgage_book_t0_schema),
             "new_originations2": trac.ModelInputSchema(new_originations_schema)
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        balance_forecast_schema = trac.load_schema(schemas, "balance_forecast_schema.csv")
+        balance_forecast_schema = SchemaRegistry.load_schema(schemas, "balance_forecast_schema.csv")
         return {
             "balance_forecast": trac.ModelOutputSchema(balance_forecast_schema),
             "financed_emissions2": trac.ModelOutputSchema(balance_forecast_schema)
         }
 
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Model is running...")
 
@@ -15,6 +15,14 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_memo_cache import MemoCache
+from utils.utils_keyed_lookup import KeyedLookup
+
+# The columns that identify a row of the rate tables
+RATE_TABLE_KEYS = ["date", "region"]
 
 
 def calculate_net_interest_margin(interest_paid_assets, interest_earned_assets):
@@ -36,16 +44,52 @@ def calculate_net_interest_income(net_interest_margin, earning_assets):
     return net_interest_income
 
 
+def prepare_net_interest_margin(cost_of_funding, customer_rates):
+    """
+    Work out the net interest margin by year and region. This does not depend on the scenario, so when several
+    scenarios are run together it is worked out once and shared by all of them.
+    :param cost_of_funding: The cost of funding by year and region.
+    :param customer_rates: The customer rates by year and region.
+    :return: The net interest margin by year and region.
+    """
+    cost_of_funding = KeyedLookup.align(cost_of_funding, customer_rates, RATE_TABLE_KEYS, "cost_of_funding", "customer_rates")
+
+    net_interest_margin = calculate_net_interest_margin(cost_of_funding, customer_rates)
+
+    return net_interest_margin[["date", "region", "average_net_interest_margin"]]
+
+
+def calculate_net_interest_income_forecast(balance_forecast, net_interest_margin):
+    """
+    Apply the net interest margin to the balance forecast. Each row takes the margin for its region and the year of
+    its date, or the latest year before that when the margin table stops earlier. Any scenario columns in the
+    balance forecast are carried through to the output.
+    :param balance_forecast: The balance forecast, one row per segment and month.
+    :param net_interest_margin: The net interest margin from prepare_net_interest_margin.
+    :return: The net interest income forecast, one row per segment and month.
+    """
+    net_interest_margin_lookup = KeyedLookup(net_interest_margin, ["region"], "date", ["average_net_interest_margin"], ignore_case=True)
+
+    net_interest_income = balance_forecast.copy()
+    net_interest_income["average_net_interest_margin"] = net_interest_margin_lookup.lookup(
+        net_interest_income, net_interest_income["date"].dt.year)["average_net_interest_margin"]
+
+    net_interest_income["net_interest_income"] = 10000 * net_interest_income["balance"] * net_interest_income["average_net_interest_margin"]
+
+    # The balance flows are only there when the model is handed the whole balance forecast
+    return net_interest_income.drop(["net_balance_flow", "cumulative_net_balance_flow", "balance"], axis=1, errors="ignore")
+
+
 class NetInterestMarginDataModel(trac.TracModel):
 
     def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
         return trac.define_parameters()
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        cost_of_funding_schema = trac.load_schema(schemas, "cost_of_funding_schema.csv")
-        customer_rates_schema = trac.load_schema(schemas, "customer_rates_schema.csv")
-        economic_scenario_schema = trac.load_schema(schemas, "economic_scenario_schema.csv")
-        balance_forecast_schema = trac.load_schema(schemas, "balance_forecast_schema.csv")
+        cost_of_funding_schema = SchemaRegistry.load_schema(schemas, "cost_of_funding_schema.csv")
+        customer_rates_schema = SchemaRegistry.load_schema(schemas, "customer_rates_schema.csv")
+        economic_scenario_schema = SchemaRegistry.load_schema(schemas, "economic_scenario_schema.csv")
+        balance_forecast_schema = SchemaRegistry.load_schema(schemas, "balance_forecast_schema.csv")
 
         return {
             "cost_of_funding": trac.ModelInputSchema(cost_of_funding_schema),
@@ -55,28 +99,37 @@ class NetInterestMarginDataModel(trac.TracModel):
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        net_interest_income_schema = trac.load_schema(schemas, "net_interest_income_schema.csv")
+        net_interest_income_schema = SchemaRegistry.load_schema(schemas, "net_interest_income_schema.csv")
         return {"net_interest_income": trac.ModelOutputSchema(net_interest_income_schema)}
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {
+            "cost_of_funding": ["date", "region", "average_funding_interest_rate"],
+            "customer_rates": ["date", "region", "average_earner_interest_rate"],
+            "economic_scenario": [],
+            "balance_forecast": ["date", "business_line", "region", "mortgage_type", "balance"]
+        }
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Net interest interest model is running...")
 
-        cost_of_funding = ctx.get_pandas_table("cost_of_funding")
-        customer_rates = ctx.get_pandas_table("customer_rates")
-        balance_forecast = ctx.get_pandas_table("balance_forecast")
+        input_columns = self.define_input_columns()
 
-        # dummy computations
-        net_interest_income = calculate_net_interest_margin(cost_of_funding, customer_rates)
-
-        net_interest_income = net_interest_income[(net_interest_income['date'] == 2021) & (net_interest_income['region'].str.upper() == "SWEDEN")]
+        cost_of_funding = CompactTableUtils.get_compact_table(ctx, "cost_of_funding", input_columns["cost_of_funding"])
+        customer_rates = CompactTableUtils.get_compact_table(ctx, "customer_rates", input_columns["customer_rates"])
+        balance_forecast = CompactTableUtils.get_compact_table(ctx, "balance_forecast", input_columns["balance_forecast"])
 
-        net_interest_income = balance_forecast.merge(net_interest_income[["average_net_interest_margin"]], how="cross")
-
-        net_interest_income["net_interest_income"] = 10000 * net_interest_income["balance"] * net_interest_income["average_net_interest_margin"]
+        # dummy computations
+        with StageMetrics.stage("prepare margin", rows_in=len(customer_rates)) as stage:
+            net_interest_margin = MemoCache.call(prepare_net_interest_margin, cost_of_funding, customer_rates)
+            stage.rows_out = len(net_interest_margin)
 
-        net_interest_income.drop(["net_balance_flow", "cumulative_net_balance_flow", "balance"], axis=1, inplace=True)
+        with StageMetrics.stage("forecast net interest income", rows_in=len(balance_forecast)) as stage:
+            net_interest_income = calculate_net_interest_income_forecast(balance_forecast, net_interest_margin)
+            stage.rows_out = len(net_interest_income)
 
-        ctx.put_pandas_table("net_interest_income", net_interest_income)
+        CompactTableUtils.put_compact_table(ctx, "net_interest_income", net_interest_income)
 
 
 if __name__ == "__main__":
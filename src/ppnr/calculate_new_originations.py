@@ -15,8 +15,62 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_forecast_calendar import ForecastCalendarUtils
 import datetime
-import calendar
+import pyarrow.compute as pc
+
+
+# The columns in the new_originations output
+NEW_ORIGINATIONS_COLUMNS = ['business_line', 'date', 'new_fixed_rate_interest_only_balance', 'new_floating_rate_interest_only_balance',
+                            'new_capped_rate_interest_only_balance', 'new_fixed_rate_amortising_balance',
+                            'new_floating_rate_amortising_balance', 'new_capped_rate_amortising_balance']
+
+
+def calculate_new_originations(market_scenario, first_forecast_month, last_forecast_month, sek_to_eur_exchange_rate, key_columns=()):
+    """
+    Calculate the new lending by mortgage type from a market scenario. Every row is calculated on its own, so a
+    table holding several scenarios stacked on top of each other can be calculated in one go.
+    :param market_scenario: The market scenario, one row per month.
+    :param first_forecast_month: The first day of the first month of the forecast.
+    :param last_forecast_month: The last day of the last month of the forecast.
+    :param sek_to_eur_exchange_rate: The exchange rate used to convert the lending to EUR.
+    :param key_columns: Any columns to carry through to the output, for example the scenario_id of a stacked table.
+    :return: The new originations, one row per month.
+    """
+    new_originations = market_scenario.copy()
+
+    new_originations['new_lending'] = new_originations["mortgage_lending_to_households"] * new_originations["share_of_market"]
+
+    new_originations["business_line"] = "Retail"
+    new_originations['new_fixed_rate_interest_only_balance'] = new_originations["new_lending"] * new_originations["new_business_fixed_rate"] * new_originations["new_business_interest_only"] * sek_to_eur_exchange_rate
+    new_originations['new_floating_rate_interest_only_balance'] = new_originations["new_lending"] * new_originations["new_business_floating_rate"] * new_originations["new_business_interest_only"] * sek_to_eur_exchange_rate
+    new_originations['new_capped_rate_interest_only_balance'] = new_originations["new_lending"] * new_originations["new_business_capped_rate"] * new_originations["new_business_interest_only"] * sek_to_eur_exchange_rate
+    new_originations['new_fixed_rate_amortising_balance'] = new_originations["new_lending"] * new_originations["new_business_fixed_rate"] * new_originations["new_business_amortising"] * sek_to_eur_exchange_rate
+    new_originations['new_floating_rate_amortising_balance'] = new_originations["new_lending"] * new_originations["new_business_floating_rate"] * new_originations["new_business_amortising"] * sek_to_eur_exchange_rate
+    new_originations['new_capped_rate_amortising_balance'] = new_originations["new_lending"] * new_originations["new_business_capped_rate"] * new_originations["new_business_amortising"] * sek_to_eur_exchange_rate
+
+    new_originations = new_originations.loc[(new_originations['observation_date'].dt.date >= first_forecast_month) & (new_originations['observation_date'].dt.date <= last_forecast_month)]
+
+    new_originations = new_originations.rename(columns={"observation_date": "date"})
+
+    return new_originations[list(key_columns) + NEW_ORIGINATIONS_COLUMNS]
+
+
+def observation_date_filter(first_forecast_month, last_forecast_month) -> pc.Expression:
+    """
+    The rows of a market scenario that calculate_new_originations keeps, as a filter that can be pushed down into
+    the read of a Parquet or Arrow input so that months outside the forecast are never loaded.
+    :param first_forecast_month: A date in the first month of the forecast.
+    :param last_forecast_month: A date in the last month of the forecast.
+    :return: The filter on the observation_date column.
+    """
+    first_forecast_month = ForecastCalendarUtils.first_day_of_month(first_forecast_month)
+    last_forecast_month = ForecastCalendarUtils.last_day_of_month(last_forecast_month)
+
+    return (pc.field("observation_date") >= first_forecast_month) & (pc.field("observation_date") <= last_forecast_month)
 
 
 class NewOriginationsModel(trac.TracModel):
@@ -35,15 +89,19 @@ class NewOriginationsModel(trac.TracModel):
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        market_scenario_schema = trac.load_schema(schemas, "market_scenario_schema.csv")
+        market_scenario_schema = SchemaRegistry.load_schema(schemas, "market_scenario_schema.csv")
         return {
             "market_scenario": trac.ModelInputSchema(market_scenario_schema)
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        new_originations_schema = trac.load_schema(schemas, "new_originations_schema.csv")
+        new_originations_schema = SchemaRegistry.load_schema(schemas, "new_originations_schema.csv")
         return {"new_originations": trac.ModelOutputSchema(new_originations_schema)}
 
+    def define_input_filters(self, parameters: tp.Dict[str, tp.Any]) -> tp.Dict[str, pc.Expression]:
+        return {"market_scenario": observation_date_filter(parameters["first_forecast_month"], parameters["last_forecast_month"])}
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Model is running...")
 
@@ -51,31 +109,16 @@ class NewOriginationsModel(trac.TracModel):
         last_forecast_month = ctx.get_parameter("last_forecast_month")
         sek_to_eur_exchange_rate = ctx.get_parameter("sek_to_eur_exchange_rate")
 
-        first_forecast_month = first_forecast_month.replace(day=1)
-
-        last_day = calendar.monthrange(last_forecast_month.year, last_forecast_month.month)[1]
-        last_forecast_month = last_forecast_month.replace(day=last_day)
-
-        new_originations = ctx.get_pandas_table("market_scenario")
-
-        new_originations['new_lending'] = new_originations["mortgage_lending_to_households"] * new_originations["share_of_market"]
-
-        new_originations["business_line"] = "Retail"
-        new_originations['new_fixed_rate_interest_only_balance'] = new_originations["new_lending"] * new_originations["new_business_fixed_rate"] * new_originations["new_business_interest_only"] * sek_to_eur_exchange_rate
-        new_originations['new_floating_rate_interest_only_balance'] = new_originations["new_lending"] * new_originations["new_business_floating_rate"] * new_originations["new_business_interest_only"] * sek_to_eur_exchange_rate
-        new_originations['new_capped_rate_interest_only_balance'] = new_originations["new_lending"] * new_originations["new_business_capped_rate"] * new_originations["new_business_interest_only"] * sek_to_eur_exchange_rate
-        new_originations['new_fixed_rate_amortising_balance'] = new_originations["new_lending"] * new_originations["new_business_fixed_rate"] * new_originations["new_business_amortising"] * sek_to_eur_exchange_rate
-        new_originations['new_floating_rate_amortising_balance'] = new_originations["new_lending"] * new_originations["new_business_floating_rate"] * new_originations["new_business_amortising"] * sek_to_eur_exchange_rate
-        new_originations['new_capped_rate_amortising_balance'] = new_originations["new_lending"] * new_originations["new_business_capped_rate"] * new_originations["new_business_amortising"] * sek_to_eur_exchange_rate
+        first_forecast_month = ForecastCalendarUtils.first_day_of_month(first_forecast_month)
+        last_forecast_month = ForecastCalendarUtils.last_day_of_month(last_forecast_month)
 
-        new_originations = new_originations.loc[(new_originations['observation_date'].dt.date >= first_forecast_month) & (new_originations['observation_date'].dt.date <= last_forecast_month)]
+        market_scenario = CompactTableUtils.get_compact_table(ctx, "market_scenario")
 
-        new_originations.rename(columns={"observation_date": "date"}, inplace=True)
+        with StageMetrics.stage("forecast new originations", rows_in=len(market_scenario)) as stage:
+            new_originations = calculate_new_originations(market_scenario, first_forecast_month, last_forecast_month, sek_to_eur_exchange_rate)
+            stage.rows_out = len(new_originations)
 
-        ctx.put_pandas_table("new_originations", new_originations[
-            ['business_line', 'date', 'new_fixed_rate_interest_only_balance', 'new_floating_rate_interest_only_balance',
-             'new_capped_rate_interest_only_balance', 'new_fixed_rate_amortising_balance',
-             'new_floating_rate_amortising_balance', 'new_capped_rate_amortising_balance']])
+        CompactTableUtils.put_compact_table(ctx, "new_originations", new_originations)
 
 
 if __name__ == "__main__":
@@ -15,6 +15,8 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_stage_metrics import StageMetrics
 import datetime
 import calendar
 
@@ -35,15 +37,16 @@ class NewOriginationsModel(trac.TracModel):
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        market_scenario_schema = trac.load_schema(schemas, "new_originations_schema.csv")
+        market_scenario_schema = SchemaRegistry.load_schema(schemas, "new_originations_schema.csv")
         return {
             "market_scenario": trac.ModelInputSchema(market_scenario_schema)
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        new_originations_schema = trac.load_schema(schemas, "market_scenario_schema.csv")
+        new_originations_schema = SchemaRegistry.load_schema(schemas, "market_scenario_schema.csv")
         return {"new_originations": trac.ModelOutputSchema(new_originations_schema)}
 
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Model is running...")
 
@@ -16,6 +16,11 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_memo_cache import MemoCache
+from utils.utils_keyed_lookup import KeyedLookup
 
 
 def calculate_non_interest_income(fees_and_commission_income):
@@ -31,15 +36,58 @@ def calculate_non_interest_income(fees_and_commission_income):
     return non_interest_income
 
 
+def prepare_net_fee_commissions_income(fees_and_commissions_income):
+    """
+    Work out the fee and commission income by year and region. This does not depend on the scenario, so when
+    several scenarios are run together it is worked out once and shared by all of them.
+    :param fees_and_commissions_income: The fee and commission income by year and region.
+    :return: The net fee and commission income by year and region.
+    """
+    non_interest_income = calculate_non_interest_income(fees_and_commissions_income)
+
+    return non_interest_income[["date", "region", "net_fee_commissions_income"]]
+
+
+def calculate_non_interest_income_forecast(balance_forecast, net_fee_commissions_income, key_columns=()):
+    """
+    Share the fee and commission income out over the segments in proportion to their balance in each month. Each
+    row takes the income for its region and the year of its date, or the latest year before that when the income
+    table stops earlier, and the income for a region is shared out over the segments in that region. When the
+    balance forecast holds several scenarios the key columns identify each scenario, so the balance across segments
+    is summed separately for each one.
+    :param balance_forecast: The balance forecast, one row per segment and month.
+    :param net_fee_commissions_income: The income from prepare_net_fee_commissions_income.
+    :param key_columns: The columns identifying each scenario in the balance forecast.
+    :return: The non-interest income forecast, one row per segment and month.
+    """
+    group_by_list = list(key_columns) + ["date", "region"]
+
+    net_fee_commissions_income_lookup = KeyedLookup(net_fee_commissions_income, ["region"], "date", ["net_fee_commissions_income"], ignore_case=True)
+
+    non_interest_income = balance_forecast.copy()
+    non_interest_income["net_fee_commissions_income"] = net_fee_commissions_income_lookup.lookup(
+        non_interest_income, non_interest_income["date"].dt.year)["net_fee_commissions_income"]
+
+    sum_data = non_interest_income[group_by_list + ["balance"]].groupby(group_by_list, observed=True)["balance"].sum().reset_index(name='balance_across_segments')
+
+    non_interest_income = non_interest_income.merge(sum_data, on=group_by_list, how="inner")
+
+    non_interest_income["non_interest_income"] = non_interest_income["net_fee_commissions_income"] * non_interest_income["balance"] / non_interest_income[
+        "balance_across_segments"]
+
+    # The balance flows are only there when the model is handed the whole balance forecast
+    return non_interest_income.drop(["net_fee_commissions_income", "net_balance_flow", "cumulative_net_balance_flow"], axis=1, errors="ignore")
+
+
 class NonInterestIncomeModel(trac.TracModel):
 
     def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
         return trac.define_parameters()
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        balance_forecast_schema = trac.load_schema(schemas, "balance_forecast_schema.csv")
-        investment_income = trac.load_schema(schemas, "investment_income_schema.csv")
-        fees_and_commissions_income = trac.load_schema(schemas, "fees_and_commissions_income_schema.csv")
+        balance_forecast_schema = SchemaRegistry.load_schema(schemas, "balance_forecast_schema.csv")
+        investment_income = SchemaRegistry.load_schema(schemas, "investment_income_schema.csv")
+        fees_and_commissions_income = SchemaRegistry.load_schema(schemas, "fees_and_commissions_income_schema.csv")
         return {
             "balance_forecast": trac.ModelInputSchema(balance_forecast_schema),
             "investment_income": trac.ModelInputSchema(investment_income),
@@ -47,32 +95,35 @@ class NonInterestIncomeModel(trac.TracModel):
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        non_interest_income = trac.load_schema(schemas, "non_interest_income_schema.csv")
+        non_interest_income = SchemaRegistry.load_schema(schemas, "non_interest_income_schema.csv")
         return {"non_interest_income": trac.ModelOutputSchema(non_interest_income)}
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {
+            "balance_forecast": ["date", "business_line", "region", "mortgage_type", "balance"],
+            "investment_income": [],
+            "fees_and_commissions_income": ["date", "region", "commissions_fees", "early_termination_early_payments", "delinquency_fees"]
+        }
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Net interest margin model is running...")
 
-        # investment_income = ctx.get_pandas_table("investment_income")
-        fees_and_commissions_income = ctx.get_pandas_table("fees_and_commissions_income")
-        balance_forecast = ctx.get_pandas_table("balance_forecast")
-
-        non_interest_income = fees_and_commissions_income[(fees_and_commissions_income['date'] == 2021) & (fees_and_commissions_income['region'].str.upper() == "SWEDEN")]
-
-        non_interest_income = calculate_non_interest_income(non_interest_income)
-
-        non_interest_income = balance_forecast.merge(non_interest_income[["net_fee_commissions_income"]], how="cross")
-
-        sum_data = non_interest_income[["date", "balance"]].groupby("date")["balance"].sum().reset_index(name='balance_across_segments')
+        input_columns = self.define_input_columns()
 
-        non_interest_income = non_interest_income.merge(sum_data, on=["date"], how="inner")
+        # investment_income = CompactTableUtils.get_compact_table(ctx, "investment_income")
+        fees_and_commissions_income = CompactTableUtils.get_compact_table(ctx, "fees_and_commissions_income", input_columns["fees_and_commissions_income"])
+        balance_forecast = CompactTableUtils.get_compact_table(ctx, "balance_forecast", input_columns["balance_forecast"])
 
-        non_interest_income["non_interest_income"] = non_interest_income["net_fee_commissions_income"] * non_interest_income["balance"] / non_interest_income[
-            "balance_across_segments"]
+        with StageMetrics.stage("prepare fee income", rows_in=len(fees_and_commissions_income)) as stage:
+            net_fee_commissions_income = MemoCache.call(prepare_net_fee_commissions_income, fees_and_commissions_income)
+            stage.rows_out = len(net_fee_commissions_income)
 
-        non_interest_income.drop(["net_fee_commissions_income", "net_balance_flow", "cumulative_net_balance_flow"], axis=1, inplace=True)
+        with StageMetrics.stage("forecast non interest income", rows_in=len(balance_forecast)) as stage:
+            non_interest_income = calculate_non_interest_income_forecast(balance_forecast, net_fee_commissions_income)
+            stage.rows_out = len(non_interest_income)
 
-        ctx.put_pandas_table("non_interest_income", non_interest_income)
+        CompactTableUtils.put_compact_table(ctx, "non_interest_income", non_interest_income)
 
 
 if __name__ == "__main__":
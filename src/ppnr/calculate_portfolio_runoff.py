@@ -15,9 +15,45 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_forecast_calendar import ForecastCalendarUtils
+from utils.utils_memo_cache import MemoCache
 import datetime
-import calendar
-import pandas as pd
+
+
+def calculate_portfolio_runoff(mortgage_book_t0, first_forecast_month, last_forecast_month):
+    """
+    Calculate the runoff of the t0 book by segment and month. The runoff only depends on the book, so when several
+    scenarios are run together it is calculated once and shared by all of them.
+    :param mortgage_book_t0: The mortgage book at t0, one row per account.
+    :param first_forecast_month: A date in the first month of the forecast.
+    :param last_forecast_month: A date in the last month of the forecast.
+    :return: The portfolio runoff, one row per segment and month.
+    """
+    dates = ForecastCalendarUtils.month_grid(first_forecast_month, last_forecast_month)
+
+    group_by_list = ['business_line', "mortgage_type"]
+
+    # The balances being summed do not change by month, so sum each segment once and then copy the totals to
+    # every month rather than summing the whole account x month panel. Grouping categoricals with observed=True keeps
+    # the segments in the order they are first seen, so they are sorted to give the same order as plain strings
+    segment_balances = (mortgage_book_t0.groupby(group_by_list, as_index=False, observed=True)
+                        .agg({'balance': 'sum', "monthly_repayment": "sum"})
+                        .rename(columns={'balance': 'prepayment_balance', 'monthly_repayment': 'repayment_balance'})
+                        .sort_values(by=group_by_list))
+
+    portfolio_runoff = segment_balances.join(dates, how="cross")
+
+    portfolio_runoff["month_index"] = ForecastCalendarUtils.month_index(portfolio_runoff["date"], first_forecast_month)
+
+    portfolio_runoff["prepayment_balance"] = portfolio_runoff["prepayment_balance"] - portfolio_runoff[
+        "month_index"] * portfolio_runoff["repayment_balance"] * 0.02
+
+    portfolio_runoff["runoff_balance"] = portfolio_runoff["prepayment_balance"] + portfolio_runoff["repayment_balance"]
+
+    return portfolio_runoff[['business_line', 'mortgage_type', 'date', 'runoff_balance', 'prepayment_balance', 'repayment_balance']]
 
 
 class PortfolioRunoffModel(trac.TracModel):
@@ -37,55 +73,39 @@ class PortfolioRunoffModel(trac.TracModel):
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        mortgage_book_t0_schema = trac.load_schema(schemas, "mortgage_book_t0_schema.csv")
-        economic_scenario_schema = trac.load_schema(schemas, "economic_scenario_schema.csv")
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        economic_scenario_schema = SchemaRegistry.load_schema(schemas, "economic_scenario_schema.csv")
         return {
             "mortgage_book_t0": trac.ModelInputSchema(mortgage_book_t0_schema),
             "economic_scenario": trac.ModelInputSchema(economic_scenario_schema)
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        portfolio_runoff_schema = trac.load_schema(schemas, "portfolio_runoff_schema.csv")
+        portfolio_runoff_schema = SchemaRegistry.load_schema(schemas, "portfolio_runoff_schema.csv")
         return {"portfolio_runoff": trac.ModelOutputSchema(portfolio_runoff_schema)}
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {
+            "mortgage_book_t0": ["business_line", "mortgage_type", "balance", "monthly_repayment"],
+            "economic_scenario": []
+        }
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Model is running...")
 
         first_forecast_month = ctx.get_parameter("first_forecast_month")
         last_forecast_month = ctx.get_parameter("last_forecast_month")
 
-        last_day = calendar.monthrange(first_forecast_month.year, first_forecast_month.month)[1]
-        first_forecast_month = first_forecast_month.replace(day=last_day)
-
-        last_day = calendar.monthrange(last_forecast_month.year, last_forecast_month.month)[1]
-        last_forecast_month = last_forecast_month.replace(day=last_day)
-
-        date_list = pd.date_range(first_forecast_month, last_forecast_month, freq="M", inclusive="both", name="date")
-        dates = date_list.to_series("date").to_frame("date").reset_index(drop=True)
-
-        mortgage_book_t0 = ctx.get_pandas_table("mortgage_book_t0")
-
-        portfolio_runoff = mortgage_book_t0.drop("date", axis=1).join(dates, how="cross")
-
-        group_by_list = ['business_line', "mortgage_type", "date"]
-
-        portfolio_runoff = (portfolio_runoff.groupby(group_by_list, as_index=False)
-                            .agg({'balance': 'sum', "monthly_repayment": "sum"})
-                            .rename(
-            columns={'balance': 'prepayment_balance', 'monthly_repayment': 'repayment_balance'}))
-
-        portfolio_runoff["month_index"] = 1 + (portfolio_runoff["date"].dt.year - first_forecast_month.year) * 12 + \
-                                          portfolio_runoff["date"].dt.month - first_forecast_month.month
+        input_columns = self.define_input_columns()
 
-        portfolio_runoff["prepayment_balance"] = portfolio_runoff["prepayment_balance"] - portfolio_runoff[
-            "month_index"] * portfolio_runoff[
-                                                     "repayment_balance"] * 0.02
+        mortgage_book_t0 = CompactTableUtils.get_compact_table(ctx, "mortgage_book_t0", input_columns["mortgage_book_t0"])
 
-        portfolio_runoff["runoff_balance"] = portfolio_runoff["prepayment_balance"] + portfolio_runoff[
-            "repayment_balance"]
+        with StageMetrics.stage("forecast runoff", rows_in=len(mortgage_book_t0)) as stage:
+            portfolio_runoff = MemoCache.call(calculate_portfolio_runoff, mortgage_book_t0, first_forecast_month, last_forecast_month)
+            stage.rows_out = len(portfolio_runoff)
 
-        ctx.put_pandas_table("portfolio_runoff", portfolio_runoff[
-            ['business_line', 'mortgage_type', 'date', 'runoff_balance', 'prepayment_balance', 'repayment_balance']])
+        CompactTableUtils.put_compact_table(ctx, "portfolio_runoff", portfolio_runoff)
 
 
 if __name__ == "__main__":
@@ -15,6 +15,14 @@
 import typing as tp
 import tracdap.rt.api as trac
 import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_memo_cache import MemoCache
+from utils.utils_keyed_lookup import KeyedLookup
+
+# The columns that identify a row of the cost tables
+COST_TABLE_KEYS = ["date", "region"]
 
 
 def calculate_operating_profit(non_interest_income, operating_costs, net_interest_income):
@@ -51,18 +59,70 @@ def calculate_operating_costs(corporate_centre_costs, sales_and_marketing_costs,
     return operating_costs
 
 
+def prepare_total_operating_expenses(corporate_centre_costs, sales_and_marketing_costs,
+                                     processing_costs, business_support_costs):
+    """
+    Work out the operating expenses by year and region. These do not depend on the scenario, so when several
+    scenarios are run together they are worked out once and shared by all of them.
+    :param corporate_centre_costs: The corporate centre costs by year and region.
+    :param sales_and_marketing_costs: The sales and marketing costs by year and region.
+    :param processing_costs: The processing costs by year and region.
+    :param business_support_costs: The business support costs by year and region.
+    :return: The total operating expenses by year and region.
+    """
+    corporate_centre_costs = KeyedLookup.align(corporate_centre_costs, processing_costs, COST_TABLE_KEYS, "corporate_centre_costs", "processing_costs")
+    sales_and_marketing_costs = KeyedLookup.align(sales_and_marketing_costs, processing_costs, COST_TABLE_KEYS, "sales_and_marketing_costs", "processing_costs")
+    business_support_costs = KeyedLookup.align(business_support_costs, processing_costs, COST_TABLE_KEYS, "business_support_costs", "processing_costs")
+
+    operating_costs = calculate_operating_costs(corporate_centre_costs, sales_and_marketing_costs,
+                                                processing_costs, business_support_costs)
+
+    operating_costs["total_operating_expenses"] = operating_costs["other_expenses"] + operating_costs["staff_costs"]
+
+    return operating_costs[["date", "region", "total_operating_expenses"]]
+
+
+def calculate_ppnr_forecast(non_interest_income, net_interest_income, operating_expenses, key_columns=()):
+    """
+    Combine the income forecasts and share the operating expenses out over the segments in proportion to their
+    balance. Each row takes the expenses for its region and the year of its date, or the latest year before that
+    when the cost tables stop earlier. When the income forecasts hold several scenarios the key columns identify
+    each scenario and are part of the join between them.
+    :param non_interest_income: The non-interest income forecast, one row per segment and month.
+    :param net_interest_income: The net interest income forecast, one row per segment and month.
+    :param operating_expenses: The operating expenses from prepare_total_operating_expenses.
+    :param key_columns: The columns identifying each scenario in the income forecasts.
+    :return: The PPNR forecast, one row per segment and month.
+    """
+    total_income = non_interest_income.merge(net_interest_income, on=list(key_columns) + ["date", "business_line", "mortgage_type", "region"], how="inner")
+    total_income["total_operating_income"] = total_income["net_interest_income"] + total_income["non_interest_income"]
+
+    operating_expenses_lookup = KeyedLookup(operating_expenses, ["region"], "date", ["total_operating_expenses"], ignore_case=True)
+
+    ppnr_forecast = total_income
+    ppnr_forecast["total_operating_expenses"] = operating_expenses_lookup.lookup(ppnr_forecast, ppnr_forecast["date"].dt.year)["total_operating_expenses"]
+
+    ppnr_forecast["total_operating_expenses"] = ppnr_forecast["total_operating_expenses"] * ppnr_forecast["balance"] / ppnr_forecast[
+        "balance_across_segments"]
+
+    ppnr_forecast["pre_provision_net_revenue"] = ppnr_forecast["total_operating_income"] + ppnr_forecast["total_operating_expenses"]
+
+    # The net interest margin is only there when the model is handed the whole net interest income forecast
+    return ppnr_forecast.drop(["average_net_interest_margin", "balance", "balance_across_segments"], axis=1, errors="ignore")
+
+
 class PpnrForecastModel(trac.TracModel):
 
     def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
         return trac.define_parameters()
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        non_interest_income_schema = trac.load_schema(schemas, "non_interest_income_schema.csv")
-        net_interest_income_schema = trac.load_schema(schemas, "net_interest_income_schema.csv")
-        business_support_costs_schema = trac.load_schema(schemas, "business_support_costs_schema.csv")
-        processing_costs_schema = trac.load_schema(schemas, "processing_costs_schema.csv")
-        sales_and_marketing_costs_schema = trac.load_schema(schemas, "sales_and_marketing_costs_schema.csv")
-        corporate_centre_costs_schema = trac.load_schema(schemas, "corporate_centre_costs_schema.csv")
+        non_interest_income_schema = SchemaRegistry.load_schema(schemas, "non_interest_income_schema.csv")
+        net_interest_income_schema = SchemaRegistry.load_schema(schemas, "net_interest_income_schema.csv")
+        business_support_costs_schema = SchemaRegistry.load_schema(schemas, "business_support_costs_schema.csv")
+        processing_costs_schema = SchemaRegistry.load_schema(schemas, "processing_costs_schema.csv")
+        sales_and_marketing_costs_schema = SchemaRegistry.load_schema(schemas, "sales_and_marketing_costs_schema.csv")
+        corporate_centre_costs_schema = SchemaRegistry.load_schema(schemas, "corporate_centre_costs_schema.csv")
 
         return {
             "non_interest_income": trac.ModelInputSchema(non_interest_income_schema),
@@ -74,42 +134,46 @@ class PpnrForecastModel(trac.TracModel):
         }
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        ppnr_forecast_schema = trac.load_schema(schemas, "ppnr_forecast_schema.csv")
+        ppnr_forecast_schema = SchemaRegistry.load_schema(schemas, "ppnr_forecast_schema.csv")
 
         return {
             "ppnr_forecast": trac.ModelOutputSchema(ppnr_forecast_schema)
         }
 
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {
+            "non_interest_income": ["date", "business_line", "region", "mortgage_type", "non_interest_income", "balance", "balance_across_segments"],
+            "net_interest_income": ["date", "business_line", "region", "mortgage_type", "net_interest_income"],
+            "business_support_costs": ["date", "region", "consulting_cost"],
+            "processing_costs": ["date", "region", "it_delivery_costs", "employee_costs"],
+            "sales_and_marketing_costs": ["date", "region", "direct_marketing_campaign_costs", "indirect_marketing_costs", "sales_commissions_costs", "employee_costs"],
+            "corporate_centre_costs": ["date", "region", "it_compute_cost", "it_infrastructure_cost", "physical_infrastructure_cost", "employee_costs"]
+        }
+
+    @StageMetrics.instrument
     def run_model(self, ctx: trac.TracContext):
         ctx.log().info("Operating costs profit model is running...")
 
-        business_support_costs = ctx.get_pandas_table("business_support_costs")
-        processing_costs = ctx.get_pandas_table("processing_costs")
-        sales_and_marketing_costs = ctx.get_pandas_table("sales_and_marketing_costs")
-        corporate_centre_costs = ctx.get_pandas_table("corporate_centre_costs")
-
-        non_interest_income = ctx.get_pandas_table("non_interest_income")
-        net_interest_income = ctx.get_pandas_table("net_interest_income")
-
-        total_income = non_interest_income.merge(net_interest_income, on=["date", "business_line", "mortgage_type", "region"], how="inner")
-        total_income["total_operating_income"] = total_income["net_interest_income"] + total_income["non_interest_income"]
-
-        operating_costs = calculate_operating_costs(corporate_centre_costs, sales_and_marketing_costs,
-                                                    processing_costs, business_support_costs)
-
-        operating_costs["total_operating_expenses"] = operating_costs["other_expenses"] + operating_costs["staff_costs"]
-        operating_costs = operating_costs[(operating_costs['date'] == 2021) & (operating_costs['region'].str.upper() == "SWEDEN")]
+        input_columns = self.define_input_columns()
 
-        ppnr_forecast = total_income.merge(operating_costs[["total_operating_expenses"]], how="cross")
+        business_support_costs = CompactTableUtils.get_compact_table(ctx, "business_support_costs", input_columns["business_support_costs"])
+        processing_costs = CompactTableUtils.get_compact_table(ctx, "processing_costs", input_columns["processing_costs"])
+        sales_and_marketing_costs = CompactTableUtils.get_compact_table(ctx, "sales_and_marketing_costs", input_columns["sales_and_marketing_costs"])
+        corporate_centre_costs = CompactTableUtils.get_compact_table(ctx, "corporate_centre_costs", input_columns["corporate_centre_costs"])
 
-        ppnr_forecast["total_operating_expenses"] = ppnr_forecast["total_operating_expenses"] * ppnr_forecast["balance"] / ppnr_forecast[
-            "balance_across_segments"]
+        non_interest_income = CompactTableUtils.get_compact_table(ctx, "non_interest_income", input_columns["non_interest_income"])
+        net_interest_income = CompactTableUtils.get_compact_table(ctx, "net_interest_income", input_columns["net_interest_income"])
 
-        ppnr_forecast["pre_provision_net_revenue"] = ppnr_forecast["total_operating_income"] + ppnr_forecast["total_operating_expenses"]
+        with StageMetrics.stage("prepare operating expenses", rows_in=len(corporate_centre_costs)) as stage:
+            operating_expenses = MemoCache.call(prepare_total_operating_expenses, corporate_centre_costs, sales_and_marketing_costs,
+                                                processing_costs, business_support_costs)
+            stage.rows_out = len(operating_expenses)
 
-        ppnr_forecast.drop(["average_net_interest_margin", "balance", "balance_across_segments"], axis=1, inplace=True)
+        with StageMetrics.stage("forecast ppnr", rows_in=len(net_interest_income)) as stage:
+            ppnr_forecast = calculate_ppnr_forecast(non_interest_income, net_interest_income, operating_expenses)
+            stage.rows_out = len(ppnr_forecast)
 
-        ctx.put_pandas_table("ppnr_forecast", ppnr_forecast)
+        CompactTableUtils.put_compact_table(ctx, "ppnr_forecast", ppnr_forecast)
 
 
 if __name__ == "__main__":
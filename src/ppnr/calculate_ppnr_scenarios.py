@@ -0,0 +1,176 @@
+#  Copyright 2022 Accenture Global Solutions Limited
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import typing as tp
+import tracdap.rt.api as trac
+import ppnr.schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics
+from utils.utils_forecast_calendar import ForecastCalendarUtils
+from utils.utils_memo_cache import MemoCache
+import datetime
+import pyarrow.compute as pc
+
+from ppnr.calculate_portfolio_runoff import calculate_portfolio_runoff
+from ppnr.calculate_new_originations import calculate_new_originations, observation_date_filter
+from ppnr.calculate_balance_forecast import aggregate_mortgage_book_t0, calculate_balance_forecast
+from ppnr.calculate_net_interest_income import prepare_net_interest_margin, calculate_net_interest_income_forecast
+from ppnr.calculate_non_interest_income import prepare_net_fee_commissions_income, calculate_non_interest_income_forecast
+from ppnr.calculate_ppnr_forecast import prepare_total_operating_expenses, calculate_ppnr_forecast
+
+# The column identifying each scenario in a stacked scenario table
+SCENARIO_ID_COLUMN = "scenario_id"
+
+
+def calculate_ppnr_scenarios(market_scenarios, mortgage_book_t0, cost_of_funding, customer_rates, fees_and_commissions_income,
+                             corporate_centre_costs, sales_and_marketing_costs, processing_costs, business_support_costs,
+                             first_forecast_month, last_forecast_month, sek_to_eur_exchange_rate):
+    """
+    Run the PPNR chain for a set of market scenarios stacked on top of each other. The work that does not depend on
+    the scenario (the runoff of the t0 book, the balance at the start of the forecast, the net interest margin, the
+    fee income and the operating expenses) is done once, then every scenario goes through the rest of the chain in
+    a single pass with the scenario_id as part of each grouping and join. The rows for each scenario match a run of
+    the individual models on that scenario alone.
+    :param market_scenarios: The market scenarios, one row per scenario and month.
+    :param mortgage_book_t0: The mortgage book at t0, one row per account.
+    :param cost_of_funding: The cost of funding by year and region.
+    :param customer_rates: The customer rates by year and region.
+    :param fees_and_commissions_income: The fee and commission income by year and region.
+    :param corporate_centre_costs: The corporate centre costs by year and region.
+    :param sales_and_marketing_costs: The sales and marketing costs by year and region.
+    :param processing_costs: The processing costs by year and region.
+    :param business_support_costs: The business support costs by year and region.
+    :param first_forecast_month: A date in the first month of the forecast.
+    :param last_forecast_month: A date in the last month of the forecast.
+    :param sek_to_eur_exchange_rate: The exchange rate used to convert the new lending to EUR.
+    :return: The PPNR forecast, one row per scenario, segment and month.
+    """
+    key_columns = [SCENARIO_ID_COLUMN]
+
+    # The work shared by every scenario, this is also reused from the cache on later runs when the inputs are the same
+    with StageMetrics.stage("shared work", rows_in=len(mortgage_book_t0)):
+        portfolio_runoff = MemoCache.call(calculate_portfolio_runoff, mortgage_book_t0, first_forecast_month, last_forecast_month)
+        balance_at_start = MemoCache.call(aggregate_mortgage_book_t0, mortgage_book_t0)
+        net_interest_margin = MemoCache.call(prepare_net_interest_margin, cost_of_funding, customer_rates)
+        net_fee_commissions_income = MemoCache.call(prepare_net_fee_commissions_income, fees_and_commissions_income)
+        operating_expenses = MemoCache.call(prepare_total_operating_expenses, corporate_centre_costs, sales_and_marketing_costs,
+                                            processing_costs, business_support_costs)
+
+    with StageMetrics.stage("scenario forecasts", rows_in=len(market_scenarios)) as stage:
+
+        # The new originations are worked out for the same months as in NewOriginationsModel
+        new_originations = calculate_new_originations(market_scenarios, ForecastCalendarUtils.first_day_of_month(first_forecast_month),
+                                                      ForecastCalendarUtils.last_day_of_month(last_forecast_month), sek_to_eur_exchange_rate, key_columns)
+
+        balance_forecast = calculate_balance_forecast(balance_at_start, portfolio_runoff, new_originations, key_columns)
+
+        net_interest_income = calculate_net_interest_income_forecast(balance_forecast, net_interest_margin)
+        non_interest_income = calculate_non_interest_income_forecast(balance_forecast, net_fee_commissions_income, key_columns)
+
+        ppnr_forecast = calculate_ppnr_forecast(non_interest_income, net_interest_income, operating_expenses, key_columns)
+
+        stage.rows_out = len(ppnr_forecast)
+
+    # A stable sort keeps the rows for each scenario in the order the individual models put them in
+    return ppnr_forecast.sort_values(by=key_columns, kind="stable").reset_index(drop=True)
+
+
+class PpnrScenariosModel(trac.TracModel):
+
+    def define_parameters(self) -> tp.Dict[str, trac.ModelParameter]:
+        return trac.define_parameters(
+
+            trac.P("first_forecast_month", trac.BasicType.DATE, label="First month of forecast",
+                   default_value=datetime.datetime(2022, 1, 1).date()),
+
+            trac.P("last_forecast_month", trac.BasicType.DATE, label="Last month of forecast",
+                   default_value=datetime.datetime(2025, 12, 1).date()),
+
+            trac.P("sek_to_eur_exchange_rate", trac.BasicType.FLOAT, label="SEK to EUR exchange rate",
+                   default_value=0.09)
+        )
+
+    def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
+        market_scenarios_schema = SchemaRegistry.load_schema(schemas, "market_scenarios_schema.csv")
+        mortgage_book_t0_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+        cost_of_funding_schema = SchemaRegistry.load_schema(schemas, "cost_of_funding_schema.csv")
+        customer_rates_schema = SchemaRegistry.load_schema(schemas, "customer_rates_schema.csv")
+        fees_and_commissions_income_schema = SchemaRegistry.load_schema(schemas, "fees_and_commissions_income_schema.csv")
+        business_support_costs_schema = SchemaRegistry.load_schema(schemas, "business_support_costs_schema.csv")
+        processing_costs_schema = SchemaRegistry.load_schema(schemas, "processing_costs_schema.csv")
+        sales_and_marketing_costs_schema = SchemaRegistry.load_schema(schemas, "sales_and_marketing_costs_schema.csv")
+        corporate_centre_costs_schema = SchemaRegistry.load_schema(schemas, "corporate_centre_costs_schema.csv")
+
+        return {
+            "market_scenarios": trac.ModelInputSchema(market_scenarios_schema),
+            "mortgage_book_t0": trac.ModelInputSchema(mortgage_book_t0_schema),
+            "cost_of_funding": trac.ModelInputSchema(cost_of_funding_schema),
+            "customer_rates": trac.ModelInputSchema(customer_rates_schema),
+            "fees_and_commissions_income": trac.ModelInputSchema(fees_and_commissions_income_schema),
+            "business_support_costs": trac.ModelInputSchema(business_support_costs_schema),
+            "processing_costs": trac.ModelInputSchema(processing_costs_schema),
+            "sales_and_marketing_costs": trac.ModelInputSchema(sales_and_marketing_costs_schema),
+            "corporate_centre_costs": trac.ModelInputSchema(corporate_centre_costs_schema)
+        }
+
+    def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
+        ppnr_forecast_scenarios_schema = SchemaRegistry.load_schema(schemas, "ppnr_forecast_scenarios_schema.csv")
+
+        return {"ppnr_forecast_scenarios": trac.ModelOutputSchema(ppnr_forecast_scenarios_schema)}
+
+    def define_input_filters(self, parameters: tp.Dict[str, tp.Any]) -> tp.Dict[str, pc.Expression]:
+        return {"market_scenarios": observation_date_filter(parameters["first_forecast_month"], parameters["last_forecast_month"])}
+
+    def define_input_columns(self) -> tp.Dict[str, tp.List[str]]:
+        return {
+            "mortgage_book_t0": ["business_line", "region", "mortgage_type", "balance", "monthly_repayment"],
+            "cost_of_funding": ["date", "region", "average_funding_interest_rate"],
+            "customer_rates": ["date", "region", "average_earner_interest_rate"],
+            "fees_and_commissions_income": ["date", "region", "commissions_fees", "early_termination_early_payments", "delinquency_fees"],
+            "business_support_costs": ["date", "region", "consulting_cost"],
+            "processing_costs": ["date", "region", "it_delivery_costs", "employee_costs"],
+            "sales_and_marketing_costs": ["date", "region", "direct_marketing_campaign_costs", "indirect_marketing_costs", "sales_commissions_costs", "employee_costs"],
+            "corporate_centre_costs": ["date", "region", "it_compute_cost", "it_infrastructure_cost", "physical_infrastructure_cost", "employee_costs"]
+        }
+
+    @StageMetrics.instrument
+    def run_model(self, ctx: trac.TracContext):
+        ctx.log().info("PPNR scenarios model is running...")
+
+        input_columns = self.define_input_columns()
+
+        ppnr_forecast_scenarios = calculate_ppnr_scenarios(
+            CompactTableUtils.get_compact_table(ctx, "market_scenarios"),
+            CompactTableUtils.get_compact_table(ctx, "mortgage_book_t0", input_columns["mortgage_book_t0"]),
+            CompactTableUtils.get_compact_table(ctx, "cost_of_funding", input_columns["cost_of_funding"]),
+            CompactTableUtils.get_compact_table(ctx, "customer_rates", input_columns["customer_rates"]),
+            CompactTableUtils.get_compact_table(ctx, "fees_and_commissions_income", input_columns["fees_and_commissions_income"]),
+            CompactTableUtils.get_compact_table(ctx, "corporate_centre_costs", input_columns["corporate_centre_costs"]),
+            CompactTableUtils.get_compact_table(ctx, "sales_and_marketing_costs", input_columns["sales_and_marketing_costs"]),
+            CompactTableUtils.get_compact_table(ctx, "processing_costs", input_columns["processing_costs"]),
+            CompactTableUtils.get_compact_table(ctx, "business_support_costs", input_columns["business_support_costs"]),
+            ctx.get_parameter("first_forecast_month"),
+            ctx.get_parameter("last_forecast_month"),
+            ctx.get_parameter("sek_to_eur_exchange_rate"))
+
+        ctx.log().info(f"Calculated {ppnr_forecast_scenarios[SCENARIO_ID_COLUMN].nunique()} scenarios")
+
+        CompactTableUtils.put_compact_table(ctx, "ppnr_forecast_scenarios", ppnr_forecast_scenarios)
+
+
+if __name__ == "__main__":
+    import tracdap.rt.launch as launch
+
+    launch.launch_model(PpnrScenariosModel, "config/calculate_ppnr_scenarios.yaml", "config/sys_config.yaml")
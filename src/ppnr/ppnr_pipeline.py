@@ -0,0 +1,45 @@
+#  Copyright 2022 Accenture Global Solutions Limited
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import sys
+import typing as tp
+import tracdap.rt.api as trac
+
+from ppnr.calculate_portfolio_runoff import PortfolioRunoffModel
+from ppnr.calculate_new_originations import NewOriginationsModel
+from ppnr.calculate_balance_forecast import BalanceForecastModel
+from ppnr.calculate_net_interest_income import NetInterestMarginDataModel
+from ppnr.calculate_non_interest_income import NonInterestIncomeModel
+from ppnr.calculate_ppnr_forecast import PpnrForecastModel
+
+# The PPNR models keyed by the node names used in flows/mortgage_ppnr_v2.json, the pipeline works out the order to run
+# them in from their inputs and outputs
+PPNR_MODELS: tp.Dict[str, tp.Type[trac.TracModel]] = {
+    "calculate_portfolio_runoff": PortfolioRunoffModel,
+    "calculate_new_originations": NewOriginationsModel,
+    "calculate_balance_forecast": BalanceForecastModel,
+    "calculate_net_interest_income": NetInterestMarginDataModel,
+    "calculate_non_interest_income": NonInterestIncomeModel,
+    "calculate_forecast_ppnr": PpnrForecastModel
+}
+
+
+if __name__ == "__main__":
+    from utils.utils_model_pipeline import run_pipeline_config
+
+    # The pipeline config can be given on the command line, for example config/ppnr_pipeline_parquet.yaml, or
+    # config/ppnr_pipeline_concurrent.yaml to run the models in a pool of worker processes
+    pipeline_config = sys.argv[1] if len(sys.argv) > 1 else "config/ppnr_pipeline.yaml"
+
+    run_pipeline_config(PPNR_MODELS, pipeline_config, "config/sys_config.yaml")
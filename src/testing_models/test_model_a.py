@@ -1,6 +1,7 @@
 import tracdap.rt.api as trac
 import typing as tp
 from testing_models import schemas as schemas
+from utils.utils_schema_registry import SchemaRegistry
 import datetime
 
 
@@ -62,12 +63,12 @@ class Wrapper(trac.TracModel):
         )
 
     def define_inputs(self) -> tp.Dict[str, trac.ModelInputSchema]:
-        test_input_schema = trac.load_schema(schemas, "test_schema.csv")
+        test_input_schema = SchemaRegistry.load_schema(schemas, "test_schema.csv")
 
         return {"test_input": trac.ModelInputSchema(test_input_schema)}
 
     def define_outputs(self) -> tp.Dict[str, trac.ModelOutputSchema]:
-        test_output_schema = trac.load_schema(schemas, "test_schema.csv")
+        test_output_schema = SchemaRegistry.load_schema(schemas, "test_schema.csv")
 
         return {"test_output": trac.ModelOutputSchema(test_output_schema)}
 
@@ -0,0 +1,245 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import importlib.resources
+import logging
+import pathlib
+
+# Load the python libraries
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pa_pq
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+import tracdap.rt.ext.plugins as trac_plugins
+
+# Load the TRAC runtime internals, the CSV codec is the one the runtime uses to read CSV inputs so converted files hold
+# exactly the types a model would see
+import tracdap.rt._impl.data as _trac_data  # noqa
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+import tracdap.rt._impl.storage as _trac_storage  # noqa
+
+# Load the TRAC helpers
+from utils.utils_schema_registry import SchemaRegistry
+
+"""
+Reading and writing inputs in the columnar formats the TRAC runtime supports, Parquet and Arrow IPC files (also known
+as Feather). Unlike CSV these hold typed columns that are read without parsing, only the columns that are asked for are
+read, and a row filter can skip whole row groups using the statistics Parquet keeps for each of them. A converter turns
+the CSV sample data into either format.
+
+Convert the sample data from the root of the repository with:
+    PYTHONPATH=src python src/utils/utils_columnar_storage.py data/inputs --format PARQUET
+"""
+
+# The columnar formats by TRAC format code, with the file extension the runtime uses to recognise them
+COLUMNAR_FORMATS = {"PARQUET": ".parquet", "ARROW_FILE": ".arrow"}
+
+# The number of rows in each Parquet row group or Arrow record batch, a row filter skips or keeps whole groups
+DEFAULT_ROWS_PER_GROUP = 100000
+
+
+class ColumnarStorageUtils:
+
+    @staticmethod
+    def is_columnar_format(storage_format: str) -> bool:
+        """
+        A function that says whether a TRAC format code is one of the columnar formats.
+        :param storage_format: The TRAC format code, for example 'PARQUET' or 'CSV'.
+        :return: True for Parquet and Arrow IPC files.
+        """
+
+        return storage_format.upper() in COLUMNAR_FORMATS
+
+    @staticmethod
+    def read_table(source: tp.Union[str, tp.BinaryIO], storage_format: str, columns: tp.Optional[tp.List[str]] = None,
+                   row_filter: tp.Optional[pc.Expression] = None, memory_map: bool = False) -> pa.Table:
+        """
+        A function that reads a Parquet or Arrow IPC file. For Parquet the row filter is checked against the
+        statistics of each row group so groups with no matching rows are never read. Arrow IPC files have no
+        statistics, so they are filtered one record batch at a time as they are read.
+        :param source: The path to the file, or the file opened for reading.
+        :param storage_format: The TRAC format code, 'PARQUET' or 'ARROW_FILE'.
+        :param columns: The columns to read, by default all of them.
+        :param row_filter: A filter on the rows to keep, the columns it uses do not need to be read.
+        :param memory_map: Whether to memory-map a file given by its path. The columns of an uncompressed Arrow file
+        are then views over the mapped file, shared with every other process that maps it, as long as no row filter
+        is given. Parquet has to be decoded, so mapping it only saves a copy of the raw file.
+        :return: The rows and columns that were asked for.
+        """
+
+        if storage_format.upper() == "PARQUET":
+            return pa_pq.read_table(source, columns=columns, filters=row_filter, memory_map=memory_map)
+
+        if storage_format.upper() == "ARROW_FILE":
+
+            if isinstance(source, str):
+                source = pa.memory_map(source, "r") if memory_map else pa.OSFile(source, "rb")
+
+            reader = pa.ipc.open_file(source)
+            batches = []
+
+            for batch_index in range(reader.num_record_batches):
+                batch = pa.Table.from_batches([reader.get_batch(batch_index)])
+
+                if row_filter is not None:
+                    batch = batch.filter(row_filter)
+
+                batches.append(batch.select(columns) if columns is not None else batch)
+
+            if not batches:
+                schema = reader.schema
+                return schema.empty_table().select(columns) if columns is not None else schema.empty_table()
+
+            return pa.concat_tables(batches)
+
+        raise Exception(f"Storage format '{storage_format}' is not a columnar format, use one of {', '.join(COLUMNAR_FORMATS)}")
+
+    @staticmethod
+    def write_table(target: tp.Union[str, tp.BinaryIO], table: pa.Table, storage_format: str, rows_per_group: int = DEFAULT_ROWS_PER_GROUP):
+        """
+        A function that writes a Parquet or Arrow IPC file, split into groups of rows so that a row filter can skip
+        the groups it does not need.
+        :param target: The path to the file, or the file opened for writing.
+        :param table: The table to write.
+        :param storage_format: The TRAC format code, 'PARQUET' or 'ARROW_FILE'.
+        :param rows_per_group: The number of rows in each row group or record batch, 0 writes a single group. An Arrow
+        file that is shared between processes through a memory map should be a single group, so that each column is
+        one contiguous array that pandas can view without joining up the pieces.
+        """
+
+        if rows_per_group <= 0:
+            rows_per_group = max(table.num_rows, 1)
+
+        if storage_format.upper() == "PARQUET":
+            pa_pq.write_table(table, target, row_group_size=rows_per_group)
+
+        elif storage_format.upper() == "ARROW_FILE":
+            # Written without compression, in the same way as the TRAC runtime writes Arrow files
+            with pa.ipc.new_file(target, table.schema) as writer:
+                writer.write_table(table, max_chunksize=rows_per_group)
+
+        else:
+            raise Exception(f"Storage format '{storage_format}' is not a columnar format, use one of {', '.join(COLUMNAR_FORMATS)}")
+
+    @staticmethod
+    def read_csv(csv_path: tp.Union[str, pathlib.Path], schema: tp.Optional[trac.SchemaDefinition] = None) -> pa.Table:
+        """
+        A function that reads a CSV file into an Arrow table. With a schema the file is read by the TRAC runtime's own
+        CSV codec, so dates, booleans and numbers come out exactly as a model would see them, otherwise the types
+        are inferred from the data.
+        :param csv_path: The path to the CSV file.
+        :param schema: The TRAC schema of the file.
+        :return: The data.
+        """
+
+        if schema is None:
+            return pa_csv.read_csv(str(csv_path))
+
+        arrow_schema = _trac_data.DataMapping.trac_to_arrow_schema(schema)
+        csv_codec = _trac_storage.FormatManager.get_data_format("CSV", {"lenient_csv_parser": True})
+
+        with pa.OSFile(str(csv_path), "rb") as csv_source:
+            table = csv_codec.read_table(csv_source, arrow_schema)
+
+        return _trac_data.DataConformance.conform_to_schema(table, arrow_schema, warn_extra_columns=False)
+
+    @staticmethod
+    def convert_csv(csv_path: tp.Union[str, pathlib.Path], storage_format: str = "PARQUET", schema: tp.Optional[trac.SchemaDefinition] = None,
+                    sort_by: tp.Optional[tp.List[str]] = None, rows_per_group: int = DEFAULT_ROWS_PER_GROUP) -> pathlib.Path:
+        """
+        A function that converts a CSV file to Parquet or an Arrow IPC file, the new file is written next to the CSV
+        file with the extension of the new format.
+        :param csv_path: The path to the CSV file.
+        :param storage_format: The TRAC format code, 'PARQUET' or 'ARROW_FILE'.
+        :param schema: The TRAC schema of the file, by default the types are inferred from the data.
+        :param sort_by: Columns to sort the rows by, sorting on the columns used in row filters keeps the range of
+        values in each row group narrow. By default the rows keep their order in the CSV file.
+        :param rows_per_group: The number of rows in each row group or record batch.
+        :return: The path to the new file.
+        """
+
+        if not ColumnarStorageUtils.is_columnar_format(storage_format):
+            raise Exception(f"Storage format '{storage_format}' is not a columnar format, use one of {', '.join(COLUMNAR_FORMATS)}")
+
+        csv_path = pathlib.Path(csv_path)
+        target_path = csv_path.with_suffix(COLUMNAR_FORMATS[storage_format.upper()])
+
+        table = ColumnarStorageUtils.read_csv(csv_path, schema)
+
+        if sort_by:
+            table = table.sort_by([(column_name, "ascending") for column_name in sort_by])
+
+        ColumnarStorageUtils.write_table(str(target_path), table, storage_format, rows_per_group)
+
+        return target_path
+
+    @staticmethod
+    def find_schema(csv_path: pathlib.Path) -> tp.Optional[trac.SchemaDefinition]:
+        """
+        A function that finds the schema for a file of sample data. Files under data/inputs/<package> use the schema
+        of the same name in the <package>.schemas package, for example inputs/ppnr/mortgage_book_t0.csv uses
+        ppnr/schemas/mortgage_book_t0_schema.csv.
+        :param csv_path: The path to the CSV file.
+        :return: The schema, or None if there is not one.
+        """
+
+        schema_package = f"{csv_path.parent.name}.schemas"
+        schema_file = f"{csv_path.stem}_schema.csv"
+
+        try:
+            if not importlib.resources.files(schema_package).joinpath(schema_file).is_file():
+                return None
+        except ModuleNotFoundError:
+            return None
+
+        return SchemaRegistry.load_schema(schema_package, schema_file)
+
+    @staticmethod
+    def convert_folder(input_folder: tp.Union[str, pathlib.Path], storage_format: str = "PARQUET",
+                       rows_per_group: int = DEFAULT_ROWS_PER_GROUP) -> tp.List[pathlib.Path]:
+        """
+        A function that converts every CSV file in a folder and its sub-folders, using the matching schema where
+        there is one.
+        :param input_folder: The folder holding the CSV files, for example data/inputs.
+        :param storage_format: The TRAC format code, 'PARQUET' or 'ARROW_FILE'.
+        :param rows_per_group: The number of rows in each row group or record batch.
+        :return: The paths to the new files.
+        """
+
+        log = logging.getLogger(ColumnarStorageUtils.__name__)
+
+        converted = []
+
+        for csv_path in sorted(pathlib.Path(input_folder).rglob("*.csv")):
+
+            schema = ColumnarStorageUtils.find_schema(csv_path)
+
+            try:
+                target_path = ColumnarStorageUtils.convert_csv(csv_path, storage_format, schema, rows_per_group=rows_per_group)
+            except Exception as e:
+                # Some of the sample files hold deliberately invalid data to test the models, these are left as CSV
+                log.warning(f"Could not convert [{csv_path}]: {e}")
+                continue
+
+            log.info(f"Converted [{csv_path}] to [{target_path}] {'using its schema' if schema else 'with inferred types'}")
+            converted.append(target_path)
+
+        return converted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Convert CSV sample data to a columnar format")
+    parser.add_argument("input_folder", help="The folder holding the CSV files, for example data/inputs")
+    parser.add_argument("--format", default="PARQUET", choices=list(COLUMNAR_FORMATS), help="The format to convert to")
+    parser.add_argument("--rows-per-group", type=int, default=DEFAULT_ROWS_PER_GROUP, help="The number of rows in each row group, 0 for one group")
+    arguments = parser.parse_args()
+
+    # Schemas and the CSV codec are loaded through the TRAC runtime, which needs its plugins outside of a model run
+    trac_plugins.PluginManager.register_core_plugins()
+    _trac_static_api.StaticApiImpl.register_impl()
+
+    ColumnarStorageUtils.convert_folder(arguments.input_folder, arguments.format, arguments.rows_per_group)
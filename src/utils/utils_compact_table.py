@@ -0,0 +1,304 @@
+# Load a plugin to allow typing
+import typing as tp
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+
+# Load the TRAC helpers
+from utils.utils_stage_metrics import StageMetrics
+
+"""
+Helpers that keep model data in compact, Arrow-backed column types rather than columns of Python objects. The TRAC
+runtime hands models a pandas dataFrame with one Python string object per cell for every STRING field, which costs
+50-100 bytes a cell and makes every groupby and merge on those columns hash Python objects. Fields marked as
+categorical in the schema are turned into pandas categoricals, which hold small integer codes over one copy of each
+distinct value and map directly onto Arrow dictionary arrays, and the other STRING fields into Arrow-backed strings.
+
+Every INTEGER field comes from the runtime as 64-bit integers, these are narrowed to the smallest width that holds
+twice the largest value in the column, so adding or subtracting two columns cannot overflow. A model can also ask for
+FLOAT fields to be held as 32-bit floats, which halves them but keeps only about 7 significant digits, so this is
+only for columns where that precision is enough. The types for each column make up a dtype plan, worked out from the
+schema and the range of the data. Date columns are left as they are.
+"""
+
+# The pandas type used for STRING fields that are not categorical, the values are held in an Arrow string array
+ARROW_STRING_DTYPE = pd.StringDtype("pyarrow")
+
+# The integer widths columns are narrowed to, narrowest first
+INTEGER_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+# The pandas types the TRAC runtime gives a model for each Arrow type, apart from strings
+ARROW_TO_PANDAS_TYPES = {
+    pa.bool_(): pd.BooleanDtype(),
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(),
+    pa.float16(): pd.Float32Dtype(),
+    pa.float32(): pd.Float32Dtype(),
+    pa.float64(): pd.Float64Dtype()
+}
+
+
+class CompactTableUtils:
+
+    @staticmethod
+    def get_compact_columns(schema: trac.SchemaDefinition) -> tp.Tuple[tp.List[str], tp.List[str]]:
+        """
+        A function that works out which columns in a schema should be held as categoricals and which as Arrow
+        strings.
+        :param schema: The TRAC schema of the dataset.
+        :return: The categorical columns and the other string columns.
+        """
+
+        categorical_columns = []
+        string_columns = []
+
+        for field in schema.table.fields:
+            if field.fieldType == trac.BasicType.STRING:
+                if field.categorical:
+                    categorical_columns.append(field.fieldName)
+                else:
+                    string_columns.append(field.fieldName)
+
+        return categorical_columns, string_columns
+
+    @staticmethod
+    def compact_table(data: pd.DataFrame, categorical_columns: tp.List[str], string_columns: tp.Optional[tp.List[str]] = None) -> pd.DataFrame:
+        """
+        A function that converts the string columns of a dataFrame to compact types, columns that are not in the
+        dataFrame are skipped.
+        :param data: The dataFrame to convert, it is changed in place.
+        :param categorical_columns: The columns to hold as categoricals.
+        :param string_columns: The columns to hold as Arrow strings.
+        :return: The converted dataFrame.
+        """
+
+        for column_name in categorical_columns:
+            if column_name in data.columns and not isinstance(data[column_name].dtype, pd.CategoricalDtype):
+                data[column_name] = data[column_name].astype("category")
+
+        for column_name in string_columns or []:
+            if column_name in data.columns and data[column_name].dtype != ARROW_STRING_DTYPE:
+                data[column_name] = data[column_name].astype(ARROW_STRING_DTYPE)
+
+        return data
+
+    @staticmethod
+    def narrowest_integer_dtype(column: pd.Series) -> tp.Union[np.dtype, pd.api.extensions.ExtensionDtype]:
+        """
+        A function that gives the narrowest integer type that holds twice the largest value in a column, nullable
+        if the column is nullable.
+        :param column: An integer column.
+        :return: The type to hold the column in.
+        """
+
+        nullable = isinstance(column.dtype, pd.api.extensions.ExtensionDtype)
+        values = column.array if nullable else column.to_numpy()
+
+        largest = max(abs(int(values.min())), abs(int(values.max()))) if len(column) > 0 and column.notna().any() else 0
+
+        for integer_dtype in INTEGER_DTYPES:
+            if 2 * largest <= np.iinfo(integer_dtype).max:
+                return pd.api.types.pandas_dtype(integer_dtype.__name__.capitalize()) if nullable else np.dtype(integer_dtype)
+
+        return column.dtype
+
+    @staticmethod
+    def get_dtype_plan(schema: trac.SchemaDefinition, data: pd.DataFrame,
+                       float32_columns: tp.Optional[tp.List[str]] = None) -> tp.Dict[str, tp.Any]:
+        """
+        A function that works out the compact type for each column of a dataFrame from its schema, categorical STRING
+        fields become categoricals, other STRING fields Arrow strings and INTEGER fields the narrowest safe width.
+        :param schema: The TRAC schema of the dataset.
+        :param data: The dataFrame, the integer widths depend on the values in it.
+        :param float32_columns: FLOAT fields that can be held as 32-bit floats.
+        :return: The type for each column that is to change.
+        """
+
+        dtype_plan = dict()
+
+        for field in schema.table.fields:
+
+            column_name = field.fieldName
+
+            if column_name not in data.columns:
+                continue
+
+            dtype = data[column_name].dtype
+
+            if field.fieldType == trac.BasicType.STRING:
+                if field.categorical and not isinstance(dtype, pd.CategoricalDtype):
+                    dtype_plan[column_name] = "category"
+                elif not field.categorical and dtype != ARROW_STRING_DTYPE:
+                    dtype_plan[column_name] = ARROW_STRING_DTYPE
+
+            elif field.fieldType == trac.BasicType.INTEGER and pd.api.types.is_integer_dtype(dtype):
+                integer_dtype = CompactTableUtils.narrowest_integer_dtype(data[column_name])
+                if integer_dtype != dtype:
+                    dtype_plan[column_name] = integer_dtype
+
+            elif field.fieldType == trac.BasicType.FLOAT and column_name in (float32_columns or []) and pd.api.types.is_float_dtype(dtype):
+                float_dtype = pd.Float32Dtype() if isinstance(dtype, pd.api.extensions.ExtensionDtype) else np.dtype(np.float32)
+                if float_dtype != dtype:
+                    dtype_plan[column_name] = float_dtype
+
+        return dtype_plan
+
+    @staticmethod
+    def apply_dtype_plan(data: pd.DataFrame, dtype_plan: tp.Dict[str, tp.Any]) -> pd.DataFrame:
+        """
+        A function that converts the columns of a dataFrame to the types in a dtype plan.
+        :param data: The dataFrame to convert, it is changed in place.
+        :param dtype_plan: The type for each column, from get_dtype_plan.
+        :return: The converted dataFrame.
+        """
+
+        for column_name, dtype in dtype_plan.items():
+            data[column_name] = data[column_name].astype(dtype)
+
+        return data
+
+    @staticmethod
+    def get_compact_table(ctx: trac.TracContext, dataset_name: str, columns: tp.Optional[tp.List[str]] = None,
+                          float32_columns: tp.Optional[tp.List[str]] = None) -> pd.DataFrame:
+        """
+        A function that reads a model input, keeps only the columns the model reads and converts them to compact
+        types, using the dtype plan for the input's schema. The memory held by the input before and after is logged,
+        and recorded with the stage metrics.
+        :param ctx: The model context.
+        :param dataset_name: The name of the input.
+        :param columns: The columns the model reads, as declared by its define_input_columns method, by default all of
+        them. In a model pipeline the input only has these columns already.
+        :param float32_columns: FLOAT fields the model can use as 32-bit floats.
+        :return: The input as a dataFrame.
+        """
+
+        with StageMetrics.stage(f"load {dataset_name}") as stage:
+
+            data = ctx.get_pandas_table(dataset_name)
+            memory_before = CompactTableUtils.memory_usage(data)
+
+            if columns is not None:
+                data = data.drop(columns=[column_name for column_name in data.columns if column_name not in columns])
+
+            dtype_plan = CompactTableUtils.get_dtype_plan(ctx.get_schema(dataset_name), data, float32_columns)
+            data = CompactTableUtils.apply_dtype_plan(data, dtype_plan)
+            memory_after = CompactTableUtils.memory_usage(data)
+
+            stage.rows_out = len(data)
+            stage.bytes_in = memory_before
+            stage.bytes_out = memory_after
+
+        ctx.log().info(f"Loaded {dataset_name}, {len(data)} rows in {CompactTableUtils.format_bytes(memory_before)}, "
+                       f"{CompactTableUtils.format_bytes(memory_after)} after {len(dtype_plan)} columns were made compact")
+
+        return data
+
+    @staticmethod
+    def put_compact_table(ctx: trac.TracContext, dataset_name: str, data: pd.DataFrame):
+        """
+        A function that writes a model output that may hold categorical columns. The TRAC runtime does not accept
+        Arrow dictionary arrays for STRING fields, so categoricals are expanded into Arrow strings as the output is
+        handed over, without going through Python string objects.
+        :param ctx: The model context.
+        :param dataset_name: The name of the output.
+        :param data: The output as a dataFrame.
+        """
+
+        with StageMetrics.stage(f"save {dataset_name}", rows_in=len(data)):
+
+            categorical_columns = [column_name for column_name, dtype in data.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+
+            if categorical_columns:
+                data = data.assign(**{column_name: data[column_name].astype(ARROW_STRING_DTYPE) for column_name in categorical_columns})
+
+            ctx.put_pandas_table(dataset_name, data)
+
+    @staticmethod
+    def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+        """
+        A function that converts an Arrow table to a dataFrame with the column types the TRAC runtime gives a model,
+        except that strings are Arrow strings. Strings, integers and floats held in one contiguous Arrow array become
+        views over the Arrow buffers rather than copies, with or without missing values, so a table read from a
+        memory-mapped file is shared by every process that maps the file. Integers and floats each add a null mask of
+        one byte per row. Booleans and dates are always copied, pandas holds them in a different layout. The views are
+        read-only, so a model has to assign new columns rather than write into the columns of an input.
+        :param table: The Arrow table.
+        :return: The table as a dataFrame.
+        """
+
+        columns = dict()
+        copied_columns = []
+
+        for field, column in zip(table.schema, table.columns):
+
+            if pa.types.is_string(field.type):
+                columns[field.name] = pd.arrays.ArrowStringArray(column)
+
+            elif (pa.types.is_integer(field.type) or field.type in (pa.float32(), pa.float64())) and column.num_chunks > 0:
+
+                # A column split over several chunks has to be joined up, which is a copy
+                array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+                # The values are a view over the data buffer, the slots under a null hold whatever is in the buffer but
+                # pandas never reads them as the mask marks them missing
+                values = np.frombuffer(array.buffers()[1], dtype=array.type.to_pandas_dtype(), count=array.offset + len(array))[array.offset:] \
+                    if len(array) > 0 else np.zeros(0, dtype=array.type.to_pandas_dtype())
+
+                if array.null_count > 0:
+                    mask = array.is_null().to_numpy(zero_copy_only=False)
+                else:
+                    mask = np.zeros(len(array), dtype=bool)
+
+                if pa.types.is_integer(field.type):
+                    columns[field.name] = pd.arrays.IntegerArray(values, mask)
+                else:
+                    columns[field.name] = pd.arrays.FloatingArray(values, mask)
+
+            else:
+                columns[field.name] = None
+                copied_columns.append(field.name)
+
+        if copied_columns:
+            copied = table.select(copied_columns).to_pandas(
+                types_mapper=ARROW_TO_PANDAS_TYPES.get, date_as_object=False, timestamp_as_object=False,
+                ignore_metadata=True, split_blocks=True)
+            columns.update({column_name: copied[column_name].array for column_name in copied_columns})
+
+        # A dictionary of arrays is copied by the dataFrame constructor unless it is told not to
+        return pd.DataFrame(columns, copy=False)
+
+    @staticmethod
+    def format_bytes(number_of_bytes: int) -> str:
+        """
+        A function that writes a number of bytes in KiB, MiB or GiB, whichever reads best.
+        """
+
+        for unit, unit_bytes in [("GiB", 2 ** 30), ("MiB", 2 ** 20)]:
+            if number_of_bytes >= unit_bytes:
+                return f"{number_of_bytes / unit_bytes:.1f} {unit}"
+
+        return f"{number_of_bytes / 2 ** 10:.1f} KiB"
+
+    @staticmethod
+    def memory_usage(data: tp.Union[pd.DataFrame, pa.Table]) -> int:
+        """
+        A function that gives the memory held by a dataFrame or Arrow table in bytes, counting the Python string
+        objects in object columns.
+        :param data: The dataFrame or table.
+        :return: The memory in bytes.
+        """
+
+        if isinstance(data, pa.Table):
+            return data.nbytes
+
+        return int(data.memory_usage(index=True, deep=True).sum())
@@ -0,0 +1,134 @@
+import datetime
+import functools
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+
+
+@functools.lru_cache(maxsize=32)
+def _month_end_dates(first_month: np.datetime64, last_month: np.datetime64) -> np.ndarray:
+    """
+    The last day of every month from first_month to last_month, worked out once for each forecast horizon.
+    """
+    months = np.arange(first_month, last_month + 1, dtype="datetime64[M]")
+
+    month_ends = ((months + 1).astype("datetime64[D]") - 1).astype("datetime64[ns]")
+    month_ends.setflags(write=False)
+
+    return month_ends
+
+
+class ForecastCalendarUtils:
+
+    @staticmethod
+    def _to_datetime64(dates: pd.Series) -> np.ndarray:
+
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates)
+
+        return dates.to_numpy(dtype="datetime64[ns]")
+
+    @staticmethod
+    def month_start(dates: pd.Series) -> pd.Series:
+        """
+        A function that moves every date in a series to the first day of its month, as one operation on the whole
+        series rather than a Python call for each row.
+        :param dates: The dates, either datetime64 or date objects.
+        :return: The first day of each month as a datetime64 series with the same index.
+        """
+
+        month_starts = ForecastCalendarUtils._to_datetime64(dates).astype("datetime64[M]").astype("datetime64[ns]")
+
+        return pd.Series(month_starts, index=dates.index, name=dates.name)
+
+    @staticmethod
+    def month_end(dates: pd.Series) -> pd.Series:
+        """
+        A function that moves every date in a series to the last day of its month.
+        :param dates: The dates, either datetime64 or date objects.
+        :return: The last day of each month as a datetime64 series with the same index.
+        """
+
+        months = ForecastCalendarUtils._to_datetime64(dates).astype("datetime64[M]")
+        month_ends = ((months + 1).astype("datetime64[D]") - 1).astype("datetime64[ns]")
+
+        return pd.Series(month_ends, index=dates.index, name=dates.name)
+
+    @staticmethod
+    def quarter_start(dates: pd.Series) -> pd.Series:
+        """
+        A function that moves every date in a series to the first day of its calendar quarter.
+        :param dates: The dates, either datetime64 or date objects.
+        :return: The first day of each quarter as a datetime64 series with the same index.
+        """
+
+        months = ForecastCalendarUtils._to_datetime64(dates).astype("datetime64[M]").astype("int64")
+        quarter_starts = (months - months % 3).astype("datetime64[M]").astype("datetime64[ns]")
+
+        return pd.Series(quarter_starts, index=dates.index, name=dates.name)
+
+    @staticmethod
+    def quarter_end(dates: pd.Series) -> pd.Series:
+        """
+        A function that moves every date in a series to the last day of its calendar quarter.
+        :param dates: The dates, either datetime64 or date objects.
+        :return: The last day of each quarter as a datetime64 series with the same index.
+        """
+
+        months = ForecastCalendarUtils._to_datetime64(dates).astype("datetime64[M]").astype("int64")
+        quarter_ends = ((months - months % 3 + 3).astype("datetime64[M]").astype("datetime64[D]") - 1).astype("datetime64[ns]")
+
+        return pd.Series(quarter_ends, index=dates.index, name=dates.name)
+
+    @staticmethod
+    def first_day_of_month(date: datetime.date) -> datetime.date:
+        """
+        A function that gives the first day of the month a date is in, for parameters such as first_forecast_month.
+        :param date: The date.
+        :return: The first day of the month.
+        """
+
+        return date.replace(day=1)
+
+    @staticmethod
+    def last_day_of_month(date: datetime.date) -> datetime.date:
+        """
+        A function that gives the last day of the month a date is in, for parameters such as last_forecast_month.
+        :param date: The date.
+        :return: The last day of the month.
+        """
+
+        next_month = date.replace(day=28) + datetime.timedelta(days=4)
+
+        return next_month - datetime.timedelta(days=next_month.day)
+
+    @staticmethod
+    def month_grid(first_forecast_month: datetime.date, last_forecast_month: datetime.date, column_name: str = "date") -> pd.DataFrame:
+        """
+        A function that gives the months of a forecast as a dataFrame with one row per month, dated on the last day of
+        the month. The dates are worked out once for each forecast horizon and reused by every model that asks for
+        the same months.
+        :param first_forecast_month: A date in the first month of the forecast.
+        :param last_forecast_month: A date in the last month of the forecast.
+        :param column_name: The name of the date column.
+        :return: The forecast months, or an empty dataFrame if the last month is before the first.
+        """
+
+        month_ends = _month_end_dates(np.datetime64(first_forecast_month, "M"), np.datetime64(last_forecast_month, "M"))
+
+        return pd.DataFrame({column_name: month_ends.copy()})
+
+    @staticmethod
+    def month_index(dates: pd.Series, first_forecast_month: datetime.date) -> pd.Series:
+        """
+        A function that numbers each date by its month in the forecast, the first month of the forecast is 1.
+        :param dates: The dates, either datetime64 or date objects.
+        :param first_forecast_month: A date in the first month of the forecast.
+        :return: The month numbers as an int64 series with the same index.
+        """
+
+        months = ForecastCalendarUtils._to_datetime64(dates).astype("datetime64[M]").astype("int64")
+        first_month = np.datetime64(first_forecast_month, "M").astype("int64")
+
+        return pd.Series(months - first_month + 1, index=dates.index)
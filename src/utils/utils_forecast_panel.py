@@ -0,0 +1,117 @@
+# Load a plugin to allow typing
+import typing as tp
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+
+
+class ForecastPanelUtils:
+
+    @staticmethod
+    def iterate_panel(loans: pd.DataFrame, dates: pd.DataFrame, loans_per_chunk: int = 0, months_per_chunk: int = 0) -> tp.Iterator[pd.DataFrame]:
+        """
+        A function that expands a set of loans into a loan x month panel, one chunk at a time. Each chunk is the cross
+        join of a batch of loans with a window of months, so the memory needed depends on the chunk size rather than on
+        the size of the book and the length of the forecast horizon.
+        :param loans: The loans to expand, one row per loan.
+        :param dates: The forecast months, one row per month.
+        :param loans_per_chunk: The number of loans in each chunk, zero or less puts all the loans in one chunk.
+        :param months_per_chunk: The number of months in each chunk, zero or less puts all the months in one chunk.
+        :return: An iterator over the chunks of the panel.
+        """
+
+        if len(loans) == 0 or len(dates) == 0:
+            yield loans.join(dates, how="cross")
+            return
+
+        loans_per_chunk = loans_per_chunk if loans_per_chunk > 0 else len(loans)
+        months_per_chunk = months_per_chunk if months_per_chunk > 0 else len(dates)
+
+        for loan_start in range(0, len(loans), loans_per_chunk):
+
+            loan_batch = loans.iloc[loan_start:loan_start + loans_per_chunk]
+
+            for month_start in range(0, len(dates), months_per_chunk):
+
+                yield loan_batch.join(dates.iloc[month_start:month_start + months_per_chunk], how="cross")
+
+    @staticmethod
+    def build_panel(loans: pd.DataFrame, dates: pd.DataFrame, calculate: tp.Callable[[pd.DataFrame], pd.DataFrame],
+                    loans_per_chunk: int = 0, months_per_chunk: int = 0) -> pd.DataFrame:
+        """
+        A function that runs a calculation over the loan x month panel chunk by chunk and puts the results together.
+        Only the columns the calculation returns are kept for the whole panel, any working columns it creates and drops
+        are only ever the size of a chunk. When the months are split into windows the rows for each batch of loans
+        come out one window at a time, so the row order differs from a single cross join but the rows are the same.
+
+        The result of each chunk is split into its columns as soon as it is worked out, and each column of the panel is
+        put together and its pieces released before the next one, so the memory needed is the panel plus one column
+        and one chunk rather than twice the panel, as joining the chunks in one go would need.
+        :param loans: The loans to expand, one row per loan.
+        :param dates: The forecast months, one row per month.
+        :param calculate: The calculation to run on each chunk, it returns the chunk of the final result.
+        :param loans_per_chunk: The number of loans in each chunk, zero or less puts all the loans in one chunk.
+        :param months_per_chunk: The number of months in each chunk, zero or less puts all the months in one chunk.
+        :return: The combined result for the whole panel.
+        """
+
+        column_pieces: tp.Dict[str, tp.List[pd.Series]] = dict()
+        first_result = None
+
+        for chunk_index, chunk in enumerate(ForecastPanelUtils.iterate_panel(loans, dates, loans_per_chunk, months_per_chunk)):
+
+            result = calculate(chunk)
+
+            if chunk_index == 0:
+                first_result = result
+                continue
+
+            if chunk_index == 1:
+                column_pieces = {column_name: [] for column_name in first_result.columns}
+                ForecastPanelUtils._split_columns(first_result, column_pieces)
+                first_result = None
+
+            if list(result.columns) != list(column_pieces):
+                raise Exception("The calculation returned different columns for different chunks of the panel")
+
+            ForecastPanelUtils._split_columns(result, column_pieces)
+
+        if first_result is not None:
+            return first_result.reset_index(drop=True)
+
+        columns = dict()
+
+        for column_name in list(column_pieces):
+            columns[column_name] = pd.concat(column_pieces.pop(column_name), ignore_index=True)
+
+        # A dictionary of columns is copied by the dataFrame constructor unless it is told not to
+        return pd.DataFrame(columns, copy=False)
+
+    @staticmethod
+    def _split_columns(result: pd.DataFrame, column_pieces: tp.Dict[str, tp.List[pd.Series]]):
+
+        # Each column is copied out of the chunk, so no piece keeps the blocks of the whole chunk alive
+        for column_name in column_pieces:
+            column_pieces[column_name].append(result[column_name].reset_index(drop=True).copy())
+
+    @staticmethod
+    def panel_order(loan_positions: np.ndarray, month_positions: np.ndarray, number_of_loans: int, number_of_months: int,
+                    loans_per_chunk: int = 0, months_per_chunk: int = 0) -> np.ndarray:
+        """
+        A function that works out the order build_panel puts a set of rows in, so rows from different runs can be put
+        together in the order a single run over the whole panel would give.
+        :param loan_positions: The position of each row's loan in the loans given to build_panel.
+        :param month_positions: The position of each row's month in the forecast months.
+        :param number_of_loans: The number of loans given to build_panel.
+        :param number_of_months: The number of forecast months.
+        :param loans_per_chunk: The number of loans in each chunk, as given to build_panel.
+        :param months_per_chunk: The number of months in each chunk, as given to build_panel.
+        :return: The indices that put the rows in panel order.
+        """
+
+        loans_per_chunk = loans_per_chunk if loans_per_chunk > 0 else max(number_of_loans, 1)
+        months_per_chunk = months_per_chunk if months_per_chunk > 0 else max(number_of_months, 1)
+
+        # Chunks of loans, then windows of months, then the cross join of the loans and months in each chunk
+        return np.lexsort((month_positions, loan_positions, month_positions // months_per_chunk, loan_positions // loans_per_chunk))
@@ -0,0 +1,126 @@
+# Load a plugin to allow typing
+import typing as tp
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+
+
+class KeyedLookup:
+
+    def __init__(self, table: pd.DataFrame, key_columns: tp.List[str], period_column: str, value_columns: tp.List[str], ignore_case: bool = False):
+        """
+        An index over a table of rates or costs that are set by key (for example the region) and period (for example
+        the year), built once so that each row of a forecast can look up its values without a merge or a cross join.
+        A lookup uses the latest period on or before the period asked for, so a rate stays in force until the table
+        sets a new one. The table must have at most one row for each key and period.
+        :param table: The table of rates or costs.
+        :param key_columns: The columns holding the keys.
+        :param period_column: The column holding the period, an integer such as a year.
+        :param value_columns: The columns holding the values to look up.
+        :param ignore_case: Whether string keys should match regardless of case.
+        """
+        self.key_columns = key_columns
+        self.period_column = period_column
+        self.value_columns = value_columns
+        self.ignore_case = ignore_case
+
+        keys = self._normalise_keys(table)
+        periods = table[period_column].to_numpy(dtype="int64")
+
+        duplicates = pd.concat([keys, pd.Series(periods, name=period_column, index=keys.index)], axis=1).duplicated(keep=False).to_numpy()
+
+        if duplicates.any():
+            duplicate_rows = table.loc[duplicates, key_columns + [period_column]].drop_duplicates()
+            raise Exception(f"The lookup table has more than one row for the same key and period: {duplicate_rows.to_dict('records')}")
+
+        self._keys = pd.MultiIndex.from_frame(keys).unique()
+        key_codes = self._keys.get_indexer(pd.MultiIndex.from_frame(keys))
+
+        # Each (key, period) pair is encoded as one integer that sorts by key and then by period, with a gap between
+        # keys so that a search can never run on into the next key
+        self._first_period = int(periods.min()) if len(periods) > 0 else 0
+        self._period_count = int(periods.max()) - self._first_period + 1 if len(periods) > 0 else 1
+
+        positions = key_codes * (self._period_count + 1) + (periods - self._first_period)
+        order = np.argsort(positions, kind="stable")
+
+        self._positions = positions[order]
+        self._values = {value_column: table[value_column].to_numpy()[order] for value_column in value_columns}
+
+    def _normalise_keys(self, data: pd.DataFrame) -> pd.DataFrame:
+
+        keys = data[self.key_columns].reset_index(drop=True)
+
+        if self.ignore_case:
+            for key_column in self.key_columns:
+                if isinstance(keys[key_column].dtype, pd.CategoricalDtype):
+                    # Only the categories need to be changed, not every row
+                    keys[key_column] = keys[key_column].map(str.upper)
+                elif pd.api.types.is_object_dtype(keys[key_column]) or pd.api.types.is_string_dtype(keys[key_column]):
+                    keys[key_column] = keys[key_column].astype(str).str.upper()
+
+        return keys
+
+    def lookup(self, data: pd.DataFrame, periods: tp.Union[pd.Series, np.ndarray]) -> pd.DataFrame:
+        """
+        Look up the values for each row of a dataFrame. The work is one hash lookup for the keys and one binary search
+        for the periods over the whole dataFrame, so it grows linearly with the number of rows.
+        :param data: The rows to look up, holding the key columns.
+        :param periods: The period for each row.
+        :return: The values for each row, with the same index as data.
+        """
+        keys = self._normalise_keys(data)
+        periods = np.asarray(periods, dtype="int64")
+
+        key_codes = self._keys.get_indexer(pd.MultiIndex.from_frame(keys)) if len(keys) > 0 else np.zeros(0, dtype="int64")
+
+        # Periods after the last one in the table use the last one, periods before the first one have no value
+        query_periods = np.clip(periods - self._first_period, -1, self._period_count - 1)
+        query_positions = key_codes * (self._period_count + 1) + query_periods
+
+        # The entry just before the insertion point is the latest period on or before the one asked for, as long as
+        # it belongs to the same key
+        matches = np.searchsorted(self._positions, query_positions, side="right") - 1
+
+        found = (key_codes >= 0) & (query_periods >= 0) & (matches >= 0)
+        found[found] = self._positions[matches[found]] // (self._period_count + 1) == key_codes[found]
+
+        if not found.all():
+            missing_rows = keys.loc[~found].assign(**{self.period_column: periods[~found]}).drop_duplicates()
+            raise Exception(f"The lookup table has no value for: {missing_rows.to_dict('records')}")
+
+        return pd.DataFrame({value_column: values[matches] for value_column, values in self._values.items()}, index=data.index)
+
+    @staticmethod
+    def align(table: pd.DataFrame, target: pd.DataFrame, key_columns: tp.List[str], table_name: str, target_name: str) -> pd.DataFrame:
+        """
+        Put the rows of a table in the order of another table set by the same keys, for example two tables of rates
+        by year and region, so that their columns can be combined row by row. Each key must be on one row of each
+        table and the two tables must hold the same keys, otherwise this raises rather than leaving rows unmatched.
+        :param table: The table to reorder.
+        :param target: The table whose row order is followed.
+        :param key_columns: The columns holding the keys, in both tables.
+        :param table_name: The name of the table to reorder, used in errors.
+        :param target_name: The name of the table whose order is followed, used in errors.
+        :return: The rows of table in the order of target, with the same index as target.
+        """
+        # The keys are compared by value, so a categorical column matches a plain one with the same values
+        keys = pd.MultiIndex.from_arrays([np.asarray(table[key_column]) for key_column in key_columns], names=key_columns)
+        target_keys = pd.MultiIndex.from_arrays([np.asarray(target[key_column]) for key_column in key_columns], names=key_columns)
+
+        for name, name_keys in [(table_name, keys), (target_name, target_keys)]:
+            if name_keys.has_duplicates:
+                raise Exception(f"The {name} table has more than one row for the same key: {name_keys[name_keys.duplicated()].unique().tolist()}")
+
+        positions = keys.get_indexer(target_keys)
+        extra_keys = keys[~keys.isin(target_keys)]
+
+        if (positions < 0).any() or len(extra_keys) > 0:
+            raise Exception(f"The {table_name} and {target_name} tables do not have the same {', '.join(key_columns)}, "
+                            f"only in {target_name}: {target_keys[positions < 0].tolist()}, only in {table_name}: {extra_keys.tolist()}")
+
+        aligned = table.iloc[positions]
+        aligned.index = target.index
+
+        return aligned
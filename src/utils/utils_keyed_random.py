@@ -0,0 +1,102 @@
+# Load a plugin to allow typing
+import typing as tp
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+
+"""
+Random numbers that are tied to the rows they are drawn for rather than to the position of the rows in a table. Each
+number is a hash of the seed, the name of the draw and the key of the row, for example the account ID and month, so a
+row gets the same draws whatever other rows are in the table and whatever order they are in. This is what lets a
+forecast be worked out again for some of the accounts in a book and give the same rows as a run over the whole book.
+
+The hash is the SplitMix64 finaliser, applied once for each key column. Draws with different names are independent of
+each other.
+"""
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_MULTIPLIER_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_MULTIPLIER_2 = np.uint64(0x94D049BB133111EB)
+
+
+class KeyedRandomUtils:
+
+    @staticmethod
+    def mix(values: np.ndarray) -> np.ndarray:
+        """
+        A function that scrambles 64-bit integers with the SplitMix64 finaliser, the arithmetic wraps around.
+        :param values: An array of uint64.
+        :return: The scrambled values.
+        """
+
+        values = values + _GOLDEN_GAMMA
+        values = (values ^ (values >> np.uint64(30))) * _MIX_MULTIPLIER_1
+        values = (values ^ (values >> np.uint64(27))) * _MIX_MULTIPLIER_2
+
+        return values ^ (values >> np.uint64(31))
+
+    @staticmethod
+    def hash_column(column: pd.Series) -> np.ndarray:
+        """
+        A function that turns a column of keys into 64-bit hashes. Each distinct value is hashed once, so a column of
+        account IDs repeated for every month costs one hash per account.
+        :param column: The keys, of any type pandas can hash.
+        :return: An array of uint64, one for each row.
+        """
+
+        codes, uniques = pd.factorize(column)
+
+        return pd.util.hash_pandas_object(pd.Series(uniques), index=False).to_numpy()[codes]
+
+    @staticmethod
+    def row_keys(seed: int, draw_name: str, key_columns: tp.List[pd.Series]) -> np.ndarray:
+        """
+        A function that combines the seed, the name of a draw and the key columns into one hash for each row.
+        :param seed: The random number seed.
+        :param draw_name: The name of the draw, draws with different names are independent.
+        :param key_columns: The columns that identify each row.
+        :return: An array of uint64, one for each row.
+        """
+
+        draw_hash = pd.util.hash_array(np.array([f"{seed}/{draw_name}"], dtype=object))[0]
+
+        row_keys = np.full(len(key_columns[0]), draw_hash, dtype=np.uint64)
+
+        for key_column in key_columns:
+            row_keys = KeyedRandomUtils.mix(row_keys ^ KeyedRandomUtils.hash_column(key_column))
+
+        return row_keys
+
+    @staticmethod
+    def uniform(seed: int, draw_name: str, key_columns: tp.List[pd.Series]) -> np.ndarray:
+        """
+        A function that draws a number for each row from the uniform distribution on (0, 1), neither end is included.
+        :param seed: The random number seed.
+        :param draw_name: The name of the draw.
+        :param key_columns: The columns that identify each row.
+        :return: An array of float64, one for each row.
+        """
+
+        # The top 53 bits fill the mantissa of a double, the half moves the numbers off zero
+        row_keys = KeyedRandomUtils.row_keys(seed, draw_name, key_columns)
+
+        return ((row_keys >> np.uint64(11)).astype(np.float64) + 0.5) * 2.0 ** -53
+
+    @staticmethod
+    def normal(seed: int, draw_name: str, key_columns: tp.List[pd.Series], mean: float = 0.0, standard_deviation: float = 1.0) -> np.ndarray:
+        """
+        A function that draws a number for each row from a normal distribution, using the Box-Muller transform of two
+        uniform draws.
+        :param seed: The random number seed.
+        :param draw_name: The name of the draw.
+        :param key_columns: The columns that identify each row.
+        :param mean: The mean of the distribution.
+        :param standard_deviation: The standard deviation of the distribution.
+        :return: An array of float64, one for each row.
+        """
+
+        radius = np.sqrt(-2.0 * np.log(KeyedRandomUtils.uniform(seed, f"{draw_name}/radius", key_columns)))
+        angle = 2.0 * np.pi * KeyedRandomUtils.uniform(seed, f"{draw_name}/angle", key_columns)
+
+        return mean + standard_deviation * radius * np.cos(angle)
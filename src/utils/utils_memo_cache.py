@@ -0,0 +1,254 @@
+# Load a plugin to allow typing
+import typing as tp
+import datetime
+import hashlib
+import marshal
+import os
+import pathlib
+import sys
+import types
+
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Import the TRAC runtime library
+import tracdap.rt as trac_rt
+
+# Load a set of utils for converting Arrow tables
+from utils.utils_compact_table import CompactTableUtils
+
+"""
+A cache for the tables that a model works out from inputs which rarely change, for example the operating expenses from
+the four cost tables or the balance at the start of the forecast from the t0 book. The cache is keyed on a fingerprint
+of the function and everything passed to it, so a result is only reused when the function and its inputs are exactly the
+same. The fingerprint also covers the code version, a hash of every source file in the model code and the versions of
+Python and the libraries, so changing a function the cached function calls, a constant it reads or a library version
+never gives back a result worked out by the old code. Results are kept as Arrow IPC files in a folder, so they are
+reused by later runs, and the least recently used files are removed when the folder grows past a size limit.
+"""
+
+# Set this environment variable to a folder to turn the cache on, by default every call is worked out in full
+MEMO_CACHE_DIR_VARIABLE = "MODEL_MEMO_CACHE_DIR"
+
+# Set this environment variable to change the size limit of the cache folder, in bytes
+MEMO_CACHE_MAX_BYTES_VARIABLE = "MODEL_MEMO_CACHE_MAX_BYTES"
+
+DEFAULT_MEMO_CACHE_MAX_BYTES = 1024 ** 3
+
+# The folder holding the model code, every source file in it is part of the code version
+MEMO_CACHE_SOURCE_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+class MemoCache:
+
+    _cache_dir: tp.Optional[pathlib.Path] = pathlib.Path(os.environ[MEMO_CACHE_DIR_VARIABLE]) if os.environ.get(MEMO_CACHE_DIR_VARIABLE) else None
+
+    _max_bytes: int = int(os.environ.get(MEMO_CACHE_MAX_BYTES_VARIABLE, DEFAULT_MEMO_CACHE_MAX_BYTES))
+
+    _code_version: tp.Optional[str] = None
+
+    _hits = 0
+    _misses = 0
+
+    @classmethod
+    def set_cache_dir(cls, cache_dir: tp.Optional[tp.Union[str, pathlib.Path]], max_bytes: tp.Optional[int] = None):
+        """
+        Set the folder holding the cached tables, None turns the cache off.
+        :param cache_dir: The cache folder.
+        :param max_bytes: The size limit of the cache folder, by default the limit is left as it is.
+        """
+        cls._cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+
+        if max_bytes is not None:
+            cls._max_bytes = max_bytes
+
+    @classmethod
+    def statistics(cls) -> tp.Dict[str, int]:
+        """
+        The number of calls served from the cache and the number that had to be worked out, along with the number
+        and total size of the cached tables.
+        """
+        cache_files = cls._cache_files()
+
+        return {"hits": cls._hits, "misses": cls._misses, "tables": len(cache_files),
+                "bytes": sum(cache_file.stat().st_size for cache_file in cache_files)}
+
+    @classmethod
+    def clear(cls):
+        """
+        Remove every cached table and reset the hit and miss counts.
+        """
+        for cache_file in cls._cache_files():
+            cache_file.unlink(missing_ok=True)
+
+        cls._hits = 0
+        cls._misses = 0
+
+    @classmethod
+    def _cache_files(cls) -> tp.List[pathlib.Path]:
+
+        if cls._cache_dir is None or not cls._cache_dir.is_dir():
+            return []
+
+        return list(cls._cache_dir.glob("*.arrow"))
+
+    @classmethod
+    def code_version(cls) -> str:
+        """
+        A hash of every Python source file in the model code and of the versions of Python, numpy, pandas, pyarrow
+        and the TRAC runtime. It is worked out once for each process, the source files do not change during a run.
+        """
+        if cls._code_version is None:
+
+            fingerprint = hashlib.sha256()
+
+            library_versions = [sys.version, np.__version__, pd.__version__, pa.__version__, trac_rt.__version__]
+            fingerprint.update(repr(library_versions).encode())
+
+            for source_file in sorted(MEMO_CACHE_SOURCE_ROOT.rglob("*.py")):
+                fingerprint.update(f"{source_file.relative_to(MEMO_CACHE_SOURCE_ROOT).as_posix()}\0".encode())
+                with pa.OSFile(str(source_file), "rb") as source:
+                    fingerprint.update(source.read())
+
+            cls._code_version = fingerprint.hexdigest()
+
+        return cls._code_version
+
+    @staticmethod
+    def _fingerprint_value(value: tp.Any, fingerprint: "hashlib._Hash"):
+
+        if isinstance(value, pd.DataFrame):
+            fingerprint.update(b"DataFrame\0")
+            fingerprint.update(repr([(str(column), str(dtype)) for column, dtype in value.dtypes.items()]).encode())
+            fingerprint.update(repr(len(value)).encode())
+            # The index is part of the fingerprint because it is kept in the cached result
+            fingerprint.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+
+        elif isinstance(value, pd.Series):
+            fingerprint.update(b"Series\0")
+            fingerprint.update(f"{value.name}|{value.dtype}".encode())
+            fingerprint.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+
+        elif isinstance(value, (list, tuple)):
+            fingerprint.update(f"{type(value).__name__}[{len(value)}]\0".encode())
+            for item in value:
+                MemoCache._fingerprint_value(item, fingerprint)
+
+        elif value is None or isinstance(value, (str, bytes, bool, int, float, datetime.date)):
+            fingerprint.update(f"{type(value).__name__}:{value!r}\0".encode())
+
+        elif isinstance(value, np.generic):
+            # Numpy scalars keep their type, a float32 and a float64 of the same value can give different results
+            fingerprint.update(f"{type(value).__name__}:{value.item()!r}\0".encode())
+
+        else:
+            raise Exception(f"Values of type '{type(value).__name__}' can not be used in a cache fingerprint")
+
+    @staticmethod
+    def _strip_file_names(code: types.CodeType) -> types.CodeType:
+
+        # The module name and the file name of a function depend on how it was loaded, for example a model file run as
+        # a script is '__main__' with a relative path, so only the code itself goes into the fingerprint
+        constants = tuple(MemoCache._strip_file_names(constant) if isinstance(constant, types.CodeType) else constant for constant in code.co_consts)
+
+        return code.replace(co_filename="", co_consts=constants)
+
+    @staticmethod
+    def fingerprint(function: tp.Callable[..., pd.DataFrame], *args, **kwargs) -> str:
+        """
+        A fingerprint of a call, made from the code version, the compiled code of the function and the contents of
+        every argument. Changing any of the model code, a library version, or any of the inputs or parameters gives a
+        different fingerprint.
+        :param function: The function being called.
+        :param args: The positional arguments, dataFrames, series or simple values, including numpy scalars.
+        :param kwargs: The keyword arguments, dataFrames, series or simple values, including numpy scalars.
+        :return: The fingerprint as a hex string.
+        """
+        fingerprint = hashlib.sha256()
+
+        fingerprint.update(f"{MemoCache.code_version()}\0".encode())
+        fingerprint.update(f"{function.__qualname__}\0".encode())
+        fingerprint.update(marshal.dumps(MemoCache._strip_file_names(function.__code__)))
+
+        MemoCache._fingerprint_value(list(args), fingerprint)
+
+        for name in sorted(kwargs):
+            fingerprint.update(f"{name}=".encode())
+            MemoCache._fingerprint_value(kwargs[name], fingerprint)
+
+        return fingerprint.hexdigest()
+
+    @classmethod
+    def call(cls, function: tp.Callable[..., pd.DataFrame], *args, **kwargs) -> pd.DataFrame:
+        """
+        Call a function that returns a dataFrame, reusing the cached result when the same function has already been
+        called with the same inputs. When the cache is turned off the function is always called.
+        :param function: A function that depends only on its arguments and returns a dataFrame.
+        :param args: The positional arguments for the function.
+        :param kwargs: The keyword arguments for the function.
+        :return: The result of the function. When the cache is on the result is converted with
+        CompactTableUtils.arrow_to_pandas, so it has the same column types whether it was worked out or read back.
+        """
+        if cls._cache_dir is None:
+            return function(*args, **kwargs)
+
+        cache_file = cls._cache_dir / f"{cls.fingerprint(function, *args, **kwargs)}.arrow"
+
+        # File IO goes through pyarrow, the TRAC guard rails do not allow model code to call open() directly
+        if cache_file.exists():
+            cls._hits += 1
+
+            with pa.memory_map(str(cache_file), "r") as cache_source:
+                result = CompactTableUtils.arrow_to_pandas(pa.ipc.open_file(cache_source).read_all())
+
+            # Mark the file as recently used, the least recently used files are the first to go
+            os.utime(cache_file)
+
+            return result
+
+        cls._misses += 1
+
+        result = function(*args, **kwargs)
+
+        cls._cache_dir.mkdir(parents=True, exist_ok=True)
+
+        table = pa.Table.from_pandas(result)
+
+        # Write to a temporary file first so other processes never read a partly written file
+        temporary_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with pa.OSFile(str(temporary_file), "wb") as cache_sink:
+            with pa.ipc.new_file(cache_sink, table.schema) as writer:
+                writer.write_table(table)
+        temporary_file.replace(cache_file)
+
+        cls._evict()
+
+        # Hand back the table as it is read from the cache, so a call gives the same column types on a hit or a miss
+        return CompactTableUtils.arrow_to_pandas(table)
+
+    @classmethod
+    def _evict(cls):
+        """
+        Remove the least recently used tables until the cache folder is within its size limit.
+        """
+        cache_files = []
+
+        for cache_file in cls._cache_files():
+            try:
+                cache_stat = cache_file.stat()
+                cache_files.append((cache_stat.st_mtime, cache_stat.st_size, cache_file))
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+
+        total_bytes = sum(size for _, size, _ in cache_files)
+
+        for _, size, cache_file in sorted(cache_files, key=lambda entry: entry[0]):
+
+            if total_bytes <= cls._max_bytes:
+                break
+
+            cache_file.unlink(missing_ok=True)
+            total_bytes -= size
@@ -0,0 +1,568 @@
+# Load a plugin to allow typing
+import typing as tp
+import dataclasses
+import json
+import logging
+import pathlib
+import posixpath
+import time
+
+# Load the python libraries
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import yaml
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+import tracdap.rt.config as trac_config
+import tracdap.rt.ext.plugins as trac_plugins
+
+# Load the TRAC runtime internals that the engine uses to run a model node. Using the same classes means parameters,
+# schema conformance and storage formats behave exactly as they do in a job started with launch.launch_model()
+import tracdap.rt._exec.context as _trac_context  # noqa
+import tracdap.rt._exec.dev_mode as _trac_dev_mode  # noqa
+import tracdap.rt._impl.config_parser as _trac_config_parser  # noqa
+import tracdap.rt._impl.data as _trac_data  # noqa
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+import tracdap.rt._impl.storage as _trac_storage  # noqa
+import tracdap.rt._impl.type_system as _trac_types  # noqa
+import tracdap.rt._impl.util as _trac_util  # noqa
+
+# Load the TRAC helpers
+from utils.utils_columnar_storage import ColumnarStorageUtils
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_stage_metrics import StageMetrics, STAGE_METRICS_SUFFIX
+
+"""
+A runner that executes a chain of TRAC models in a single process. Each model's outputs are held as Arrow tables and
+handed straight to the models that read them, so intermediate datasets are never written to storage and parsed back in.
+
+Inputs held as Parquet or Arrow IPC files are read with only the columns in the model's input schema. A model can also
+declare row filters on its inputs with a define_input_filters(parameters) method, returning a dictionary of pyarrow
+compute expressions keyed by input name. These are pushed down into the read, so Parquet row groups with no matching
+rows are skipped. A model must still apply the same filter itself, the pipeline only pushes a filter down when no other
+model reads the same input, and the TRAC runtime does not use them at all.
+
+In the same way a model can declare the columns it reads from each input with a define_input_columns() method,
+returning a list of column names keyed by input name. Only the columns some model reads are read from storage, and
+each model is handed just its own columns, selected from the Arrow table without a copy, with its input schema cut
+down to match. An input none of whose columns are read is not loaded at all. A model passes its declared columns to
+CompactTableUtils.get_compact_table as well, which drops the other columns when the model runs in the TRAC runtime.
+src/benchmarks/check_dead_columns.py finds the columns each model does not use.
+
+Arrow IPC inputs in a LOCAL storage bucket are memory-mapped, and models get their inputs as dataFrames built over the
+Arrow buffers rather than copies of them. Jobs running at the same time on the same file then share one copy of it
+through the page cache. The file must be uncompressed and written as a single record batch for every column to be
+shared, ColumnarStorageUtils.write_table does this when rows_per_group is 0.
+
+When stage metrics are turned on (see utils_stage_metrics.py) and no folder is set for them, the metrics of each model
+are saved as <node name>_stage_metrics.json in the folder of the first output the pipeline saves for it.
+"""
+
+
+class _PipelineTracContext(_trac_context.TracContextImpl):
+
+    def __init__(self, model_def: trac.ModelDefinition, model_class: tp.Type[trac.TracModel],
+                 local_ctx: tp.Dict[str, tp.Any], schemas: tp.Dict[str, trac.SchemaDefinition]):
+        """
+        The TRAC context for a model run in a pipeline. It behaves in the same way as the runtime's own context,
+        except that get_pandas_table builds each input with CompactTableUtils.arrow_to_pandas, so the columns are
+        views over the Arrow data where that is possible and strings are Arrow strings.
+        """
+
+        super().__init__(model_def, model_class, local_ctx, schemas)
+
+        self.__model_def = model_def
+        self.__local_ctx = local_ctx
+        self.__schemas = schemas
+
+    def get_pandas_table(self, dataset_name: str, use_temporal_objects: tp.Optional[bool] = None) -> pd.DataFrame:
+
+        data_view = self.__local_ctx.get(dataset_name)
+
+        # Anything else, including a dataset that does not exist, is left to the runtime so errors are reported as usual
+        if use_temporal_objects or dataset_name not in self.__model_def.inputs or not isinstance(data_view, _trac_data.DataView) or not data_view.parts:
+            return super().get_pandas_table(dataset_name, use_temporal_objects)
+
+        arrow_schema = _trac_data.DataMapping.trac_to_arrow_schema(self.__schemas[dataset_name])
+        table = _trac_data.DataMapping.view_to_arrow(data_view, _trac_data.DataPartKey.for_root())
+
+        return CompactTableUtils.arrow_to_pandas(_trac_data.DataConformance.conform_to_schema(table, arrow_schema, warn_extra_columns=False))
+
+
+class ModelPipeline:
+
+    def __init__(self, models: tp.Dict[str, tp.Type[trac.TracModel]], sys_config: tp.Union[str, pathlib.Path],
+                 prune_columns: bool = True):
+        """
+        Set up a pipeline for a set of models, the order the models run in is worked out from their declared inputs
+        and outputs.
+        :param models: A dictionary of model classes keyed by node name.
+        :param sys_config: The path to the TRAC system config, this defines the storage used for inputs and outputs.
+        :param prune_columns: Whether to hand models only the input columns they declare, turning this off gives every
+        model every column in its input schemas.
+        """
+
+        self._log = logging.getLogger(self.__class__.__name__)
+
+        # Plugins and the static API are singletons, calling these more than once is fine
+        trac_plugins.PluginManager.register_core_plugins()
+        _trac_static_api.StaticApiImpl.register_impl()
+
+        self._sys_config = ModelPipeline._load_sys_config(pathlib.Path(sys_config))
+        self._storage = _trac_storage.StorageManager(self._sys_config)
+
+        self._models = models
+        self._model_defs = {node_name: ModelPipeline._scan_model(model_class) for node_name, model_class in models.items()}
+        self._input_columns = {node_name: self.declared_input_columns(node_name) if prune_columns else dict() for node_name in models}
+        self._dependencies = self._find_dependencies()
+        self._node_order = self._sort_nodes()
+
+    @staticmethod
+    def _load_sys_config(sys_config_path: pathlib.Path) -> trac_config.RuntimeConfig:
+
+        sys_config_parser = _trac_config_parser.ConfigParser(trac_config.RuntimeConfig)
+        sys_config_raw = sys_config_parser.load_raw_config(sys_config_path, config_file_name="system")
+        sys_config = sys_config_parser.parse(sys_config_raw, sys_config_path)
+
+        # Resolve relative storage paths in the same way as launch.launch_model()
+        return _trac_dev_mode.DevModeTranslator.translate_sys_config(sys_config, sys_config_path.parent)
+
+    @staticmethod
+    def _scan_model(model_class: tp.Type[trac.TracModel]) -> trac.ModelDefinition:
+
+        model = model_class()
+
+        return trac.ModelDefinition(
+            language="python", repository="trac_integrated",
+            entryPoint=f"{model_class.__module__}.{model_class.__name__}",
+            parameters=model.define_parameters(),
+            inputs=model.define_inputs(),
+            outputs=model.define_outputs())
+
+    def declared_input_columns(self, node_name: str) -> tp.Dict[str, tp.List[str]]:
+        """
+        The columns a model declares it reads, keyed by input name, inputs it does not declare columns for are left out.
+        """
+
+        model = self._models[node_name]()
+        model_def = self._model_defs[node_name]
+
+        if not hasattr(model, "define_input_columns"):
+            return dict()
+
+        input_columns = model.define_input_columns()
+
+        for input_name, columns in input_columns.items():
+
+            if input_name not in model_def.inputs:
+                raise Exception(f"Model [{node_name}] declares columns for '{input_name}', which is not one of its inputs")
+
+            schema_columns = [field.fieldName for field in model_def.inputs[input_name].schema.table.fields]
+            unknown_columns = [column_name for column_name in columns if column_name not in schema_columns]
+
+            if unknown_columns:
+                raise Exception(f"Model [{node_name}] declares columns for '{input_name}' that are not in its schema: {', '.join(unknown_columns)}")
+
+        return input_columns
+
+    def _read_columns(self, input_name: str) -> tp.Optional[tp.List[str]]:
+        """
+        The columns of an input that some model reads, or None when a model reading it does not declare its columns.
+        """
+
+        read_columns = set()
+
+        for node_name, model_def in self._model_defs.items():
+            if input_name in model_def.inputs:
+                if input_name not in self._input_columns[node_name]:
+                    return None
+                read_columns.update(self._input_columns[node_name][input_name])
+
+        return list(read_columns)
+
+    @staticmethod
+    def _project_schema(schema: trac.SchemaDefinition, columns: tp.Optional[tp.List[str]]) -> trac.SchemaDefinition:
+
+        if columns is None:
+            return schema
+
+        # The fields keep the order they have in the schema
+        fields = [field for field in schema.table.fields if field.fieldName in columns]
+
+        return dataclasses.replace(schema, table=dataclasses.replace(schema.table, fields=fields))
+
+    def _find_dependencies(self) -> tp.Dict[str, tp.Set[str]]:
+        """
+        Work out which nodes produce the inputs of each node.
+        """
+
+        producers = dict()
+
+        for node_name, model_def in self._model_defs.items():
+            for output_name in model_def.outputs:
+                if output_name in producers:
+                    raise Exception(f"Dataset '{output_name}' is an output of both '{producers[output_name]}' and '{node_name}'")
+                producers[output_name] = node_name
+
+        return {
+            node_name: {producers[input_name] for input_name in model_def.inputs if input_name in producers}
+            for node_name, model_def in self._model_defs.items()
+        }
+
+    def _sort_nodes(self) -> tp.List[str]:
+        """
+        Order the nodes so that every model runs after the models producing its inputs. Nodes with no dependency
+        between them keep the order they were supplied in.
+        """
+
+        dependencies = self._dependencies
+
+        node_order = []
+
+        while len(node_order) < len(dependencies):
+
+            ready = [node_name for node_name, depends_on in dependencies.items() if node_name not in node_order and depends_on.issubset(node_order)]
+
+            if not ready:
+                raise Exception(f"The models {', '.join(sorted(set(dependencies) - set(node_order)))} have a circular dependency")
+
+            node_order.extend(ready)
+
+        return node_order
+
+    @property
+    def node_order(self) -> tp.List[str]:
+        return list(self._node_order)
+
+    def node_dependencies(self, node_name: str) -> tp.List[str]:
+        """
+        The nodes producing the inputs of a node, in the order the nodes run in.
+        """
+
+        return [upstream_node for upstream_node in self._node_order if upstream_node in self._dependencies[node_name]]
+
+    def node_inputs(self, node_name: str) -> tp.List[str]:
+        return list(self._model_defs[node_name].inputs)
+
+    def node_outputs(self, node_name: str) -> tp.List[str]:
+        return list(self._model_defs[node_name].outputs)
+
+    def required_inputs(self) -> tp.List[str]:
+        """
+        The datasets that are read by a model in the pipeline but not produced by any of them, these need to be
+        supplied when the pipeline is run.
+        """
+
+        produced = {output_name for model_def in self._model_defs.values() for output_name in model_def.outputs}
+
+        required = []
+        for model_def in self._model_defs.values():
+            for input_name in model_def.inputs:
+                if input_name not in produced and input_name not in required:
+                    required.append(input_name)
+
+        return required
+
+    def final_outputs(self) -> tp.List[str]:
+        """
+        The datasets that are produced by a model in the pipeline and not read by any other model.
+        """
+
+        consumed = {input_name for model_def in self._model_defs.values() for input_name in model_def.inputs}
+
+        return [output_name for node_name in self._node_order for output_name in self._model_defs[node_name].outputs if output_name not in consumed]
+
+    def dataset_schema(self, dataset_name: str) -> trac.SchemaDefinition:
+        """
+        The schema of a dataset read or produced by a model in the pipeline.
+        """
+
+        for model_def in self._model_defs.values():
+            if dataset_name in model_def.outputs:
+                return model_def.outputs[dataset_name].schema
+            if dataset_name in model_def.inputs:
+                return model_def.inputs[dataset_name].schema
+
+        raise Exception(f"No model in the pipeline reads or produces the dataset '{dataset_name}'")
+
+    def parameter_values(self, node_name: str, node_parameters: tp.Dict[str, tp.Any]) -> tp.Dict[str, tp.Any]:
+        """
+        The parameters a model in the pipeline runs with, as Python values, with the defaults filled in.
+        """
+
+        return {param_name: _trac_types.MetadataCodec.decode_value(value)
+                for param_name, value in self._resolve_parameters(node_name, node_parameters).items()}
+
+    def load_dataset(self, dataset_name: str, storage_path: str, schema: tp.Optional[trac.SchemaDefinition] = None) -> pa.Table:
+        """
+        Load a dataset from storage in the same way as a pipeline input, by default with the schema the models in
+        the pipeline use for it.
+        """
+
+        return self._load_input(dataset_name, storage_path, schema or self.dataset_schema(dataset_name))
+
+    def save_dataset(self, dataset_name: str, table: pa.Table, storage_path: str):
+        """
+        Save a dataset to storage in the same way as a pipeline output.
+        """
+
+        self._save_output(dataset_name, table, storage_path)
+
+    def run(self, parameters: tp.Dict[str, tp.Dict[str, tp.Any]], inputs: tp.Dict[str, tp.Union[str, pd.DataFrame, pa.Table]],
+            outputs: tp.Optional[tp.Dict[str, str]] = None, keep: tp.Optional[tp.List[str]] = None) -> tp.Dict[str, pa.Table]:
+        """
+        Run every model in the pipeline in dependency order.
+        :param parameters: A dictionary keyed by node name of the parameters for each model, parameters not set here
+        use the default value declared by the model.
+        :param inputs: The external inputs to the pipeline, either as a storage path or as an in-memory table.
+        :param outputs: Storage paths to save datasets to, any dataset in the pipeline (including intermediate
+        datasets) can be saved.
+        :param keep: Intermediate datasets to hand back without saving them.
+        :return: The final outputs of the pipeline, plus any other datasets that were saved or kept, as Arrow tables.
+        """
+
+        outputs = outputs or dict()
+
+        missing_inputs = [input_name for input_name in self.required_inputs() if input_name not in inputs]
+        if missing_inputs:
+            raise Exception(f"The pipeline needs these inputs to be supplied: {', '.join(missing_inputs)}")
+
+        # Count how many models still need each dataset, so datasets can be released as soon as they are used up
+        pending_reads = dict()
+        for model_def in self._model_defs.values():
+            for input_name in model_def.inputs:
+                pending_reads[input_name] = pending_reads.get(input_name, 0) + 1
+
+        readers = dict(pending_reads)
+
+        keep = set(self.final_outputs()) | set(outputs) | set(keep or [])
+
+        datasets: tp.Dict[str, pa.Table] = dict()
+
+        for node_name in self._node_order:
+
+            model_def = self._model_defs[node_name]
+
+            node_parameters = self._resolve_parameters(node_name, parameters.get(node_name) or dict())
+            input_filters = self._input_filters(node_name, node_parameters)
+
+            for input_name, input_schema in model_def.inputs.items():
+                if input_name not in datasets:
+                    # A filter for one model would drop rows another model needs, so it is only used by a single reader
+                    row_filter = input_filters.get(input_name) if readers[input_name] == 1 else None
+                    read_schema = ModelPipeline._project_schema(input_schema.schema, self._read_columns(input_name))
+                    datasets[input_name] = self._load_input(input_name, inputs[input_name], read_schema, row_filter)
+
+            start_time = time.perf_counter()
+
+            StageMetrics.last_report = None
+
+            node_outputs = self._run_node(node_name, node_parameters, datasets)
+
+            self._log.info(f"Model [{node_name}] ran in {time.perf_counter() - start_time:.3f}s")
+
+            datasets.update(node_outputs)
+
+            for output_name, table in node_outputs.items():
+                if output_name in outputs:
+                    self._save_output(output_name, table, outputs[output_name])
+
+            saved_outputs = [outputs[output_name] for output_name in node_outputs if output_name in outputs]
+
+            if StageMetrics.last_report is not None and StageMetrics.output_folder() is None and saved_outputs:
+                self._save_stage_metrics(node_name, StageMetrics.last_report, saved_outputs[0])
+
+            for input_name in model_def.inputs:
+                pending_reads[input_name] -= 1
+                if pending_reads[input_name] == 0 and input_name not in keep:
+                    del datasets[input_name]
+
+        return {dataset_name: table for dataset_name, table in datasets.items() if dataset_name in keep}
+
+    def _resolve_parameters(self, node_name: str, node_parameters: tp.Dict[str, tp.Any]) -> tp.Dict[str, trac.Value]:
+
+        model_def = self._model_defs[node_name]
+
+        unknown_parameters = [param_name for param_name in node_parameters if param_name not in model_def.parameters]
+        if unknown_parameters:
+            raise Exception(f"Model [{node_name}] does not have these parameters: {', '.join(unknown_parameters)}")
+
+        parameter_values = dict()
+
+        for param_name, param in model_def.parameters.items():
+            if node_parameters.get(param_name) is not None:
+                parameter_values[param_name] = _trac_types.MetadataCodec.convert_value(node_parameters[param_name], param.paramType)
+            elif param.defaultValue is not None:
+                parameter_values[param_name] = param.defaultValue
+            else:
+                raise Exception(f"Model [{node_name}] needs a value for parameter '{param_name}'")
+
+        return parameter_values
+
+    def _input_filters(self, node_name: str, parameter_values: tp.Dict[str, trac.Value]) -> tp.Dict[str, pc.Expression]:
+
+        model = self._models[node_name]()
+
+        if not hasattr(model, "define_input_filters"):
+            return dict()
+
+        return model.define_input_filters({param_name: _trac_types.MetadataCodec.decode_value(value) for param_name, value in parameter_values.items()})
+
+    def _run_node(self, node_name: str, parameter_values: tp.Dict[str, trac.Value], datasets: tp.Dict[str, pa.Table]) -> tp.Dict[str, pa.Table]:
+
+        model_class = self._models[node_name]
+        model_def = self._model_defs[node_name]
+
+        local_ctx = dict(parameter_values)
+        static_schemas = dict()
+
+        root_part = _trac_data.DataPartKey.for_root()
+
+        for input_name, input_schema in model_def.inputs.items():
+
+            # A model that declares its columns only sees those columns, selecting them from the table is not a copy
+            columns = self._input_columns[node_name].get(input_name)
+            schema = ModelPipeline._project_schema(input_schema.schema, columns)
+            table = datasets[input_name].select(columns) if columns is not None else datasets[input_name]
+
+            empty_view = _trac_data.DataView.for_trac_schema(schema)
+            local_ctx[input_name] = _trac_data.DataMapping.add_item_to_view(empty_view, root_part, _trac_data.DataItem(table.schema, table))
+            static_schemas[input_name] = schema
+
+        for output_name, output_schema in model_def.outputs.items():
+            local_ctx[output_name] = _trac_data.DataView.for_trac_schema(output_schema.schema)
+            static_schemas[output_name] = output_schema.schema
+
+        trac_ctx = _PipelineTracContext(model_def, model_class, local_ctx, static_schemas)
+
+        model_class().run_model(trac_ctx)
+
+        node_outputs = dict()
+
+        for output_name in model_def.outputs:
+
+            if not local_ctx[output_name].parts:
+                raise Exception(f"Model [{node_name}] did not produce its output '{output_name}'")
+
+            node_outputs[output_name] = _trac_data.DataMapping.view_to_arrow(local_ctx[output_name], root_part)
+
+        return node_outputs
+
+    def _load_input(self, input_name: str, source: tp.Union[str, pd.DataFrame, pa.Table], schema: trac.SchemaDefinition,
+                    row_filter: tp.Optional[pc.Expression] = None) -> pa.Table:
+
+        if isinstance(source, pa.Table):
+            return source
+
+        if isinstance(source, pd.DataFrame):
+            return _trac_data.DataMapping.pandas_to_arrow(source)
+
+        if not schema.table.fields:
+            self._log.info(f"Skipping input [{input_name}], none of its columns are read")
+            return pa.table({})
+
+        self._log.info(f"Loading input [{input_name}] from [{source}]")
+
+        storage_key = self._storage.default_storage_key()
+        storage_format = self._infer_format(source)
+        arrow_schema = _trac_data.DataMapping.trac_to_arrow_schema(schema)
+
+        if ColumnarStorageUtils.is_columnar_format(storage_format):
+
+            local_path = self._local_path(storage_key, source)
+
+            # Only the columns in the schema and the rows that pass the filter are read from the file, a local file is
+            # memory-mapped so an Arrow file is not copied at all
+            if local_path is not None:
+                table = ColumnarStorageUtils.read_table(str(local_path), storage_format, arrow_schema.names, row_filter, memory_map=True)
+            else:
+                with self._storage.get_file_storage(storage_key).read_byte_stream(source) as byte_stream:
+                    table = ColumnarStorageUtils.read_table(byte_stream, storage_format, arrow_schema.names, row_filter)
+
+            return _trac_data.DataConformance.conform_to_schema(table, arrow_schema, warn_extra_columns=False)
+
+        # Match the options launch.launch_model() uses for inputs given as a file path
+        storage_options = {"lenient_csv_parser": True} if storage_format == "CSV" else None
+
+        return self._storage.get_data_storage(storage_key).read_table(source, storage_format, arrow_schema, storage_options)
+
+    def _local_path(self, storage_key: str, storage_path: str) -> tp.Optional[pathlib.Path]:
+
+        bucket_config = self._sys_config.storage.buckets.get(storage_key)
+
+        if bucket_config is None or bucket_config.protocol.upper() != "LOCAL":
+            return None
+
+        # The root path has already been made absolute when the system config was loaded
+        return pathlib.Path(bucket_config.properties["rootPath"]) / storage_path
+
+    def _save_output(self, output_name: str, table: pa.Table, storage_path: str):
+
+        self._log.info(f"Saving output [{output_name}] to [{storage_path}]")
+
+        storage_key = self._storage.default_storage_key()
+        storage_format = self._infer_format(storage_path)
+
+        self._storage.get_data_storage(storage_key).write_table(storage_path, storage_format, table, overwrite=True)
+
+    def save_report(self, report: tp.Dict[str, tp.Any], storage_path: str):
+        """
+        Save a report as JSON in the default storage.
+        """
+
+        storage_key = self._storage.default_storage_key()
+
+        self._storage.get_file_storage(storage_key).write_bytes(storage_path, json.dumps(report, indent=2).encode(), overwrite=True)
+
+    def _save_stage_metrics(self, node_name: str, report: tp.Dict[str, tp.Any], output_path: str):
+
+        storage_path = posixpath.join(posixpath.dirname(output_path), f"{node_name}{STAGE_METRICS_SUFFIX}")
+
+        self._log.info(f"Saving stage metrics for [{node_name}] to [{storage_path}]")
+
+        self.save_report(report, storage_path)
+
+    def _infer_format(self, storage_path: str) -> str:
+
+        # The file extension decides the format, paths without one use the default format from the system config
+        return _trac_dev_mode.DevModeTranslator.infer_format(storage_path, self._sys_config.storage)
+
+
+def run_pipeline_config(models: tp.Dict[str, tp.Type[trac.TracModel]], pipeline_config: tp.Union[str, pathlib.Path],
+                        sys_config: tp.Union[str, pathlib.Path]) -> tp.Dict[str, pa.Table]:
+    """
+    Run a pipeline of models from a YAML config, the config sets the parameters for each model, the external inputs
+    and where to save outputs. Datasets listed under 'intermediates' are only saved when 'persistIntermediates' is
+    true, otherwise they are only ever held in memory. When 'maxWorkers' is set the models that do not depend on each
+    other run at the same time in that many worker processes, and the node timings and critical path of the run are
+    saved to 'timingsReport' if it is given.
+    :param models: A dictionary of model classes keyed by node name.
+    :param pipeline_config: The path to the pipeline config.
+    :param sys_config: The path to the TRAC system config.
+    :return: The outputs of the pipeline as Arrow tables.
+    """
+
+    _trac_util.configure_logging()
+
+    config = yaml.safe_load(pathlib.Path(pipeline_config).read_text())["pipeline"]
+
+    outputs = dict(config.get("outputs") or dict())
+
+    if config.get("persistIntermediates", False):
+        outputs.update(config.get("intermediates") or dict())
+
+    if not config.get("maxWorkers"):
+        pipeline = ModelPipeline(models, sys_config)
+        return pipeline.run(config.get("parameters") or dict(), config.get("inputs") or dict(), outputs)
+
+    # The executor builds on the model pipeline, so it is imported here rather than at the top of the module
+    from utils.utils_pipeline_executor import PipelineExecutor
+
+    executor = PipelineExecutor(models, sys_config, config["maxWorkers"])
+    results = executor.run(config.get("parameters") or dict(), config.get("inputs") or dict(), outputs)
+
+    if config.get("timingsReport"):
+        executor.pipeline.save_report(executor.last_report, config["timingsReport"])
+
+    return results
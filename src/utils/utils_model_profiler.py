@@ -0,0 +1,364 @@
+# Load a plugin to allow typing
+import typing as tp
+import argparse
+import collections
+import cProfile
+import importlib
+import os
+import pathlib
+import pstats
+import runpy
+import sys
+import sysconfig
+import threading
+import time
+
+"""
+Runs a model under a profiler without any change to the model code, to find where a slow model spends its time. The
+model is run in the same way as running its script, so the launch config in the script's __main__ block is used, or it
+can be given a job config of its own. Two profilers are available:
+
+    deterministic  cProfile, which records every function call, the time is exact but calls to small functions are
+                   slowed down by the profiling itself
+    sampling       Samples the call stack of every thread at a fixed interval, the model runs at close to full speed
+                   and the time in each function is estimated from the number of samples it appears in
+
+The TRAC runtime runs models on a thread of their own, so both profilers cover every thread. The results are written
+to the output folder, named after the model:
+
+    <model>.prof        cProfile stats, readable with pstats or tools such as snakeviz (deterministic only)
+    <model>.collapsed   Collapsed stacks, one line per stack with its weight, the input format of flamegraph.pl,
+                        speedscope and inferno. Weights are microseconds for deterministic and samples for sampling
+    <model>_top.txt     The functions with the most time of their own and the most time including what they call
+
+The profiler is chosen with --profiler, or with the MODEL_PROFILER environment variable when the flag is not given.
+Profile the LGD model from the root of the repository with:
+    PYTHONPATH=src python src/utils/utils_model_profiler.py impairment.calculate_lgd.CalculateLgd --profiler sampling
+"""
+
+# The environment variable that chooses the profiler when it is not given on the command line
+PROFILER_VARIABLE = "MODEL_PROFILER"
+
+PROFILERS = ["deterministic", "sampling"]
+
+DEFAULT_OUTPUT_FOLDER = "data/outputs/profiles"
+DEFAULT_TOP_FUNCTIONS = 25
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Frames where a thread is waiting rather than working, samples of waiting threads are left out
+IDLE_FUNCTIONS = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("threading.py", "join"),
+                  ("queue.py", "get"), ("selectors.py", "select")}
+
+# The same for cProfile, which records the wait itself as a call to acquire a lock
+IDLE_BUILTINS = {"<method 'acquire' of '_thread.lock' objects>"}
+
+# Stacks with less than this share of the total time are left out of the collapsed stacks made from cProfile stats
+MIN_STACK_SHARE = 0.0001
+
+# The function the TRAC runtime calls to run a model, the summary has a section for the time spent inside it
+MODEL_ENTRY_POINT = "run_model"
+
+
+class ModelProfiler:
+
+    @staticmethod
+    def resolve_target(target: str) -> pathlib.Path:
+        """
+        A function that finds the script of a model, the script is run as if it had been started from the command
+        line so its __main__ block launches the model with its own config.
+        :param target: The path to the script, its module name (impairment.calculate_lgd) or the name of the model
+        class (impairment.calculate_lgd.CalculateLgd).
+        :return: The path to the script.
+        """
+
+        if target.endswith(".py"):
+            return pathlib.Path(target)
+
+        try:
+            module = importlib.import_module(target)
+        except ModuleNotFoundError:
+            module_name, _, class_name = target.rpartition(".")
+            module = importlib.import_module(module_name)
+            if not hasattr(module, class_name):
+                raise Exception(f"Module '{module_name}' has no model class '{class_name}'")
+
+        return pathlib.Path(module.__file__)
+
+    @staticmethod
+    def frame_label(file_name: str, line_number: int, function_name: str) -> str:
+        """
+        A function that gives a short, readable name for a function, for example 'apply (pandas/core/frame.py:9423)'.
+        Library files are named from their package and files in the working directory from there.
+        """
+
+        if "site-packages" in file_name:
+            file_name = file_name.split("site-packages", 1)[1].lstrip(os.sep)
+        elif file_name.startswith(sysconfig.get_paths()["stdlib"]):
+            file_name = os.path.relpath(file_name, sysconfig.get_paths()["stdlib"])
+        elif file_name.startswith(os.getcwd()):
+            file_name = os.path.relpath(file_name)
+
+        # Collapsed stacks use ';' between frames
+        return f"{function_name} ({file_name}:{line_number})".replace(";", ",")
+
+    @staticmethod
+    def profile_deterministic(run: tp.Callable[[], tp.Any]) -> pstats.Stats:
+        """
+        A function that runs a function under cProfile, with every thread it starts profiled as well.
+        :param run: The function to run.
+        :return: The stats for all the threads together.
+        """
+
+        profiles = [cProfile.Profile()]
+
+        def profile_thread(frame, event, arg):
+            # Called once as each new thread starts, the profile then replaces this hook for the rest of the thread
+            sys.setprofile(None)
+            thread_profile = cProfile.Profile()
+            profiles.append(thread_profile)
+            thread_profile.enable()
+
+        threading.setprofile(profile_thread)
+        profiles[0].enable()
+
+        try:
+            run()
+        finally:
+            profiles[0].disable()
+            threading.setprofile(None)
+
+        stats = pstats.Stats(profiles[0])
+
+        for thread_profile in profiles[1:]:
+            try:
+                stats.add(thread_profile)
+            except TypeError:
+                # A thread that ended before it made any calls has an empty profile
+                pass
+
+        return stats
+
+    @staticmethod
+    def profile_sampling(run: tp.Callable[[], tp.Any], interval: float = DEFAULT_SAMPLE_INTERVAL) -> tp.Counter[tp.Tuple[str, ...]]:
+        """
+        A function that runs a function while another thread samples the call stack of every thread.
+        :param run: The function to run.
+        :param interval: The time between samples in seconds.
+        :return: The number of samples of each stack, each stack starts with the name of its thread.
+        """
+
+        samples: tp.Counter[tp.Tuple[str, ...]] = collections.Counter()
+        finished = threading.Event()
+
+        def sample():
+            sampler_id = threading.get_ident()
+
+            while not finished.wait(interval):
+
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+                for thread_id, frame in sys._current_frames().items():  # noqa
+
+                    if thread_id == sampler_id:
+                        continue
+
+                    if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FUNCTIONS:
+                        continue
+
+                    stack = []
+                    while frame is not None:
+                        stack.append(ModelProfiler.frame_label(frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name))
+                        frame = frame.f_back
+
+                    samples[(thread_names.get(thread_id, str(thread_id)), *reversed(stack))] += 1
+
+        sampler = threading.Thread(target=sample, name="profile-sampler", daemon=True)
+        sampler.start()
+
+        try:
+            run()
+        finally:
+            finished.set()
+            sampler.join()
+
+        return samples
+
+    @staticmethod
+    def collapse_stats(stats: pstats.Stats, max_depth: int = 100) -> tp.Counter[tp.Tuple[str, ...]]:
+        """
+        A function that turns cProfile stats into collapsed stacks. cProfile only records which function called which,
+        not whole stacks, so the time of a function called from several places is split between them in proportion
+        to the time spent in each call. Recursive calls are folded into the first call, time spent waiting on a lock
+        is left out and so are stacks with too small a share of the total time to show.
+        :param stats: The cProfile stats.
+        :param max_depth: The deepest stack to follow.
+        :return: The time in microseconds spent in the last function of each stack, not counting what it calls.
+        """
+
+        callees = collections.defaultdict(dict)
+        for function, (_, _, _, _, callers) in stats.stats.items():  # noqa
+            for caller, edge in callers.items():
+                callees[caller][function] = edge
+
+        stacks: tp.Counter[tp.Tuple[str, ...]] = collections.Counter()
+
+        min_time = MIN_STACK_SHARE * sum(own_time for _, _, own_time, _, _ in stats.stats.values())  # noqa
+
+        def walk(function, stack, functions_on_stack, share):
+
+            _, _, own_time, total_time, _ = stats.stats[function]  # noqa
+
+            if function[2] not in IDLE_BUILTINS:
+                stacks[stack] += own_time * share * 1e6
+
+            if len(stack) >= max_depth:
+                return
+
+            for callee, (_, _, _, edge_time) in callees[function].items():
+
+                callee_total_time = stats.stats[callee][3]  # noqa
+                callee_share = share * edge_time / callee_total_time if callee_total_time > 0 else 0.0
+
+                if callee in functions_on_stack or callee_share * callee_total_time < min_time:
+                    continue
+
+                walk(callee, stack + (ModelProfiler.frame_label(*callee),), functions_on_stack | {callee}, callee_share)
+
+        for function, (_, _, _, _, callers) in stats.stats.items():  # noqa
+            if not callers:
+                walk(function, (ModelProfiler.frame_label(*function),), {function}, 1.0)
+
+        return stacks
+
+    @staticmethod
+    def top_functions(stacks: tp.Counter[tp.Tuple[str, ...]], number_of_functions: int = DEFAULT_TOP_FUNCTIONS) -> str:
+        """
+        A function that lists the functions with the most weight of their own, where the function was at the top of
+        the stack, and the most weight in total, where the function was anywhere on the stack.
+        :param stacks: The weight of each stack.
+        :param number_of_functions: The number of functions in each list.
+        :return: The two lists as text, with shares of the total weight of the stacks.
+        """
+
+        total_weight = sum(stacks.values()) or 1
+
+        own_weight: tp.Counter[str] = collections.Counter()
+        inclusive_weight: tp.Counter[str] = collections.Counter()
+
+        for stack, weight in stacks.items():
+            own_weight[stack[-1]] += weight
+            for function in set(stack):
+                inclusive_weight[function] += weight
+
+        lines = []
+
+        for title, weights in [("Own time (not counting the functions it calls)", own_weight), ("Total time (including the functions it calls)", inclusive_weight)]:
+            lines.append(title)
+            lines.append(f"{'share':>7}  function")
+            lines.extend(f"{weight / total_weight:>7.1%}  {function}" for function, weight in weights.most_common(number_of_functions))
+            lines.append("")
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def write_collapsed(stacks: tp.Counter[tp.Tuple[str, ...]], target_path: pathlib.Path):
+
+        with open(target_path, "w") as collapsed_file:
+            for stack, weight in sorted(stacks.items()):
+                if round(weight) > 0:
+                    collapsed_file.write(f"{';'.join(stack)} {round(weight)}\n")
+
+    @staticmethod
+    def profile_model(target: str, profiler: str = "deterministic", output_folder: tp.Union[str, pathlib.Path] = DEFAULT_OUTPUT_FOLDER,
+                      job_config: tp.Optional[str] = None, sys_config: str = "config/sys_config.yaml",
+                      number_of_functions: int = DEFAULT_TOP_FUNCTIONS, interval: float = DEFAULT_SAMPLE_INTERVAL) -> tp.Dict[str, pathlib.Path]:
+        """
+        A function that runs a model under a profiler and writes the results.
+        :param target: The model's script, module or class, see resolve_target().
+        :param profiler: 'deterministic' or 'sampling'.
+        :param output_folder: The folder to write the results to.
+        :param job_config: A job config to launch the model class with, by default the script's __main__ block is run.
+        :param sys_config: The system config used with a job config.
+        :param number_of_functions: The number of functions in the summary.
+        :param interval: The time between samples in seconds, for the sampling profiler.
+        :return: The paths to the files written.
+        """
+
+        if profiler not in PROFILERS:
+            raise Exception(f"Profiler '{profiler}' is not known, use one of {', '.join(PROFILERS)}")
+
+        if job_config is not None:
+            import tracdap.rt.launch as launch
+
+            module_name, _, class_name = target.rpartition(".")
+            model_class = getattr(importlib.import_module(module_name), class_name)
+            profile_name = class_name
+
+            def run():
+                launch.launch_model(model_class, job_config, sys_config)
+
+        else:
+            script_path = ModelProfiler.resolve_target(target)
+            profile_name = script_path.stem
+
+            def run():
+                sys.argv = [str(script_path)]
+                runpy.run_path(str(script_path), run_name="__main__")
+
+        output_folder = pathlib.Path(output_folder)
+        output_folder.mkdir(parents=True, exist_ok=True)
+
+        written = dict()
+        start = time.perf_counter()
+
+        if profiler == "deterministic":
+            stats = ModelProfiler.profile_deterministic(run)
+            written["stats"] = output_folder / f"{profile_name}.prof"
+            stats.dump_stats(written["stats"])
+            stacks = ModelProfiler.collapse_stats(stats)
+        else:
+            stacks = ModelProfiler.profile_sampling(run, interval)
+
+        seconds = time.perf_counter() - start
+
+        written["collapsed"] = output_folder / f"{profile_name}.collapsed"
+        ModelProfiler.write_collapsed(stacks, written["collapsed"])
+
+        # The model's own code is usually a small part of a short job, so it has a section of its own, with the
+        # stacks cut to start from run_model so the runtime frames above it are left out
+        model_stacks: tp.Counter[tp.Tuple[str, ...]] = collections.Counter()
+
+        for stack, weight in stacks.items():
+            entry_points = [i for i, frame in enumerate(stack) if frame.startswith(f"{MODEL_ENTRY_POINT} (")]
+            if entry_points:
+                model_stacks[stack[entry_points[-1]:]] += weight
+
+        summary = "\n".join([
+            f"{profile_name} ran in {seconds:.3f}s under the {profiler} profiler", "",
+            f"Inside {MODEL_ENTRY_POINT}, {sum(model_stacks.values()) / (sum(stacks.values()) or 1):.1%} of the profile", "",
+            ModelProfiler.top_functions(model_stacks, number_of_functions),
+            "The whole process", "",
+            ModelProfiler.top_functions(stacks, number_of_functions)])
+
+        written["summary"] = output_folder / f"{profile_name}_top.txt"
+        written["summary"].write_text(summary)
+
+        print(summary)
+
+        return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a model under a profiler")
+    parser.add_argument("target", help="The model's script, module or class, for example impairment.calculate_lgd.CalculateLgd")
+    parser.add_argument("--profiler", choices=PROFILERS, default=os.environ.get(PROFILER_VARIABLE) or "deterministic",
+                        help=f"The profiler to use, by default the value of {PROFILER_VARIABLE} or deterministic")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FOLDER, help="The folder to write the results to")
+    parser.add_argument("--job-config", help="A job config to launch the model class with, by default the script's own launch config is used")
+    parser.add_argument("--sys-config", default="config/sys_config.yaml", help="The system config used with --job-config")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_FUNCTIONS, help="The number of functions in the summary")
+    parser.add_argument("--interval", type=float, default=DEFAULT_SAMPLE_INTERVAL, help="The time between samples in seconds")
+    arguments = parser.parse_args()
+
+    ModelProfiler.profile_model(arguments.target, arguments.profiler, arguments.output, arguments.job_config,
+                                arguments.sys_config, arguments.top, arguments.interval)
@@ -0,0 +1,148 @@
+# Load a plugin to allow typing
+import typing as tp
+import concurrent.futures as futures
+import multiprocessing
+import pathlib
+import tempfile
+
+# Load the python libraries
+import pandas as pd
+import pyarrow as pa
+# Import the TRAC runtime library
+import tracdap.rt.exceptions as trac_exceptions
+
+# A function that works on some of the columns of a dataset, it is given the dataset, the (name, type) pairs of the
+# columns to work on and any extra arguments, and returns a dictionary of results keyed by column name
+ColumnFunction = tp.Callable[..., tp.Dict[str, tp.Any]]
+
+
+def _run_on_shared_table(column_function: ColumnFunction, table_path: str, columns: tp.List[tp.Tuple[str, tp.Any]], *args) -> tp.Dict[str, tp.Any]:
+    """
+    Run a column function in a worker process, reading the columns it needs from a memory-mapped Arrow IPC file. The
+    Arrow buffers point straight into the mapped file. Converting to pandas with one block per column keeps numeric
+    columns with no missing values as views over the mapped pages. Strings, dates and numeric columns with missing
+    values are still copied into the worker, as pandas holds them in a different layout.
+    """
+    with pa.memory_map(table_path, "r") as table_source:
+
+        table = pa.ipc.open_file(table_source).read_all()
+        data = table.select([column_name for column_name, _ in columns]).to_pandas(split_blocks=True)
+
+        return column_function(data, columns, *args)
+
+
+# The error raised when the process workers are used in a model run by the TRAC runtime
+PROCESS_WORKERS_BLOCKED_MESSAGE = "The executor type 'process' cannot be used in a model run by the TRAC runtime, its guard rails do not " \
+                                  "allow the worker processes to return their results, use 'thread' instead"
+
+
+def _trac_guard_rails_active() -> bool:
+    """
+    Whether the TRAC runtime has put its guard rails on the builtin functions. They stop model code from calling
+    memoryview(), which the worker processes need to receive their results, so this tries to call it.
+    """
+    try:
+        memoryview(b"")
+    except trac_exceptions.EModelValidation:
+        return True
+
+    return False
+
+
+class ParallelColumnUtils:
+
+    @staticmethod
+    def split_columns(columns: tp.List[tp.Tuple[str, tp.Any]], group_count: int) -> tp.List[tp.List[tp.Tuple[str, tp.Any]]]:
+        """
+        A function that splits a list of columns into groups of about the same size, the columns are dealt out in turn
+        so that wide and narrow columns next to each other in a schema end up in different groups.
+        :param columns: The (name, type) pairs of the columns to split.
+        :param group_count: The number of groups to split the columns into.
+        :return: A list of the non-empty groups.
+        """
+
+        groups = [columns[group_index::group_count] for group_index in range(max(group_count, 1))]
+
+        return [group for group in groups if group]
+
+    @staticmethod
+    def share_table(data: pd.DataFrame, column_names: tp.List[str], table_path: pathlib.Path):
+        """
+        A function that writes a dataFrame to an Arrow IPC file so that worker processes can memory-map it rather than
+        have it pickled and copied to each of them. On Linux the file is put in /dev/shm when it exists, so the pages
+        are shared memory and never written to disk.
+        :param data: The dataFrame to share.
+        :param column_names: The columns to share.
+        :param table_path: The file to write.
+        """
+
+        table = pa.Table.from_pandas(data, columns=column_names, preserve_index=False)
+
+        # File IO goes through pyarrow, the TRAC guard rails do not allow model code to call open() directly
+        with pa.OSFile(str(table_path), "wb") as table_sink:
+            with pa.ipc.new_file(table_sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @staticmethod
+    def map_column_groups(column_function: ColumnFunction, data: pd.DataFrame, columns: tp.List[tp.Tuple[str, tp.Any]], max_workers: int,
+                          executor_type: str = "thread", args: tp.Tuple = ()) -> tp.Dict[str, tp.Any]:
+        """
+        A function that runs a column function over groups of columns in a pool of workers and merges the results.
+        Threads share the dataFrame directly, processes memory-map it from a shared Arrow file. A process pool helps most when
+        the work holds the GIL, for example string handling, while a thread pool avoids the cost of sharing the data.
+        The TRAC guard rails block calls that the process workers need, so a model run by the TRAC launcher has to
+        use threads and asking for processes there raises straight away.
+        :param column_function: A module level function that takes a dataFrame, a list of (name, type) pairs and the
+        extra arguments, and returns a dictionary of results keyed by column name.
+        :param data: The dataFrame holding the columns.
+        :param columns: The (name, type) pairs of the columns to work on.
+        :param max_workers: The number of workers in the pool.
+        :param executor_type: Either 'thread' (the default) or 'process'.
+        :param args: Any extra arguments for the column function.
+        :return: The results for every column, keyed by column name.
+        """
+
+        if executor_type not in ["process", "thread"]:
+            raise Exception(f"The executor type must be 'process' or 'thread', got '{executor_type}'")
+
+        if executor_type == "process" and _trac_guard_rails_active():
+            raise Exception(PROCESS_WORKERS_BLOCKED_MESSAGE)
+
+        # A few groups per worker keeps the workers busy when some columns take longer than others
+        column_groups = ParallelColumnUtils.split_columns(columns, max_workers * 4)
+
+        results = dict()
+
+        if executor_type == "thread":
+
+            with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+                for group_results in executor.map(lambda column_group: column_function(data, column_group, *args), column_groups):
+                    results.update(group_results)
+
+            return results
+
+        shared_dir = "/dev/shm" if pathlib.Path("/dev/shm").is_dir() else None
+
+        with tempfile.TemporaryDirectory(dir=shared_dir) as temporary_dir:
+
+            table_path = pathlib.Path(temporary_dir) / "columns.arrow"
+            ParallelColumnUtils.share_table(data, [column_name for column_name, _ in columns], table_path)
+
+            # The guard rails can also be hit part way through, for example if the runtime changes how they are put on,
+            # so a blocked call from the pool is reported in the same way as the check above
+            try:
+
+                # Spawn rather than fork the workers, forking a process that is running threads is not safe
+                with futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+
+                    group_futures = [executor.submit(_run_on_shared_table, column_function, str(table_path), column_group, *args)
+                                     for column_group in column_groups]
+
+                    for group_future in group_futures:
+                        results.update(group_future.result())
+
+            except trac_exceptions.EModelValidation as error:
+                raise Exception(PROCESS_WORKERS_BLOCKED_MESSAGE) from error
+
+        return results
@@ -0,0 +1,253 @@
+# Load a plugin to allow typing
+import typing as tp
+import concurrent.futures as futures
+import logging
+import multiprocessing
+import os
+import pathlib
+import time
+
+# Load the python libraries
+import pyarrow as pa
+
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+import tracdap.rt._impl.util as _trac_util  # noqa
+
+# Load the TRAC helpers
+from utils.utils_model_pipeline import ModelPipeline
+
+"""
+Runs a pipeline of models as a DAG, with the models that do not depend on each other running at the same time in a
+pool of worker processes. The dependencies are worked out from the inputs and outputs the models declare, as they are
+for ModelPipeline, and a model is sent to a worker as soon as the models producing its inputs have finished.
+
+Intermediate datasets are passed between the models in memory, a worker sends the outputs of its model back as Arrow
+tables and they are handed on to the models that read them. External inputs given as storage paths are loaded by the
+workers that need them, with the columns and filters their model declares, and outputs with a storage path are saved
+by the worker that produces them.
+
+Each run records the timings of every node and the critical path, the chain of dependent models that adds up to the
+longest time. The end-to-end time of the pipeline cannot be less than the critical path, whatever the number of
+workers, and the difference between the two is the time spent starting workers, waiting for a free worker and passing
+datasets between processes. Node times are taken from the wall clock so they can be compared between processes.
+
+Workers are spawned for each run and take about a second to start, as each one imports pandas, pyarrow, the TRAC
+runtime and the models. For small datasets this is more than the models take and ModelPipeline, which runs the models
+one at a time in the calling process, finishes sooner.
+"""
+
+# The pipelines for each node built in a worker process, so a worker running the same node again does not scan the model
+_worker_pipelines: tp.Dict[str, ModelPipeline] = dict()
+
+
+def _init_worker():
+
+    _trac_util.configure_logging()
+
+
+def _run_node_in_worker(node_name: str, model_class: tp.Type[trac.TracModel], sys_config: str, node_parameters: tp.Dict[str, tp.Any],
+                        node_inputs: tp.Dict[str, tp.Union[str, pa.Table]], node_outputs: tp.Dict[str, str]) -> tp.Dict[str, tp.Any]:
+    """
+    Run one model in a worker process through a single model pipeline.
+    :return: The outputs of the model as Arrow tables, the wall clock time it started and finished and the process ID.
+    """
+
+    if node_name not in _worker_pipelines:
+        _worker_pipelines[node_name] = ModelPipeline({node_name: model_class}, sys_config)
+
+    pipeline = _worker_pipelines[node_name]
+
+    start_time = time.time()
+    outputs = pipeline.run({node_name: node_parameters}, node_inputs, node_outputs, keep=pipeline.node_outputs(node_name))
+    end_time = time.time()
+
+    return {"outputs": outputs, "start_time": start_time, "end_time": end_time, "process_id": os.getpid()}
+
+
+class PipelineExecutor:
+
+    def __init__(self, models: tp.Dict[str, tp.Type[trac.TracModel]], sys_config: tp.Union[str, pathlib.Path], max_workers: int):
+        """
+        Set up a pipeline for a set of models that runs independent models at the same time.
+        :param models: A dictionary of model classes keyed by node name, these must be defined at module level so the
+        worker processes can import them.
+        :param sys_config: The path to the TRAC system config, this defines the storage used for inputs and outputs.
+        :param max_workers: The number of worker processes.
+        """
+
+        if max_workers < 1:
+            raise Exception(f"The number of workers must be at least 1, got {max_workers}")
+
+        self._log = logging.getLogger(self.__class__.__name__)
+
+        self._models = models
+        self._sys_config = str(pathlib.Path(sys_config).resolve())
+        self._max_workers = max_workers
+        self._pipeline = ModelPipeline(models, sys_config)
+
+        self.last_report: tp.Optional[tp.Dict[str, tp.Any]] = None
+
+    @property
+    def pipeline(self) -> ModelPipeline:
+        return self._pipeline
+
+    def run(self, parameters: tp.Dict[str, tp.Dict[str, tp.Any]], inputs: tp.Dict[str, tp.Union[str, pa.Table]],
+            outputs: tp.Optional[tp.Dict[str, str]] = None, keep: tp.Optional[tp.List[str]] = None) -> tp.Dict[str, pa.Table]:
+        """
+        Run every model in the pipeline, each as soon as the models producing its inputs have finished. The timings
+        of the run are logged and kept in last_report.
+        :param parameters: A dictionary keyed by node name of the parameters for each model, parameters not set here
+        use the default value declared by the model.
+        :param inputs: The external inputs to the pipeline, either as a storage path or as an in-memory table.
+        :param outputs: Storage paths to save datasets to, any dataset in the pipeline (including intermediate
+        datasets) can be saved.
+        :param keep: Intermediate datasets to hand back without saving them.
+        :return: The final outputs of the pipeline, plus any other datasets that were saved or kept, as Arrow tables.
+        """
+
+        pipeline = self._pipeline
+        outputs = outputs or dict()
+
+        missing_inputs = [input_name for input_name in pipeline.required_inputs() if input_name not in inputs]
+        if missing_inputs:
+            raise Exception(f"The pipeline needs these inputs to be supplied: {', '.join(missing_inputs)}")
+
+        # Count how many models still need each dataset, so datasets can be released as soon as they are used up
+        pending_reads = dict()
+        for node_name in pipeline.node_order:
+            for input_name in pipeline.node_inputs(node_name):
+                pending_reads[input_name] = pending_reads.get(input_name, 0) + 1
+
+        keep = set(pipeline.final_outputs()) | set(outputs) | set(keep or [])
+
+        datasets: tp.Dict[str, tp.Union[str, pa.Table]] = dict(inputs)
+        node_timings: tp.Dict[str, tp.Dict[str, tp.Any]] = dict()
+        finished: tp.List[str] = []
+
+        run_start = time.time()
+
+        # Spawn rather than fork the workers, forking a process that is running threads is not safe
+        executor = futures.ProcessPoolExecutor(max_workers=self._max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+
+        try:
+            running: tp.Dict[futures.Future, str] = dict()
+
+            while len(finished) < len(pipeline.node_order):
+
+                for node_name in pipeline.node_order:
+                    if node_name not in node_timings and all(upstream_node in finished for upstream_node in pipeline.node_dependencies(node_name)):
+
+                        self._log.info(f"Starting model [{node_name}]")
+
+                        node_timings[node_name] = {"ready_time": time.time()}
+
+                        running[executor.submit(
+                            _run_node_in_worker, node_name, self._models[node_name], self._sys_config, parameters.get(node_name) or dict(),
+                            {input_name: datasets[input_name] for input_name in pipeline.node_inputs(node_name)},
+                            {output_name: outputs[output_name] for output_name in pipeline.node_outputs(node_name) if output_name in outputs})] = node_name
+
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+
+                for future in done:
+
+                    node_name = running.pop(future)
+
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        raise Exception(f"Model [{node_name}] failed: {error}") from error
+
+                    node_timings[node_name].update(
+                        start_time=result["start_time"], end_time=result["end_time"], received_time=time.time(), process_id=result["process_id"])
+
+                    self._log.info(f"Model [{node_name}] ran in {result['end_time'] - result['start_time']:.3f}s")
+
+                    datasets.update(result["outputs"])
+                    finished.append(node_name)
+
+                    for input_name in pipeline.node_inputs(node_name):
+                        pending_reads[input_name] -= 1
+                        if pending_reads[input_name] == 0 and input_name not in keep:
+                            del datasets[input_name]
+
+            run_end = time.time()
+
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self.last_report = self.timings_report(node_timings, run_start, run_end)
+        self.log_report(self.last_report)
+
+        return {dataset_name: table for dataset_name, table in datasets.items() if dataset_name in keep and isinstance(table, pa.Table)}
+
+    def timings_report(self, node_timings: tp.Dict[str, tp.Dict[str, tp.Any]], run_start: float, run_end: float) -> tp.Dict[str, tp.Any]:
+        """
+        Work out the timings of each node relative to the start of the run, and the critical path through the
+        pipeline, the chain of dependent nodes with the longest total run time.
+        :param node_timings: The wall clock times each node became ready, started, finished and was received.
+        :param run_start: The wall clock time the run started.
+        :param run_end: The wall clock time the run finished.
+        :return: The timings report.
+        """
+
+        pipeline = self._pipeline
+
+        nodes = dict()
+
+        for node_name in pipeline.node_order:
+            timings = node_timings[node_name]
+            nodes[node_name] = {
+                "depends_on": pipeline.node_dependencies(node_name),
+                "ready": round(timings["ready_time"] - run_start, 3),
+                "start": round(timings["start_time"] - run_start, 3),
+                "end": round(timings["end_time"] - run_start, 3),
+                "seconds": round(timings["end_time"] - timings["start_time"], 3),
+                # The time between becoming ready and starting, waiting for a worker and sending it the inputs
+                "waited": round(timings["start_time"] - timings["ready_time"], 3),
+                # The time taken to send the outputs back
+                "returned": round(timings["received_time"] - timings["end_time"], 3),
+                "process_id": timings["process_id"]}
+
+        # The longest chain of run times ending at each node, and the node before it on that chain
+        path_seconds = dict()
+        path_previous = dict()
+
+        for node_name in pipeline.node_order:
+            upstream_nodes = nodes[node_name]["depends_on"]
+            previous_node = max(upstream_nodes, key=lambda upstream_node: path_seconds[upstream_node]) if upstream_nodes else None
+            path_seconds[node_name] = (path_seconds[previous_node] if previous_node else 0.0) + nodes[node_name]["seconds"]
+            path_previous[node_name] = previous_node
+
+        critical_path = [max(path_seconds, key=lambda path_node: path_seconds[path_node])]
+
+        while path_previous[critical_path[0]] is not None:
+            critical_path.insert(0, path_previous[critical_path[0]])
+
+        for node_name, node_report in nodes.items():
+            node_report["critical"] = node_name in critical_path
+
+        wall_seconds = run_end - run_start
+        critical_path_seconds = path_seconds[critical_path[-1]]
+
+        return {
+            "max_workers": self._max_workers,
+            "wall_seconds": round(wall_seconds, 3),
+            "node_seconds": round(sum(node_report["seconds"] for node_report in nodes.values()), 3),
+            "critical_path_seconds": round(critical_path_seconds, 3),
+            "overhead_seconds": round(wall_seconds - critical_path_seconds, 3),
+            "critical_path": critical_path,
+            "nodes": nodes}
+
+    def log_report(self, report: tp.Dict[str, tp.Any]):
+
+        self._log.info(f"Pipeline ran in {report['wall_seconds']:.3f}s with {report['max_workers']} workers, "
+                       f"the models took {report['node_seconds']:.3f}s between them")
+
+        for node_name, node_report in report["nodes"].items():
+            self._log.info(f"{'*' if node_report['critical'] else ' '} {node_name:<40} ready {node_report['ready']:>8.3f}s  "
+                           f"start {node_report['start']:>8.3f}s  end {node_report['end']:>8.3f}s  "
+                           f"run {node_report['seconds']:>8.3f}s  waited {node_report['waited']:>7.3f}s")
+
+        self._log.info(f"Critical path {report['critical_path_seconds']:.3f}s (marked *): {' -> '.join(report['critical_path'])}, "
+                       f"{report['overhead_seconds']:.3f}s spent on workers and passing data")
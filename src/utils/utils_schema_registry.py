@@ -0,0 +1,168 @@
+# Load a plugin to allow typing
+import typing as tp
+import hashlib
+import importlib
+import importlib.resources
+import os
+import pathlib
+import pickle
+import types
+
+# Load the python libraries
+import pyarrow as pa
+# Import the TRAC runtime library
+import tracdap.rt as trac_runtime
+import tracdap.rt.api as trac
+
+# Load a set of utils for handling TRAC schemas
+from utils.utils_trac_schema import TracSchemaUtils
+
+"""
+A registry that parses each schema file once per process. Models load the same schema files every time they are
+loaded, and some files are shared by several models, so a batch of jobs would otherwise parse the same CSV files over
+and over again. Schemas are also keyed on a hash of the file contents, so a schema can be saved to an on-disk cache in
+pickled form and reused by later processes for as long as the file does not change.
+"""
+
+# The packages holding the model schemas, these are loaded by SchemaRegistry.preload()
+SCHEMA_PACKAGES = ["impairment.schemas", "ppnr.schemas", "testing_models.schemas"]
+
+# Set this environment variable to a folder to keep pickled schemas between processes
+SCHEMA_CACHE_DIR_VARIABLE = "MODEL_SCHEMA_CACHE_DIR"
+
+
+class SchemaEntry:
+
+    def __init__(self, schema: trac.SchemaDefinition):
+        """
+        A parsed schema along with the precomputed lists of its variables by type.
+        :param schema: The parsed schema.
+        """
+        self.schema = schema
+        self.type_breakdown = TracSchemaUtils.get_trac_schema_type_breakdown(schema)
+
+
+class SchemaRegistry:
+
+    # Entries are keyed by the hash of the schema file, so identical files in different packages share an entry
+    _entries: tp.Dict[str, SchemaEntry] = dict()
+
+    # The hash of each (package, file) that has been loaded, once a file is known it is not read again
+    _file_hashes: tp.Dict[tp.Tuple[str, str], str] = dict()
+
+    _cache_dir: tp.Optional[pathlib.Path] = pathlib.Path(os.environ[SCHEMA_CACHE_DIR_VARIABLE]) if os.environ.get(SCHEMA_CACHE_DIR_VARIABLE) else None
+
+    _hits = 0
+    _misses = 0
+
+    @classmethod
+    def set_cache_dir(cls, cache_dir: tp.Optional[tp.Union[str, pathlib.Path]]):
+        """
+        Set the folder used to keep pickled schemas between processes, None turns the on-disk cache off.
+        :param cache_dir: The cache folder.
+        """
+        cls._cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+
+    @classmethod
+    def clear(cls):
+        """
+        Forget every schema loaded in this process, the on-disk cache is left as it is.
+        """
+        cls._entries.clear()
+        cls._file_hashes.clear()
+        cls._hits = 0
+        cls._misses = 0
+
+    @classmethod
+    def statistics(cls) -> tp.Dict[str, int]:
+        """
+        The number of schema loads that were served from the registry and the number that had to parse a file.
+        """
+        return {"hits": cls._hits, "misses": cls._misses, "schemas": len(cls._entries)}
+
+    @staticmethod
+    def _package_name(package: tp.Union[types.ModuleType, str]) -> str:
+
+        return package if isinstance(package, str) else package.__name__
+
+    @classmethod
+    def _get_entry(cls, package: tp.Union[types.ModuleType, str], schema_file: str) -> SchemaEntry:
+
+        location = (cls._package_name(package), schema_file)
+
+        if location in cls._file_hashes:
+            cls._hits += 1
+            return cls._entries[cls._file_hashes[location]]
+
+        schema_bytes = importlib.resources.files(location[0]).joinpath(schema_file).read_bytes()
+
+        # The runtime version is part of the key, the pickled form is only valid for the version that created it
+        file_hash = hashlib.sha256(trac_runtime.__version__.encode() + b"\0" + schema_bytes).hexdigest()
+
+        if file_hash in cls._entries:
+            cls._file_hashes[location] = file_hash
+            cls._hits += 1
+            return cls._entries[file_hash]
+
+        cls._misses += 1
+
+        cache_file = cls._cache_dir / f"{file_hash}.pickle" if cls._cache_dir is not None else None
+
+        # The cache files are read and written through pyarrow, the TRAC guard rails stop model code from doing file IO
+        # through the standard library
+        if cache_file is not None and cache_file.exists():
+            with pa.input_stream(str(cache_file)) as cache_stream:
+                entry = pickle.loads(cache_stream.read())
+        else:
+            entry = SchemaEntry(trac.load_schema(package, schema_file))
+
+            if cache_file is not None:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+
+                # Write to a temporary file first so other processes never read a partly written file
+                temporary_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+                with pa.OSFile(str(temporary_file), "wb") as cache_stream:
+                    cache_stream.write(pickle.dumps(entry))
+                temporary_file.replace(cache_file)
+
+        # The file is only recorded once its schema is parsed, so a load that fails is tried again by the next caller
+        cls._entries[file_hash] = entry
+        cls._file_hashes[location] = file_hash
+
+        return entry
+
+    @classmethod
+    def load_schema(cls, package: tp.Union[types.ModuleType, str], schema_file: str) -> trac.SchemaDefinition:
+        """
+        A drop-in replacement for trac.load_schema() that only parses each schema file once. The same schema object
+        is returned to every caller so it must not be changed.
+        :param package: The package holding the schema file.
+        :param schema_file: The name of the schema file.
+        :return: The schema.
+        """
+        return cls._get_entry(package, schema_file).schema
+
+    @classmethod
+    def get_type_breakdown(cls, package: tp.Union[types.ModuleType, str], schema_file: str) -> tp.Dict[trac.BasicType, tp.List[str]]:
+        """
+        The variables in a schema broken down by TRAC type, worked out once when the schema is first loaded. See
+        TracSchemaUtils.get_trac_schema_type_breakdown.
+        :param package: The package holding the schema file.
+        :param schema_file: The name of the schema file.
+        :return: A dictionary keyed by the TRAC type with lists of variable names as the properties.
+        """
+        return cls._get_entry(package, schema_file).type_breakdown
+
+    @classmethod
+    def preload(cls, packages: tp.Optional[tp.List[str]] = None):
+        """
+        Load every schema file in a list of packages, for example before starting a large batch of jobs.
+        :param packages: The packages to load, by default the model schema packages in SCHEMA_PACKAGES.
+        """
+        for package in packages or SCHEMA_PACKAGES:
+
+            importlib.import_module(package)
+
+            for resource in importlib.resources.files(package).iterdir():
+                if resource.name.endswith(".csv"):
+                    cls._get_entry(package, resource.name)
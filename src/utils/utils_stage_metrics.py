@@ -0,0 +1,254 @@
+# Load a plugin to allow typing
+import typing as tp
+import datetime
+import functools
+import json
+import os
+import pathlib
+import time
+import tracemalloc
+
+# Load the python libraries
+import pyarrow as pa
+# Import the TRAC runtime library
+import tracdap.rt.api as trac
+
+"""
+Timing and memory for the stages of a model run, so a slow job shows whether the time went on loading an input, a
+merge, a groupby or saving an output. A model marks its stages with StageMetrics.stage() and its run_model method with
+the StageMetrics.instrument decorator. Loading and saving datasets through CompactTableUtils is recorded as a stage
+without any change to the model.
+
+For each stage the metrics hold the time taken, the rows and the bytes of data going in and out where the model gives
+them (for an input, as the runtime hands it over and after it is made compact), the peak memory allocated by Python and
+NumPy during the stage over what was allocated when it started, and the change in memory held in Arrow buffers.
+Stages can be nested, the depth of each one is recorded with it.
+
+Metrics are off unless the MODEL_STAGE_METRICS environment variable is set. When they are off a stage is a shared
+object that does nothing, so the instrumented models run as they did before. Set the variable to 'true' to log the
+metrics of each model run as JSON, or to a folder to also write them there as a JSON file named after the model. The
+model pipeline also writes them next to the outputs it saves for each model.
+
+    MODEL_STAGE_METRICS=data/outputs PYTHONPATH=src python src/impairment/calculate_pd.py
+"""
+
+# The environment variable that turns the metrics on
+STAGE_METRICS_VARIABLE = "MODEL_STAGE_METRICS"
+
+# The suffix of the file the metrics for a model are written to
+STAGE_METRICS_SUFFIX = "_stage_metrics.json"
+
+
+class _Stage:
+
+    def __init__(self, stage_name: str, rows_in: tp.Optional[int] = None):
+        """
+        A stage that is being measured, rows_out, bytes_in and bytes_out can be set on it before the stage ends.
+        """
+
+        self.stage_name = stage_name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_in = None
+        self.bytes_out = None
+
+        self._record = None
+        self._start_time = 0.0
+        self._start_memory = 0
+        self._start_arrow_memory = 0
+        self._peak_memory = 0
+
+    def __enter__(self) -> "_Stage":
+
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+
+        # The peak so far belongs to the stage that is already running, the peak is then reset for this stage
+        if StageMetrics._stack:
+            StageMetrics._stack[-1]._peak_memory = max(StageMetrics._stack[-1]._peak_memory, peak_memory)
+
+        tracemalloc.reset_peak()
+
+        self._record = {"stage": self.stage_name, "depth": len(StageMetrics._stack)}
+        StageMetrics._records.append(self._record)
+        StageMetrics._stack.append(self)
+
+        self._start_memory = current_memory
+        self._peak_memory = current_memory
+        self._start_arrow_memory = pa.total_allocated_bytes()
+        self._start_time = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        seconds = time.perf_counter() - self._start_time
+
+        _, peak_memory = tracemalloc.get_traced_memory()
+        self._peak_memory = max(self._peak_memory, peak_memory)
+
+        StageMetrics._stack.pop()
+
+        # The peak of this stage is also a peak of the stage it is part of
+        if StageMetrics._stack:
+            StageMetrics._stack[-1]._peak_memory = max(StageMetrics._stack[-1]._peak_memory, self._peak_memory)
+
+        self._record.update({
+            "seconds": round(seconds, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "peak_memory_delta_bytes": self._peak_memory - self._start_memory,
+            "arrow_memory_delta_bytes": pa.total_allocated_bytes() - self._start_arrow_memory,
+            "failed": exc_type is not None
+        })
+
+        return False
+
+
+class _DisabledStage:
+    """
+    Stands in for every stage when metrics are off, setting rows on it does nothing.
+    """
+
+    rows_in = None
+    rows_out = None
+    bytes_in = None
+    bytes_out = None
+
+    def __enter__(self) -> "_DisabledStage":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+class StageMetrics:
+
+    _setting: tp.Optional[str] = None
+    _stack: tp.List[_Stage] = []
+    _records: tp.List[tp.Dict[str, tp.Any]] = []
+
+    # The metrics of the last model run, kept so that a runner can save them next to the outputs
+    last_report: tp.Optional[tp.Dict[str, tp.Any]] = None
+
+    @staticmethod
+    def _get_setting() -> str:
+
+        if StageMetrics._setting is None:
+            StageMetrics._setting = os.environ.get(STAGE_METRICS_VARIABLE, "").strip()
+
+        return StageMetrics._setting
+
+    @staticmethod
+    def enabled() -> bool:
+        """
+        A function that says whether stage metrics are being collected.
+        :return: True when the MODEL_STAGE_METRICS environment variable is set, or metrics have been turned on with
+        StageMetrics.enable().
+        """
+
+        return StageMetrics._get_setting().lower() not in ("", "0", "false", "no")
+
+    @staticmethod
+    def enable(setting: tp.Optional[str] = "true"):
+        """
+        A function that turns stage metrics on or off without the environment variable.
+        :param setting: 'true' to log the metrics, a folder to also write them there, or None to turn them off.
+        """
+
+        StageMetrics._setting = setting or ""
+
+    @staticmethod
+    def output_folder() -> tp.Optional[pathlib.Path]:
+        """
+        A function that gives the folder the metrics of each model run are written to, if one has been set.
+        """
+
+        setting = StageMetrics._get_setting()
+
+        return pathlib.Path(setting) if StageMetrics.enabled() and setting.lower() not in ("1", "true", "yes") else None
+
+    @staticmethod
+    def stage(stage_name: str, rows_in: tp.Optional[int] = None) -> tp.Union[_Stage, _DisabledStage]:
+        """
+        A function that marks a stage of a model run, used as a context manager. The number of rows the stage
+        produces can be set as rows_out on the object it gives.
+
+            with StageMetrics.stage("merge", rows_in=len(lgd_forecast)) as stage:
+                impairment_forecast = lgd_forecast.merge(pd_forecast, on=["id", "date"])
+                stage.rows_out = len(impairment_forecast)
+
+        :param stage_name: The name of the stage.
+        :param rows_in: The number of rows going into the stage.
+        :return: The stage, or an object that does nothing when metrics are off or no model run is being measured.
+        """
+
+        if not StageMetrics._stack:
+            return _DISABLED_STAGE
+
+        return _Stage(stage_name, rows_in)
+
+    @staticmethod
+    def instrument(run_model: tp.Callable[[trac.TracModel, trac.TracContext], None]) -> tp.Callable[[trac.TracModel, trac.TracContext], None]:
+        """
+        A decorator for the run_model method of a model, which measures the whole run as a stage with every stage
+        inside it. At the end of the run the metrics are logged, kept as StageMetrics.last_report and written to
+        the output folder if there is one. When metrics are off the model runs as it would without the decorator.
+        """
+
+        @functools.wraps(run_model)
+        def instrumented_run_model(model: trac.TracModel, ctx: trac.TracContext):
+
+            if not StageMetrics.enabled():
+                return run_model(model, ctx)
+
+            model_name = type(model).__name__
+            started_tracing = not tracemalloc.is_tracing()
+
+            if started_tracing:
+                tracemalloc.start()
+
+            StageMetrics._records = []
+            StageMetrics._stack = []
+
+            try:
+                with _Stage("run_model"):
+                    run_model(model, ctx)
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+
+                StageMetrics.last_report = {
+                    "model": model_name,
+                    "finished": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "stages": StageMetrics._records
+                }
+
+                StageMetrics._records = []
+                StageMetrics._stack = []
+
+                ctx.log().info(f"Stage metrics: {json.dumps(StageMetrics.last_report)}")
+
+                if StageMetrics.output_folder() is not None:
+                    StageMetrics.write_report(StageMetrics.last_report, StageMetrics.output_folder() / f"{model_name}{STAGE_METRICS_SUFFIX}")
+
+        return instrumented_run_model
+
+    @staticmethod
+    def write_report(report: tp.Dict[str, tp.Any], target_path: tp.Union[str, pathlib.Path]):
+        """
+        A function that writes the metrics of a model run as a JSON file.
+        :param report: The metrics, as held in StageMetrics.last_report.
+        :param target_path: The path to the file.
+        """
+
+        target_path = pathlib.Path(target_path)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        target_path.write_text(json.dumps(report, indent=2))
@@ -26,14 +26,14 @@ class TracSchemaUtils:
     def get_trac_schema_type_breakdown(schema: trac.SchemaDefinition) -> tp.Dict[trac.BasicType, tp.List[str]]:
         """
         A function that takes a TRAC schema and returns a dictionary of lists, where the key is a
-        TRAC type and the list is the corresponding variables in the schema.
+        TRAC type and the list is the corresponding variables in the schema. The fields are only read once.
         :return: A dictionary keyed by the TRAC type with lists of variable names as the properties.
         """
 
-        type_breakdown = dict()
-        for basic_type in trac.BasicType:
-            print(basic_type)
-            type_breakdown[basic_type] = TracSchemaUtils.get_trac_fields_by_type(schema, basic_type)
+        type_breakdown = {basic_type: [] for basic_type in trac.BasicType}
+
+        for field in schema.table.fields:
+            type_breakdown[field.fieldType].append(field.fieldName)
 
         return type_breakdown
 
@@ -0,0 +1,19 @@
+import pathlib
+import sys
+
+# Import the TRAC runtime library
+import tracdap.rt.ext.plugins as trac_plugins
+import tracdap.rt._impl.static_api as _trac_static_api  # noqa
+
+"""
+Shared set up for the tests. The models import each other from the src folder in the same way as when they are run
+by TRAC, so src is put on the path before any test module is loaded. The TRAC API is set up in the same way as by
+ModelPipeline, so tests can load schemas outside of a model run.
+"""
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+trac_plugins.PluginManager.register_core_plugins()
+_trac_static_api.StaticApiImpl.register_impl()
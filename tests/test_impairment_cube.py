@@ -0,0 +1,96 @@
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Load the functions being tested
+from impairment.calculate_impairment_cube import CUBE_DIMENSIONS, add_band_columns, build_impairment_cube, query_impairment_cube
+from impairment.calculate_impairment_mi import IMPAIRMENT_MI_SUMS, IMPAIRMENT_MI_MEANS
+
+"""
+Tests that the roll-ups and slices answered from the impairment cube are the same as grouping the loan level forecast
+directly, for the totals and for the means, which are means over the accounts rather than means of the cube's means.
+"""
+
+NUMBER_OF_ROWS = 20_000
+
+
+@pytest.fixture(scope="module")
+def impairment_forecast() -> pd.DataFrame:
+    """
+    A random impairment forecast with a few members in each dimension, some missing values in the averaged columns
+    and some debt to values and arrears that fall outside the bands.
+    """
+    rng = np.random.default_rng(11)
+
+    impairment_forecast = pd.DataFrame({
+        "date": rng.choice(pd.date_range("2021-01-31", periods=6, freq="M").to_numpy(), NUMBER_OF_ROWS),
+        "business_line": rng.choice(["Retail", "Commercial"], NUMBER_OF_ROWS),
+        "product_line": rng.choice(["Mortgage", "Buy to let"], NUMBER_OF_ROWS),
+        "region": rng.choice(["Sweden", "Norway", "Denmark"], NUMBER_OF_ROWS),
+        "subregion": rng.choice(["Gotland", "Halland", "Oland", "Blekinge"], NUMBER_OF_ROWS),
+        "mortgage_type": rng.choice(["fixed rate", "variable rate", "capped rate"], NUMBER_OF_ROWS),
+        "dtv": rng.uniform(-0.1, 1.3, NUMBER_OF_ROWS),
+        "months_in_arrears": rng.integers(-1, 6, NUMBER_OF_ROWS),
+    })
+
+    impairment_forecast.loc[rng.random(NUMBER_OF_ROWS) < 0.02, "dtv"] = np.nan
+
+    for column in IMPAIRMENT_MI_SUMS:
+        impairment_forecast[column] = rng.uniform(0.0, 500_000.0, NUMBER_OF_ROWS)
+
+    for column in IMPAIRMENT_MI_MEANS:
+        impairment_forecast[column] = rng.uniform(0.0, 1.0, NUMBER_OF_ROWS)
+        impairment_forecast.loc[rng.random(NUMBER_OF_ROWS) < 0.05, column] = np.nan
+
+    return impairment_forecast
+
+
+@pytest.fixture(scope="module")
+def impairment_cube(impairment_forecast) -> pd.DataFrame:
+
+    return build_impairment_cube(impairment_forecast, CUBE_DIMENSIONS)
+
+
+def direct_summary(impairment_forecast, group_by, filters) -> pd.DataFrame:
+    """
+    The same cut worked out by filtering and grouping the forecast itself.
+    """
+    impairment_forecast = add_band_columns(impairment_forecast)
+
+    for column, values in filters.items():
+        impairment_forecast = impairment_forecast[impairment_forecast[column].isin([values] if isinstance(values, str) else values)]
+
+    aggregations = {**{column: "sum" for column in IMPAIRMENT_MI_SUMS}, **{column: "mean" for column in IMPAIRMENT_MI_MEANS}}
+
+    if not group_by:
+        return impairment_forecast.agg(aggregations).to_frame().T.rename(columns={**IMPAIRMENT_MI_SUMS, **IMPAIRMENT_MI_MEANS})
+
+    # Bands sort in band order, as they are reported by the cube
+    return (impairment_forecast.groupby(group_by, observed=True, as_index=False).agg(aggregations)
+            .sort_values(by=group_by).reset_index(drop=True)
+            .rename(columns={**IMPAIRMENT_MI_SUMS, **IMPAIRMENT_MI_MEANS}))
+
+
+@pytest.mark.parametrize("group_by, filters", [
+    ([], {}),
+    (["date"], {}),
+    (["date", "subregion"], {}),
+    (["business_line", "mortgage_type", "date"], {}),
+    (["dtv_band"], {"mortgage_type": "fixed rate"}),
+    (["date", "arrears_bucket", "mortgage_type"], {"subregion": ["Gotland", "Halland"]}),
+    (["region", "dtv_band", "arrears_bucket"], {"business_line": "Retail", "arrears_bucket": ["1 month", "Unknown"]}),
+])
+def test_cube_query_matches_direct_groupby(impairment_forecast, impairment_cube, group_by, filters):
+
+    cube_summary = query_impairment_cube(impairment_cube, group_by, filters)
+    expected = direct_summary(impairment_forecast, group_by, filters)
+
+    assert len(cube_summary) == len(expected)
+
+    for column in group_by:
+        np.testing.assert_array_equal(cube_summary[column].astype(str).to_numpy(), expected[column].astype(str).to_numpy())
+
+    for summary_column in list(IMPAIRMENT_MI_SUMS.values()) + list(IMPAIRMENT_MI_MEANS.values()):
+        np.testing.assert_allclose(cube_summary[summary_column].to_numpy(dtype=np.float64),
+                                   expected[summary_column].to_numpy(dtype=np.float64), rtol=1e-10, err_msg=summary_column)
@@ -0,0 +1,128 @@
+# Load the python libraries
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+# Load the models being tested
+from benchmarks.synthetic_data import make_mortgage_book_t0
+from impairment import schemas as schemas
+from impairment.impairment_pipeline import IMPAIRMENT_MODELS
+from impairment.impairment_incremental import run_incremental, to_arrow
+from utils.utils_model_pipeline import ModelPipeline
+from utils.utils_schema_registry import SchemaRegistry
+
+"""
+Tests that patching last month's impairment forecasts for a new book gives the same results as running the whole
+pipeline on the new book. The new book has new, changed and closed accounts and is in a different order, and the PD
+and EAD panels are built in chunks so that the patched rows have to be put back in chunk order.
+"""
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+NUMBER_OF_LOANS = 2_000
+
+FORECAST_DATASETS = ["pd_forecast", "ead_forecast", "lgd_forecast", "impairment_forecast"]
+
+
+@pytest.fixture
+def sys_config(tmp_path) -> pathlib.Path:
+    """
+    A TRAC system config with storage in a temporary folder, the sample inputs are linked in from the repository.
+    """
+    (tmp_path / "inputs").symlink_to(REPO_ROOT / "data" / "inputs", target_is_directory=True)
+    (tmp_path / "outputs").mkdir()
+
+    sys_config_path = tmp_path / "sys_config.yaml"
+    sys_config_path.write_text(yaml.safe_dump({
+        "storage": {
+            "defaultBucket": "example_data",
+            "defaultFormat": "csv",
+            "buckets": {"example_data": {"protocol": "LOCAL", "properties": {"rootPath": str(tmp_path)}}}
+        }
+    }))
+
+    return sys_config_path
+
+
+def pipeline_config() -> dict:
+    """
+    The sample pipeline config with the PD and EAD panels built in several chunks of loans and months.
+    """
+    config = yaml.safe_load((REPO_ROOT / "config" / "impairment" / "impairment_pipeline.yaml").read_text())["pipeline"]
+
+    config["parameters"]["calculate_pd"].update(loans_per_chunk=300, months_per_chunk=5)
+    config["parameters"]["calculate_ead"].update(loans_per_chunk=700, months_per_chunk=0)
+
+    return config
+
+
+def next_month_book(previous_book: pd.DataFrame, seed: int) -> pd.DataFrame:
+    """
+    The book a month later, some accounts have a new balance or arrears, some have closed, new accounts have been
+    opened and the rows are in a different order.
+    """
+    rng = np.random.default_rng(seed)
+    number_of_loans = len(previous_book)
+
+    new_book = previous_book.copy()
+
+    changed_balance = rng.choice(number_of_loans, number_of_loans // 50, replace=False)
+    new_book.loc[changed_balance, "balance"] = new_book.loc[changed_balance, "balance"] * 0.97
+
+    changed_arrears = rng.choice(number_of_loans, number_of_loans // 100, replace=False)
+    new_book.loc[changed_arrears, "months_in_arrears"] = new_book.loc[changed_arrears, "months_in_arrears"] + 1
+
+    new_book = new_book.drop(index=rng.choice(number_of_loans, number_of_loans // 40, replace=False))
+
+    opened = make_mortgage_book_t0(number_of_loans // 40, seed=seed, first_loan=10 * number_of_loans)
+    new_book = pd.concat([new_book, opened], ignore_index=True)
+
+    return new_book.iloc[rng.permutation(len(new_book))].reset_index(drop=True)
+
+
+def test_incremental_run_matches_full_run(sys_config, tmp_path):
+
+    config = pipeline_config()
+    pipeline = ModelPipeline(IMPAIRMENT_MODELS, sys_config)
+    book_schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+
+    previous_book = make_mortgage_book_t0(NUMBER_OF_LOANS)
+    new_book = next_month_book(previous_book, seed=7)
+
+    pipeline.save_dataset("mortgage_book_t0", to_arrow(previous_book, book_schema), "outputs/previous_book.parquet")
+    pipeline.save_dataset("mortgage_book_t0", to_arrow(new_book, book_schema), "outputs/new_book.parquet")
+
+    previous_outputs = {dataset_name: f"outputs/previous_{dataset_name}.parquet" for dataset_name in FORECAST_DATASETS}
+    pipeline.run(config["parameters"], {**config["inputs"], "mortgage_book_t0": "outputs/previous_book.parquet"}, previous_outputs)
+
+    full = pipeline.run(config["parameters"], {**config["inputs"], "mortgage_book_t0": "outputs/new_book.parquet"},
+                        keep=FORECAST_DATASETS + ["impairment_mi"])
+
+    incremental_config = tmp_path / "incremental.yaml"
+    incremental_config.write_text(yaml.safe_dump({"incremental": {
+        "parameters": config["parameters"],
+        "inputs": {**config["inputs"], "mortgage_book_t0": "outputs/new_book.parquet"},
+        "previous": {"mortgage_book_t0": "outputs/previous_book.parquet", **previous_outputs}
+    }}))
+
+    incremental = run_incremental(incremental_config, sys_config)
+
+    # Every model works each row out from that row's account and month alone, so the forecasts are the same row for row
+    for dataset_name in FORECAST_DATASETS:
+        assert incremental[dataset_name].equals(full[dataset_name]), dataset_name
+
+    # The summary is updated from sums, which are added up in a different order
+    full_mi = full["impairment_mi"].to_pandas()
+    incremental_mi = incremental["impairment_mi"].to_pandas()
+
+    assert list(incremental_mi.columns) == list(full_mi.columns)
+
+    numeric_columns = full_mi.select_dtypes("number").columns
+    other_columns = full_mi.columns.difference(numeric_columns)
+
+    pd.testing.assert_frame_equal(incremental_mi[other_columns], full_mi[other_columns])
+    np.testing.assert_allclose(incremental_mi[numeric_columns].to_numpy(dtype=np.float64),
+                               full_mi[numeric_columns].to_numpy(dtype=np.float64), rtol=1e-12)
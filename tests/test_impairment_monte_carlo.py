@@ -0,0 +1,83 @@
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Load the functions being tested
+from impairment.calculate_impairment_monte_carlo import ECL_HORIZONS, PathModel, make_forecast_arrays, simulate_ecl_paths
+
+"""
+Tests of the Monte Carlo impairment summary. The simulated totals are the same for any number of workers, change only
+by rounding with the number of accounts simulated at a time, and have a mean close to the deterministic total uplifted
+by the correlation between the systematic PD and LGD multipliers.
+"""
+
+NUMBER_OF_ACCOUNTS = 200
+NUMBER_OF_MONTHS = 6
+
+PATH_MODEL = PathModel(
+    pd_systematic_volatility=0.3, pd_idiosyncratic_volatility=0.2,
+    lgd_systematic_volatility=0.15, lgd_idiosyncratic_volatility=0.1,
+    systematic_persistence=0.9)
+
+
+@pytest.fixture(scope="module")
+def impairment_forecast() -> pd.DataFrame:
+    """
+    A small impairment forecast over a few segments. The PDs and LGDs are low enough that no multiplier on any path
+    takes them up to one, so nothing is capped.
+    """
+    rng = np.random.default_rng(5)
+    number_of_rows = NUMBER_OF_ACCOUNTS * NUMBER_OF_MONTHS
+
+    impairment_forecast = pd.DataFrame({
+        "id": np.repeat([f"ID{i:08d}" for i in range(NUMBER_OF_ACCOUNTS)], NUMBER_OF_MONTHS),
+        "date": np.tile(pd.date_range("2021-01-31", periods=NUMBER_OF_MONTHS, freq="M").to_numpy(), NUMBER_OF_ACCOUNTS),
+        "business_line": np.repeat(rng.choice(["Retail", "Commercial"], NUMBER_OF_ACCOUNTS), NUMBER_OF_MONTHS),
+        "mortgage_type": np.repeat(rng.choice(["fixed rate", "variable rate", "capped rate"], NUMBER_OF_ACCOUNTS), NUMBER_OF_MONTHS),
+    })
+
+    for horizon in ECL_HORIZONS:
+        impairment_forecast[f"pd_{horizon}"] = rng.uniform(0.001, 0.02, number_of_rows)
+        impairment_forecast[f"lgd_{horizon}"] = rng.uniform(0.05, 0.3, number_of_rows)
+        impairment_forecast[f"ecl_{horizon}"] = rng.uniform(0.0, 5_000.0, number_of_rows)
+
+    return impairment_forecast
+
+
+@pytest.fixture(scope="module")
+def forecast(impairment_forecast):
+
+    return make_forecast_arrays(impairment_forecast)
+
+
+def test_paths_only_change_by_rounding_with_loans_per_block(forecast):
+
+    one_block = simulate_ecl_paths(forecast, PATH_MODEL, 200, 50, NUMBER_OF_ACCOUNTS, seed=3)
+    small_blocks = simulate_ecl_paths(forecast, PATH_MODEL, 200, 50, 37, seed=3)
+
+    for horizon in ECL_HORIZONS:
+        np.testing.assert_allclose(small_blocks[horizon], one_block[horizon], rtol=1e-12)
+
+
+def test_paths_do_not_depend_on_max_workers(forecast):
+
+    serial = simulate_ecl_paths(forecast, PATH_MODEL, 200, 50, 64, seed=3, max_workers=1)
+    threaded = simulate_ecl_paths(forecast, PATH_MODEL, 200, 50, 64, seed=3, max_workers=3)
+
+    for horizon in ECL_HORIZONS:
+        np.testing.assert_array_equal(threaded[horizon], serial[horizon])
+
+
+def test_mean_total_is_uplifted_by_the_systematic_correlation(impairment_forecast, forecast):
+
+    path_totals = simulate_ecl_paths(forecast, PATH_MODEL, 4000, 500, NUMBER_OF_ACCOUNTS, seed=7)
+
+    # The PD and LGD multipliers share the systematic factor, so the mean of their product is exp(covariance)
+    uplift = np.exp(PATH_MODEL.pd_systematic_volatility * PATH_MODEL.lgd_systematic_volatility)
+
+    for horizon in ECL_HORIZONS:
+        deterministic_total = impairment_forecast[f"ecl_{horizon}"].sum()
+        mean_total = path_totals[horizon].sum(axis=(0, 1)).mean()
+
+        np.testing.assert_allclose(mean_total, deterministic_total * uplift, rtol=0.01)
@@ -0,0 +1,90 @@
+# Load the python libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+# Load the functions being tested
+from utils.utils_keyed_random import KeyedRandomUtils
+from impairment.calculate_lgd import DEFAULT_LGD_MODEL_PARAMETERS, calculate_lgd_forecast
+
+"""
+Tests that the keyed random draws for a row depend only on the seed, the name of the draw and the row's key, so the
+same account and month get the same draws whatever order the rows are in and whatever other rows are drawn with them.
+"""
+
+SEED = 1234
+
+
+def account_months(number_of_accounts: int, number_of_months: int) -> pd.DataFrame:
+    """
+    A panel of account IDs and month end dates, one row per account and month.
+    """
+    dates = pd.date_range("2021-01-31", periods=number_of_months, freq="M")
+
+    return pd.DataFrame({
+        "id": np.repeat([f"ID{i:08d}" for i in range(number_of_accounts)], number_of_months),
+        "date": np.tile(dates.to_numpy(), number_of_accounts)
+    })
+
+
+def draw(draw_type: str, keys: pd.DataFrame) -> np.ndarray:
+
+    key_columns = [keys["id"], keys["date"]]
+
+    if draw_type == "uniform":
+        return KeyedRandomUtils.uniform(SEED, "test", key_columns)
+
+    return KeyedRandomUtils.normal(SEED, "test", key_columns, 0.2, 0.1)
+
+
+@pytest.mark.parametrize("draw_type", ["uniform", "normal"])
+def test_draws_do_not_depend_on_row_order(draw_type):
+
+    keys = account_months(500, 12)
+    shuffle = np.random.default_rng(0).permutation(len(keys))
+
+    draws = draw(draw_type, keys)
+    shuffled_draws = draw(draw_type, keys.iloc[shuffle].reset_index(drop=True))
+
+    np.testing.assert_array_equal(shuffled_draws, draws[shuffle])
+
+
+@pytest.mark.parametrize("draw_type", ["uniform", "normal"])
+def test_draws_do_not_depend_on_other_rows(draw_type):
+
+    keys = account_months(500, 12)
+    subset = np.sort(np.random.default_rng(1).choice(len(keys), len(keys) // 7, replace=False))
+
+    draws = draw(draw_type, keys)
+    subset_draws = draw(draw_type, keys.iloc[subset].reset_index(drop=True))
+
+    np.testing.assert_array_equal(subset_draws, draws[subset])
+
+
+def test_draws_depend_on_seed_and_draw_name():
+
+    keys = account_months(100, 12)
+    key_columns = [keys["id"], keys["date"]]
+
+    draws = KeyedRandomUtils.uniform(SEED, "test", key_columns)
+
+    assert not np.array_equal(draws, KeyedRandomUtils.uniform(SEED + 1, "test", key_columns))
+    assert not np.array_equal(draws, KeyedRandomUtils.uniform(SEED, "other", key_columns))
+    assert ((draws > 0) & (draws < 1)).all()
+
+
+def test_lgd_forecast_does_not_depend_on_row_order():
+
+    ead_forecast = account_months(300, 12)
+
+    rng = np.random.default_rng(2)
+    ead_forecast["dtv"] = rng.uniform(0.1, 1.2, len(ead_forecast))
+    ead_forecast["time_to_default"] = rng.integers(1, 24, len(ead_forecast))
+    ead_forecast["ead"] = rng.uniform(0.0, 500_000.0, len(ead_forecast))
+
+    shuffle = rng.permutation(len(ead_forecast))
+
+    lgd_forecast = calculate_lgd_forecast(ead_forecast, DEFAULT_LGD_MODEL_PARAMETERS, SEED)
+    shuffled_lgd_forecast = calculate_lgd_forecast(ead_forecast.iloc[shuffle].reset_index(drop=True), DEFAULT_LGD_MODEL_PARAMETERS, SEED)
+
+    pd.testing.assert_frame_equal(shuffled_lgd_forecast, lgd_forecast.iloc[shuffle].reset_index(drop=True))
@@ -0,0 +1,147 @@
+# Load the python libraries
+import datetime
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Load the model being tested
+from ppnr import schemas as schemas
+from ppnr.calculate_portfolio_runoff import PortfolioRunoffModel, calculate_portfolio_runoff
+from utils.utils_compact_table import CompactTableUtils
+from utils.utils_schema_registry import SchemaRegistry
+
+"""
+Regression tests for the portfolio runoff. The model now sums each segment once and copies the totals to every
+month, these tests check that it gives the same frame as the original cross join of every account with every month.
+"""
+
+SAMPLE_BOOK = pathlib.Path(__file__).resolve().parent.parent / "data" / "inputs" / "ppnr" / "mortgage_book_t0.csv"
+
+FIRST_FORECAST_MONTH = datetime.date(2021, 1, 1)
+LAST_FORECAST_MONTH = datetime.date(2022, 12, 1)
+
+
+def baseline_portfolio_runoff(mortgage_book_t0, first_forecast_month, last_forecast_month):
+    """
+    The portfolio runoff as it was calculated before it was reworked, every account is joined to every month and the
+    panel is summed by segment and month.
+    """
+    first_forecast_month = (pd.Timestamp(first_forecast_month) + pd.offsets.MonthEnd(0)).date()
+    last_forecast_month = (pd.Timestamp(last_forecast_month) + pd.offsets.MonthEnd(0)).date()
+
+    date_list = pd.date_range(first_forecast_month, last_forecast_month, freq="M", inclusive="both", name="date")
+    dates = date_list.to_series(name="date").to_frame("date").reset_index(drop=True)
+
+    portfolio_runoff = mortgage_book_t0.drop("date", axis=1).join(dates, how="cross")
+
+    group_by_list = ['business_line', "mortgage_type", "date"]
+
+    portfolio_runoff = (portfolio_runoff.groupby(group_by_list, as_index=False)
+                        .agg({'balance': 'sum', "monthly_repayment": "sum"})
+                        .rename(columns={'balance': 'prepayment_balance', 'monthly_repayment': 'repayment_balance'}))
+
+    portfolio_runoff["month_index"] = 1 + (portfolio_runoff["date"].dt.year - first_forecast_month.year) * 12 + \
+        portfolio_runoff["date"].dt.month - first_forecast_month.month
+
+    portfolio_runoff["prepayment_balance"] = portfolio_runoff["prepayment_balance"] - portfolio_runoff[
+        "month_index"] * portfolio_runoff["repayment_balance"] * 0.02
+
+    portfolio_runoff["runoff_balance"] = portfolio_runoff["prepayment_balance"] + portfolio_runoff["repayment_balance"]
+
+    return portfolio_runoff[['business_line', 'mortgage_type', 'date', 'runoff_balance', 'prepayment_balance', 'repayment_balance']]
+
+
+def random_book(number_of_accounts: int, seed: int) -> pd.DataFrame:
+    """
+    A random mortgage book spread over several business lines and mortgage types.
+    """
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        "id": [f"ID{i:08d}" for i in range(number_of_accounts)],
+        "date": "2020-12-31",
+        "business_line": rng.choice(["Retail", "Private Banking", "Commercial"], number_of_accounts),
+        "mortgage_type": rng.choice(["fixed rate", "variable rate", "capped rate", "tracker"], number_of_accounts),
+        "balance": rng.integers(10_000, 1_000_000, number_of_accounts),
+        "monthly_repayment": rng.uniform(100.0, 5_000.0, number_of_accounts),
+    })
+
+
+def compact_book(mortgage_book_t0: pd.DataFrame) -> pd.DataFrame:
+    """
+    The book as the model gets it from get_compact_table, only the columns it declares with the segments as
+    categoricals.
+    """
+    schema = SchemaRegistry.load_schema(schemas, "mortgage_book_t0_schema.csv")
+    columns = PortfolioRunoffModel().define_input_columns()["mortgage_book_t0"]
+
+    mortgage_book_t0 = mortgage_book_t0[columns].copy()
+    dtype_plan = CompactTableUtils.get_dtype_plan(schema, mortgage_book_t0)
+
+    assert dtype_plan["business_line"] == "category" and dtype_plan["mortgage_type"] == "category"
+
+    return CompactTableUtils.apply_dtype_plan(mortgage_book_t0, dtype_plan)
+
+
+def assert_same_runoff(mortgage_book_t0, model_input=None):
+    """
+    Check the model gives the baseline runoff of a book, the model can be given the book with different column types.
+    """
+    model_input = mortgage_book_t0 if model_input is None else model_input
+
+    expected = baseline_portfolio_runoff(mortgage_book_t0, FIRST_FORECAST_MONTH, LAST_FORECAST_MONTH)
+    actual = calculate_portfolio_runoff(model_input, FIRST_FORECAST_MONTH, LAST_FORECAST_MONTH)
+
+    # Segments given as categoricals come out as categoricals, the baseline has them as strings
+    actual = actual.astype({column: object for column, dtype in actual.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_portfolio_runoff_matches_baseline_on_sample_book():
+
+    assert_same_runoff(pd.read_csv(SAMPLE_BOOK))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_portfolio_runoff_matches_baseline_on_random_book(seed):
+
+    mortgage_book_t0 = random_book(5_000, seed)
+
+    assert mortgage_book_t0.groupby(["business_line", "mortgage_type"]).ngroups > 1
+
+    assert_same_runoff(mortgage_book_t0)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_portfolio_runoff_matches_baseline_on_compact_book(seed):
+
+    # The TRAC runtime gives FLOAT fields as floats
+    mortgage_book_t0 = random_book(5_000, seed).astype({"balance": "float64"})
+
+    assert_same_runoff(mortgage_book_t0, compact_book(mortgage_book_t0))
+
+
+def test_portfolio_runoff_matches_baseline_on_compact_sample_book():
+
+    mortgage_book_t0 = pd.read_csv(SAMPLE_BOOK)
+
+    assert_same_runoff(mortgage_book_t0, compact_book(mortgage_book_t0))
+
+
+def test_portfolio_runoff_drops_empty_segments():
+
+    mortgage_book_t0 = random_book(5_000, 3).astype({"balance": "float64"})
+    model_input = compact_book(mortgage_book_t0)
+
+    # Leave a business line and a mortgage type in the categories with no accounts in them
+    has_accounts = (mortgage_book_t0["business_line"] != "Commercial") & (mortgage_book_t0["mortgage_type"] != "tracker")
+    mortgage_book_t0 = mortgage_book_t0[has_accounts]
+    model_input = model_input[has_accounts]
+
+    assert "Commercial" in model_input["business_line"].cat.categories
+    assert "tracker" in model_input["mortgage_type"].cat.categories
+
+    assert_same_runoff(mortgage_book_t0, model_input)